@@ -1,214 +1,704 @@
 """
 Anonymizer Service - API Flask pour anonymiser les PII et secrets
-Architecture: Tout est géré par Scrubadub (Détecteurs natifs + Détecteurs dynamiques depuis patterns.json)
+Architecture: Tout est géré par Scrubadub (Détecteurs natifs + PatternSet compilé depuis patterns.json)
+La construction du scrubber et l'analyse d'un texte sont dans engine.py (bibliothèque
+partagée avec le mode embarqué du gateway).
 """
+import hmac
 import logging
 import os
 import json
-import re
-import nltk
-from flask import Flask, request, jsonify
-import scrubadub
-from scrubadub.detectors import RegexDetector, TextBlobNameDetector
-from scrubadub.filth import Filth
+import multiprocessing
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+
+try:
+    import logs
+    import tracing
+except ImportError:  # lancement hors de l'image (python app.py): modules partagés dans ../common
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+    import logs
+    import tracing
+import chunked
+import engine
+import metrics
+import serialization
+from pseudonyms import Pseudonymizer, PseudonymVault
+from redos import PatternGuard
+from tiers import DetectionBlocked, NlpPolicy, TierStats, scan
 
 app = Flask(__name__)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logs écrits par un thread d'arrière-plan (LOG_*, cf. logs.py)
+logs.configure("anonymizer")
 logger = logging.getLogger(__name__)
 
-# Configurer NLTK pour TextBlob
-if os.path.exists('/app/nltk_data'):
-    nltk.data.path.append('/app/nltk_data')
-
 
 # Chargeur de patterns
 PATTERNS_FILE = os.getenv("PATTERNS_FILE", "patterns.json")
 SENSITIVE_PATTERNS = {}
+# Version (hash) du pattern set chargé: permet aux clients d'invalider leurs caches
+PATTERNS_VERSION = None
+PATTERNS_LOADED_AT = None
+RELOAD_COUNT = 0
+
+# Hot reload: intervalle de surveillance de PATTERNS_FILE (0 = désactivé)
+PATTERNS_WATCH_INTERVAL = float(os.getenv("PATTERNS_WATCH_INTERVAL", "2"))
+reload_lock = threading.Lock()
+_patterns_fingerprint = None
+
+# Garde ReDoS: sonde les nouveaux patterns au chargement (PATTERN_REDOS_POLICY=reject|flag|off)
+pattern_guard = PatternGuard.from_env()
+
+# Nombre max de textes par appel /anonymize/batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "512"))
+
+# Mode chunked (corps text/plain ou "chunked": true): fenêtres et chevauchement en caractères
+CHUNKED_WINDOW_CHARS = int(os.getenv("CHUNKED_WINDOW_CHARS", str(chunked.WINDOW_CHARS)))
+CHUNKED_OVERLAP_CHARS = int(os.getenv("CHUNKED_OVERLAP_CHARS", str(chunked.OVERLAP_CHARS)))
+CHUNKED_MAX_WINDOW_CHARS = int(os.getenv("CHUNKED_MAX_WINDOW_CHARS", str(4 * CHUNKED_WINDOW_CHARS)))
+
+# Pool de processus optionnel pour le scrubbing (CPU-bound) derrière un front multi-threads
+SCRUB_PROCESSES = int(os.getenv("SCRUB_PROCESSES", "0"))
+scrub_pool = None
+# Instantané (version, patterns) transmis avec chaque tâche du pool
+_pool_patterns = None
+
+# Paliers de détection: regex toujours, NLP selon la politique du profil (DETECTION_PROFILE)
+DETECTION_POLICY = NlpPolicy.from_env()
+tier_stats = TierStats()
+
+# Pseudonymes stables par scope de conversation (PSEUDONYM_SECRET) et coffre de réhydratation
+PSEUDONYMIZER = Pseudonymizer.from_env()
+pseudonym_vault = PseudonymVault.from_env()
+# /rehydrate rend les valeurs d'origine: désactivé sans REHYDRATE_TOKEN, sinon réservé aux
+# appels qui présentent "Authorization: Bearer <REHYDRATE_TOKEN>"
+REHYDRATE_TOKEN = os.getenv("REHYDRATE_TOKEN", "")
+
+# Texte de chauffe: charge les lexiques TextBlob/NLTK avant le fork des workers
+WARMUP_TEXT = "John Smith (john@example.com) sent the report to Marie in Paris."
 
 # Global scrubber instance
 scrubber = None
 
+# Démarrage: durées mesurées et état de chauffe (/ready ne répond 200 qu'après un scrub de chauffe réussi)
+STARTUP = {"scrubber_ms": None, "warmup_ms": None, "ready": False, "ready_at": None}
 
-def create_dynamic_detector(name, pattern):
-    """Crée dynamiquement une classe Detector et Filth pour Scrubadub."""
-    # 1. Créer une classe Filth spécifique (ex: 'ApiKeyFilth')
-    # Le 'type' définira le placeholder {{TYPE}}
-    filth_cls = type(
-        f"{name.capitalize()}Filth",
-        (Filth,),
-        {'type': name}
-    )
 
-    # 2. Créer une classe Detector (ex: 'ApiKeyDetector')
-    try:
-        compiled_regex = re.compile(pattern)
-    except re.error as e:
-        logger.error(f"Invalid regex for {name}: {e}")
+def init_scrubber():
+    """
+    (Re)construit le scrubber (détecteurs par défaut + PatternSet) sans toucher à celui
+    en service, puis le substitue atomiquement. Seuls les patterns modifiés sont recompilés.
+    """
+    global scrubber, SENSITIVE_PATTERNS, PATTERNS_VERSION, PATTERNS_LOADED_AT, RELOAD_COUNT, _patterns_fingerprint
+    global _pool_patterns
+
+    with reload_lock:
+        started = time.perf_counter()
+        fingerprint = engine.file_fingerprint(PATTERNS_FILE)
+
+        try:
+            new_scrubber, new_patterns, flagged = engine.build_scrubber(
+                PATTERNS_FILE, pattern_guard, SENSITIVE_PATTERNS, scrubber
+            )
+        except Exception as e:
+            logger.error(f"❌ Failed to load patterns: {e}")
+            metrics.observe_reload("error", time.perf_counter() - started)
+            return False, str(e)
+
+        _patterns_fingerprint = fingerprint
+        pattern_guard.flagged = flagged
+        version = engine.compute_patterns_version(new_patterns, list(new_scrubber._detectors.keys()))
+        if scrubber is not None and version == PATTERNS_VERSION:
+            metrics.observe_reload("unchanged", time.perf_counter() - started)
+            return True, "Patterns unchanged"
+
+        # Substitution atomique: les requêtes en cours gardent leur instantané de l'ancien scrubber
+        scrubber = new_scrubber
+        SENSITIVE_PATTERNS = new_patterns
+        PATTERNS_VERSION = version
+        _pool_patterns = (version, new_patterns)
+        PATTERNS_LOADED_AT = time.time()
+        RELOAD_COUNT += 1
+        logger.info(f"🔄 Pattern set version {version} active")
+        metrics.observe_reload("reloaded", time.perf_counter() - started)
+
+    return True, "Scrubber initialized successfully"
+
+
+def reload_in_background():
+    """Reconstruit le scrubber dans un thread: le worker continue de servir pendant le build."""
+    thread = threading.Thread(target=init_scrubber, name="patterns-reload", daemon=True)
+    thread.start()
+    return thread
+
+
+def check_patterns_file():
+    """Recharge si PATTERNS_FILE a changé depuis le dernier chargement. Retourne True si rechargé."""
+    if engine.file_fingerprint(PATTERNS_FILE) == _patterns_fingerprint:
+        return False
+    logger.info(f"👀 {PATTERNS_FILE} changed, reloading patterns")
+    init_scrubber()
+    return True
+
+
+def start_patterns_watcher(interval=None):
+    """
+    Thread de surveillance de PATTERNS_FILE (un par worker). Tous les workers et réplicas
+    qui montent le même fichier convergent vers la même version en moins d'un intervalle.
+    """
+    interval = PATTERNS_WATCH_INTERVAL if interval is None else interval
+    if interval <= 0:
         return None
 
-    detector_cls = type(
-        f"{name.capitalize()}Detector",
-        (RegexDetector,),
-        {
-            'name': name,
-            'regex': compiled_regex,
-            'filth_cls': filth_cls
-        }
-    )
-    return detector_cls
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                check_patterns_file()
+            except Exception as e:
+                logger.error(f"❌ Patterns watcher error: {e}")
 
+    thread = threading.Thread(target=watch, name="patterns-watcher", daemon=True)
+    thread.start()
+    return thread
 
-def init_scrubber():
-    """Initialise le scrubber avec les détecteurs par défaut + dynamiques."""
-    global scrubber, SENSITIVE_PATTERNS
 
-    # Nouveau scrubber propre
-    new_scrubber = scrubadub.Scrubber()
+def current_pattern_set(active=None):
+    """PatternSet du scrubber donné (ou de celui en service)."""
+    return engine.current_pattern_set(active or scrubber)
+
 
-    # Ajouter TextBlob pour les noms (si dispo)
+def detector_names(active=None):
+    """Noms des détecteurs actifs (le PatternSet est détaillé pattern par pattern)."""
+    return engine.detector_names(active or scrubber)
+
+
+def warm_up():
+    """
+    Scrub de chauffe: les données chargées à la demande le sont une fois (avant le fork).
+    Le service n'est prêt (/ready) qu'après une chauffe réussie.
+    """
+    started = time.perf_counter()
     try:
-        new_scrubber.add_detector(TextBlobNameDetector)
-        logger.info("✅ Added TextBlobNameDetector")
+        scrub(WARMUP_TEXT)
     except Exception as e:
-        logger.warning(f"⚠️ Could not add TextBlobNameDetector: {e}")
-
-    # Charger patterns.json
+        logger.warning(f"⚠️ Warm-up failed: {e}")
+        return False
+    STARTUP["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    STARTUP["ready"] = True
+    STARTUP["ready_at"] = time.time()
+    logger.info(f"✅ Scrubber warmed up ({STARTUP['warmup_ms']}ms)")
+    return True
+
+
+def _noop(_):
+    return None
+
+
+def start_scrub_pool(processes=None):
+    """
+    Démarre le pool de processus de scrubbing (fork: les détecteurs déjà chargés
+    sont partagés en copy-on-write). Appelé dans chaque worker gunicorn (post_fork), seul
+    point où le worker n'a encore qu'un thread: le pool n'est jamais reforké ensuite,
+    ses processus suivent les reloads (voir _run_pooled).
+    """
+    global scrub_pool
+    processes = SCRUB_PROCESSES if processes is None else processes
+    if processes <= 0:
+        return None
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork'))
+    list(pool.map(_noop, range(processes)))  # force le fork immédiat de tous les processus
+    scrub_pool = pool
+    logger.info(f"✅ Scrub process pool started ({processes} processes)")
+    return pool
+
+
+def _sync_pool_scrubber(version, patterns):
+    """
+    Processus du pool: reconstruit le scrubber avec les patterns du worker (déjà validés
+    par sa garde ReDoS, pas de nouvelle sonde ici). Le processus n'exécute qu'une tâche à la fois.
+    """
+    global scrubber, SENSITIVE_PATTERNS, PATTERNS_VERSION
+    scrubber, SENSITIVE_PATTERNS, _ = engine.build_scrubber(
+        PATTERNS_FILE, PatternGuard("off"), SENSITIVE_PATTERNS, scrubber, loaded=patterns
+    )
+    PATTERNS_VERSION = version
+    logger.info(f"🔄 Scrub process {os.getpid()} switched to pattern set version {version}")
+
+
+def _run_pooled(snapshot, func, text):
+    """Tâche du pool: aligne d'abord le scrubber du processus sur la version du worker."""
+    version, patterns = snapshot
+    if version != PATTERNS_VERSION:
+        _sync_pool_scrubber(version, patterns)
+    return func(text)
+
+
+def stop_scrub_pool():
+    global scrub_pool
+    if scrub_pool is not None:
+        scrub_pool.shutdown(wait=True)
+        scrub_pool = None
+
+
+def submit_scrub(func, text):
+    """Exécute func(text) dans le pool de processus s'il existe, sinon inline. Retourne un Future."""
+    pool = scrub_pool
+    while pool is not None:
+        try:
+            return pool.submit(_run_pooled, _pool_patterns, func, text)
+        except RuntimeError:
+            # Pool arrêté entre la lecture et la soumission: nouvelle tentative sur le pool courant
+            if scrub_pool is pool:
+                raise
+            pool = scrub_pool
+    future = Future()
     try:
-        if os.path.exists(PATTERNS_FILE):
-            with open(PATTERNS_FILE, 'r') as f:
-                new_patterns = json.load(f)
-
-            if isinstance(new_patterns, dict):
-                SENSITIVE_PATTERNS = new_patterns
-                count = 0
-                for name, pattern in new_patterns.items():
-                    # Check for collision with default detectors (e.g. 'email', 'url')
-                    # We want our custom patterns to take precedence (overwrite)
-                    try:
-                        new_scrubber.remove_detector(name)
-                        logger.info(f"ℹ️ Overwriting default detector: {name}")
-                    except KeyError:
-                        pass  # Detector didn't exist, safe to add
-
-                    detector_cls = create_dynamic_detector(name, pattern)
-                    if detector_cls:
-                        try:
-                            new_scrubber.add_detector(detector_cls)
-                            count += 1
-                        except Exception as e:
-                            logger.error(f"❌ Failed to add detector {name}: {e}")
-                logger.info(f"✅ Loaded {count} dynamic patterns from {PATTERNS_FILE}")
-            else:
-                logger.error("patterns.json is not a dictionary")
+        future.set_result(func(text))
     except Exception as e:
-        logger.error(f"❌ Failed to load patterns: {e}")
-        return False, str(e)
-
-    scrubber = new_scrubber
-    return True, "Scrubber initialized successfully"
+        future.set_exception(e)
+    return future
 
 
 # Initialisation au démarrage
-init_scrubber()
+_init_started = time.perf_counter()
+_init_ok, _init_msg = init_scrubber()
+if scrubber is None:
+    # Aucun scrubber en service: le processus ne doit pas démarrer (ni annoncer un succès)
+    raise RuntimeError(f"Scrubber initialization failed: {_init_msg}")
+STARTUP["scrubber_ms"] = round((time.perf_counter() - _init_started) * 1000, 1)
+logger.info(f"✅ Scrubber built in {STARTUP['scrubber_ms']}ms")
 
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
-    detectors = list(scrubber._detectors.keys()) if scrubber else []
+    """Health check endpoint (503 tant qu'aucun scrubber n'est en service)"""
+    detectors = detector_names()
     return jsonify({
-        "status": "healthy",
+        "status": "healthy" if scrubber is not None else "unhealthy",
         "engine": "full-scrubadub",
+        "patterns_version": PATTERNS_VERSION,
+        "patterns_loaded_at": PATTERNS_LOADED_AT,
+        "reloads": RELOAD_COUNT,
         "detectors_count": len(detectors),
-        "detectors": detectors
-    })
+        "detectors": detectors,
+        "detection": {**DETECTION_POLICY.describe(), "tiers": tier_stats.snapshot()},
+        "redos": pattern_guard.describe(),
+        "pseudonyms": {
+            **PSEUDONYMIZER.describe(),
+            "vault": pseudonym_vault.stats() if pseudonym_vault else None
+        },
+        "logs": logs.stats(),
+        "startup": STARTUP
+    }), 200 if scrubber is not None else 503
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness: 200 une fois le scrub de chauffe réussi (gunicorn le fait dans le master avant
+    le fork), 503 sinon. Un worker pas encore chaud retente la chauffe à chaque sonde.
+    """
+    if not STARTUP["ready"] and not warm_up():
+        return jsonify({"status": "warming_up", "patterns_version": PATTERNS_VERSION}), 503
+    return jsonify({"status": "ready", "patterns_version": PATTERNS_VERSION, "startup": STARTUP})
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métriques Prometheus (interne: non exposé par nginx)."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
 
 
 @app.route('/management/reload', methods=['POST'])
 def reload_patterns():
-    """Recharge tout le scrubber."""
+    """
+    Recharge le scrubber et répond une fois le rechargement terminé (200, 400 en cas d'échec).
+    ?async=true le lance en arrière-plan (202). Les autres workers/réplicas convergent via
+    la surveillance de PATTERNS_FILE.
+    """
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        reload_in_background()
+        return jsonify({"status": "accepted", "patterns_version": PATTERNS_VERSION}), 202
+
     success, msg = init_scrubber()
     if success:
-        return jsonify({"status": "success", "message": msg, "detectors": list(scrubber._detectors.keys())})
+        return jsonify({
+            "status": "success",
+            "message": msg,
+            "patterns_version": PATTERNS_VERSION,
+            "detectors": detector_names()
+        })
     else:
         return jsonify({"status": "error", "message": msg}), 400
 
 
-@app.route('/anonymize', methods=['POST'])
-def anonymize():
-    """Anonymise le texte via Scrubadub."""
-    data = request.get_json()
-    if not data or 'text' not in data:
-        return jsonify({"error": "Missing 'text' field"}), 400
+def scrub(text, active=None):
+    """
+    Passe unique des détecteurs sur le texte, palier par palier (voir tiers.py).
+    Retourne (texte anonymisé, Filth triés et fusionnés, paliers). Lève DetectionBlocked
+    si la politique l'impose.
+    """
+    active = active or scrubber
+    filth_list, tiers = scan(active, text, DETECTION_POLICY)
+    return engine.replace_filth(text, filth_list), filth_list, tiers
+
+
+def anonymize_result(original_text, scope=None):
+    """
+    Anonymise un texte et construit le payload de réponse (détections + compteurs).
+    Avec un scope: pseudonymes stables, et "pseudonyms" à verser au coffre (voir record_pseudonyms).
+    """
+    # Instantané: un reload concurrent ne change pas le scrubber en cours de route
+    return engine.anonymize_result(scrubber, original_text, DETECTION_POLICY, PSEUDONYMIZER, scope)
+
+
+def detect_result(text):
+    """Détections seules (sans remplacement)."""
+    return engine.detect_result(scrubber, text, DETECTION_POLICY)
+
+
+def window_result(text):
+    """Scan d'une fenêtre du mode chunked (détections sérialisées, avec leur placeholder)."""
+    return engine.window_result(scrubber, text, DETECTION_POLICY)
+
+
+def ndjson(payload):
+    return json.dumps(payload) + "\n"
+
+
+def stream_chunked(pieces, mode):
+    """
+    Réponse NDJSON du mode chunked, produite au fil des fenêtres:
+    - anonymize: une ligne {"anonymized": ...} par segment
+    - detect: une ligne {"detection": ...} par détection (positions absolues)
+    puis une ligne de synthèse {"done": true, ...}. Sans elle, le flux est incomplet
+    (une ligne {"error": ...} signale l'échec, les segments déjà émis restent anonymisés).
+    """
+    pattern_set = current_pattern_set()
+    custom_detectors = set(pattern_set.names if pattern_set else [])
+    tiers = {}
+
+    def scan_window(text):
+        detections, window_tiers = submit_scrub(window_result, text).result()
+        chunked.merge_tiers(tiers, window_tiers)
+        metrics.observe_scan(text, window_tiers)
+        return detections
+
+    def generate():
+        original_length = anonymized_length = count = secrets_count = 0
+        try:
+            windows = chunked.scan_windows(
+                pieces, scan_window, CHUNKED_WINDOW_CHARS, CHUNKED_OVERLAP_CHARS, CHUNKED_MAX_WINDOW_CHARS
+            )
+            for offset, segment, detections in windows:
+                original_length += len(segment)
+                count += len(detections)
+                metrics.observe_detections(detections)
+                secrets_count += sum(1 for d in detections if d['detector'] in custom_detectors)
+                if mode == 'anonymize':
+                    anonymized = chunked.replace_detections(segment, detections)
+                    anonymized_length += len(anonymized)
+                    yield ndjson({"anonymized": anonymized})
+                else:
+                    for detection in detections:
+                        del detection['replacement']
+                        detection['start'] += offset
+                        detection['end'] += offset
+                        yield ndjson({"detection": detection})
+        except DetectionBlocked as e:
+            yield ndjson(blocked_response(e))
+            return
+        except Exception as e:
+            logger.error(f"Chunked scrubbing failed: {e}")
+            yield ndjson({"error": str(e)})
+            return
+
+        tier_stats.record(tiers)
+        trace_tiers(tiers)
+        if mode == 'anonymize':
+            summary = {
+                "original_length": original_length,
+                "anonymized_length": anonymized_length,
+                "detections_count": count,
+                "pii_count": count - secrets_count,
+                "secrets_count": secrets_count
+            }
+        else:
+            summary = {"count": count}
+        yield ndjson({"done": True, **summary, "tiers": tiers})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def chunked_request(mode):
+    """
+    Mode chunked si le corps est du texte brut (lu en flux, mémoire bornée) ou si le JSON
+    demande "chunked": true. Retourne la réponse en flux, sinon None.
+    """
+    if request.mimetype == 'text/plain':
+        return stream_chunked(chunked.iter_stream(request.stream), mode)
+    data = request.get_json(silent=True)
+    if data and data.get('chunked') and isinstance(data.get('text'), str):
+        return stream_chunked(chunked.iter_string(data['text']), mode)
+    return None
+
+
+def record_result(text, result):
+    """Statistiques des paliers, métriques et trace d'un texte analysé."""
+    tier_stats.record(result['tiers'])
+    metrics.observe_scan(text, result['tiers'])
+    metrics.observe_detections(result['detections'])
+    if logs.summary is not None:
+        by_type = Counter(f"detected_{detection['type']}" for detection in result['detections'])
+        logs.count(texts=1, chars=len(text), detections=len(result['detections']), **by_type)
+    trace_tiers(result['tiers'])
+
+
+def record_pseudonyms(scope, result):
+    """Verse les pseudonymes d'un résultat au coffre (ils ne font pas partie de la réponse)."""
+    mapping = result.pop('pseudonyms', None)
+    if mapping and pseudonym_vault is not None:
+        pseudonym_vault.record(scope, mapping)
+
+
+def trace_tiers(tiers):
+    """Durées par palier et par détecteur dans la trace de la requête (cumulées sur un batch)."""
+    trace = tracing.current()
+    if trace is None:
+        return
+    for tier, info in tiers.items():
+        if info.get('ran'):
+            trace.timing(f"tier.{tier}", info.get('ms', 0.0))
+        for detector, ms in info.get('detectors', {}).items():
+            trace.timing(f"detector.{detector}", ms)
+
+
+TRACED_ENDPOINTS = {'anonymize', 'anonymize_batch', 'detect'}
+
+
+@app.before_request
+def start_trace():
+    if request.endpoint in TRACED_ENDPOINTS:
+        g.trace = tracing.Trace(request.endpoint, request.headers.get('traceparent'), service='anonymizer')
+
+
+@app.after_request
+def finish_trace_on_close(response):
+    # En mode chunked, les en-têtes partent avant le scan: les durées ne sont que dans les spans
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Trace-Id'] = trace.trace_id
+        response.call_on_close(lambda: trace.finish(status=response.status_code))
+    return response
+
+
+@app.teardown_request
+def finish_trace(exc=None):
+    trace = g.get('trace')
+    if trace is not None and exc is not None:
+        trace.finish(error=str(exc))
+
+
+def read_body():
+    """Corps de la requête: JSON, ou MessagePack (Content-Type: application/msgpack)."""
+    with tracing.span('parse'):
+        if serialization.is_msgpack(request.mimetype):
+            return serialization.decode_msgpack(request.get_data())
+        return request.get_json(silent=True)
+
+
+def requested_scope(data):
+    """Scope de pseudonymisation ("scope" du corps), None sans pseudonymes. Lève ValueError si invalide."""
+    scope = data.get('scope')
+    if scope is None or scope == "":
+        return None
+    if not isinstance(scope, str):
+        raise ValueError("'scope' must be a string")
+    return scope
+
+
+def requested_fields(data):
+    """Champs de résultat demandés ("fields" du corps ou ?fields=). Lève ValueError si inconnus."""
+    value = data.get('fields') if isinstance(data, dict) else None
+    return serialization.parse_fields(value if value is not None else request.args.get('fields'))
 
-    original_text = data['text']
 
-    # Scrubbing
+def respond(payload, status=200):
+    """Réponse en MessagePack si le client le préfère (Accept), en JSON sinon."""
+    with tracing.span('serialize'):
+        if serialization.accepts_msgpack(request.accept_mimetypes):
+            return Response(serialization.encode_msgpack(payload), status=status,
+                            mimetype=serialization.MSGPACK_MIMETYPE)
+        return jsonify(payload), status
+
+
+def blocked_response(error):
+    """Fail closed: la politique de détection n'a pas pu être respectée, le texte est bloqué."""
+    tier_stats.record_blocked(error)
+    metrics.observe_blocked(error)
+    logs.count(blocked=1)
+    logger.warning(f"⛔ {error}")
+    return {"error": str(error), "blocked": True, "tier": error.tier, "reason": error.reason}
+
+
+@app.route('/anonymize', methods=['POST'])
+def anonymize():
+    """Anonymise le texte via Scrubadub (en flux NDJSON pour le mode chunked)."""
+    response = chunked_request('anonymize')
+    if response is not None:
+        return response
+
+    data = read_body()
+    if not isinstance(data, dict) or 'text' not in data:
+        return respond({"error": "Missing 'text' field"}, 400)
     try:
-        anonymized_text = scrubber.clean(original_text)
-
-        # Récupérer les détails (Filth)
-        detections = []
-        for filth in scrubber.iter_filth(original_text):
-            detections.append({
-                'type': filth.type,  # Le type défini dans nos classes dynamiques ou natif (ex: 'name', 'email')
-                'text': filth.text,
-                'start': filth.beg,
-                'end': filth.end,
-                'detector': filth.detector_name
-            })
+        fields = requested_fields(data)
+        scope = requested_scope(data)
+    except ValueError as e:
+        return respond({"error": str(e)}, 400)
 
+    # Scrubbing (un seul passage des détecteurs)
+    try:
+        result = submit_scrub(partial(anonymize_result, scope=scope), data['text']).result()
+    except DetectionBlocked as e:
+        return respond(blocked_response(e), 503)
     except Exception as e:
         logger.error(f"Scrubbing failed: {e}")
-        return jsonify({"error": str(e)}), 500
-
-    # Legacy counts for Gateway compatibility
-    # Secrets = nos patterns custom (dans patterns.json)
-    # PII = le reste (TextBlob, etc.)
-    custom_detectors = set(SENSITIVE_PATTERNS.keys())
-    secrets_count = sum(1 for d in detections if d['detector'] in custom_detectors)
-    pii_count = len(detections) - secrets_count
-
-    return jsonify({
-        "anonymized": anonymized_text,
-        "original_length": len(original_text),
-        "anonymized_length": len(anonymized_text),
-        "detections_count": len(detections),
-        "detections": detections,
-        "pii_count": pii_count,
-        "secrets_count": secrets_count
+        return respond({"error": str(e)}, 500)
+
+    record_pseudonyms(scope, result)
+    record_result(data['text'], result)
+    return respond(serialization.project(result, fields))
+
+
+@app.route('/anonymize/batch', methods=['POST'])
+def anonymize_batch():
+    """
+    Anonymise une liste de textes (ex: tous les messages d'une conversation) en un seul appel.
+    Les résultats sont retournés dans l'ordre; un échec est signalé par item via 'error'.
+    """
+    data = read_body()
+    if not isinstance(data, dict) or not isinstance(data.get('texts'), list):
+        return respond({"error": "Missing 'texts' list"}, 400)
+    try:
+        fields = requested_fields(data)
+        scope = requested_scope(data)
+    except ValueError as e:
+        return respond({"error": str(e)}, 400)
+
+    texts = data['texts']
+    if len(texts) > BATCH_MAX_ITEMS:
+        return respond({"error": f"Too many texts ({len(texts)} > {BATCH_MAX_ITEMS})"}, 413)
+
+    # Avec un pool de processus, les textes du batch sont traités en parallèle
+    scrub_text = partial(anonymize_result, scope=scope)
+    futures = [submit_scrub(scrub_text, text) if isinstance(text, str) else None for text in texts]
+
+    results = []
+    errors = 0
+    for i, future in enumerate(futures):
+        if future is None:
+            results.append({"error": "Item is not a string"})
+            errors += 1
+            continue
+        try:
+            result = future.result()
+        except DetectionBlocked as e:
+            results.append(blocked_response(e))
+            errors += 1
+            continue
+        except Exception as e:
+            logger.error(f"Scrubbing failed for batch item {i}: {e}")
+            results.append({"error": str(e)})
+            errors += 1
+            continue
+        record_pseudonyms(scope, result)
+        record_result(texts[i], result)
+        results.append(serialization.project(result, fields))
+
+    return respond({
+        "results": results,
+        "count": len(results),
+        "errors_count": errors,
+        "patterns_version": PATTERNS_VERSION
     })
 
 
 @app.route('/detect', methods=['POST'])
 def detect():
-    """Détecte sans remplacer."""
-    data = request.get_json()
-    if not data or 'text' not in data:
-        return jsonify({"error": "Missing 'text' field"}), 400
+    """Détecte sans remplacer (en flux NDJSON pour le mode chunked)."""
+    response = chunked_request('detect')
+    if response is not None:
+        return response
 
-    text = data['text']
-    detections = []
+    data = read_body()
+    if not isinstance(data, dict) or 'text' not in data:
+        return respond({"error": "Missing 'text' field"}, 400)
 
     try:
-        for filth in scrubber.iter_filth(text):
-            detections.append({
-                'type': filth.type,
-                'text': filth.text,
-                'start': filth.beg,
-                'end': filth.end,
-                'detector': filth.detector_name
-            })
+        result = submit_scrub(detect_result, data['text']).result()
+    except DetectionBlocked as e:
+        return respond(blocked_response(e), 503)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return respond({"error": str(e)}, 500)
+
+    record_result(data['text'], result)
+    return respond(result)
+
+
+@app.route('/rehydrate', methods=['POST'])
+def rehydrate():
+    """
+    Remplace les pseudonymes d'un scope par les valeurs d'origine ("text" ou liste "texts",
+    ex: réponse du LLM). Les placeholders inconnus ou expirés du coffre sont laissés tels quels.
+    Désactivé (404) sans REHYDRATE_TOKEN, 401 sans le jeton.
+    """
+    if not REHYDRATE_TOKEN:
+        return respond({"error": "Rehydration disabled (REHYDRATE_TOKEN not set)"}, 404)
+    authorization = request.headers.get('Authorization', '').encode('utf-8')
+    if not hmac.compare_digest(authorization, f"Bearer {REHYDRATE_TOKEN}".encode('utf-8')):
+        return respond({"error": "Unauthorized"}, 401)
+    data = read_body()
+    if not isinstance(data, dict) or not isinstance(data.get('scope'), str) or not data['scope']:
+        return respond({"error": "Missing 'scope' field"}, 400)
+    if pseudonym_vault is None:
+        return respond({"error": "Pseudonym vault disabled (PSEUDONYM_VAULT_BACKEND=none)"}, 404)
+
+    if isinstance(data.get('texts'), list):
+        texts = data['texts']
+    elif isinstance(data.get('text'), str):
+        texts = [data['text']]
+    else:
+        return respond({"error": "Missing 'text' field or 'texts' list"}, 400)
+    if len(texts) > BATCH_MAX_ITEMS:
+        return respond({"error": f"Too many texts ({len(texts)} > {BATCH_MAX_ITEMS})"}, 413)
+    if not all(isinstance(text, str) for text in texts):
+        return respond({"error": "Items must be strings"}, 400)
 
-    return jsonify({
-        "detections": detections,
-        "count": len(detections)
-    })
+    try:
+        results = [pseudonym_vault.rehydrate(data['scope'], text) for text in texts]
+    except Exception as e:
+        logger.error(f"Rehydration failed: {e}")
+        return respond({"error": str(e)}, 500)
+    if 'texts' in data:
+        return respond({
+            "texts": [text for text, _ in results],
+            "rehydrated_count": sum(count for _, count in results)
+        })
+    text, count = results[0]
+    return respond({"text": text, "rehydrated_count": count})
 
 
 if __name__ == '__main__':
+    warm_up()
+    start_patterns_watcher()
     app.run(host='0.0.0.0', port=5001, debug=True)
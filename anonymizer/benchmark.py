@@ -0,0 +1,459 @@
+"""
+Micro-benchmarks des détecteurs sur un corpus synthétique reproductible
+
+Corpus (générés depuis une graine fixe):
+- prose_names: texte rédigé avec des noms de personnes
+- code_keys: extraits de code avec des clés d'API
+- jwt_logs: logs HTTP avec des tokens Bearer/JWT
+- pem_blocks: clés privées et certificats PEM au milieu de texte
+- secret_free: gros documents sans aucun secret
+
+Cibles: chaque pattern de patterns.json (regex seule), le PatternSet compilé,
+TextBlobNameDetector et le chemin /anonymize complet (Flask + JSON, et mode chunked).
+Mesures: débit (caractères/s) et latence p50/p99 par document.
+--startup: démarrage à froid dans un processus neuf (import de app et construction du scrubber,
+scrub de chauffe, première requête /anonymize), par profil de détection; rapporté sans seuil.
+
+Usage:
+    python benchmark.py --quick --output results.json
+    python benchmark.py --quick --baseline benchmark_baseline.json       # échoue si régression
+    python benchmark.py --quick --update-baseline benchmark_baseline.json
+    python benchmark.py --startup --targets none                          # démarrage à froid seul
+    python benchmark.py --report results.json --baseline base.json        # rapports déjà mesurés
+
+Les débits sont normalisés par une boucle de calibration avant comparaison, pour que
+la baseline reste exploitable sur une machine plus rapide ou plus lente. La comparaison
+porte sur le total de chaque corpus, avec une tolérance au moins égale au bruit mesuré.
+"""
+import argparse
+import base64
+import fnmatch
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import string
+import subprocess
+import sys
+import time
+
+PATTERNS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "patterns.json")
+
+SEED = 1337
+DEFAULT_THRESHOLD = 0.30
+
+FIRST_NAMES = ["John", "Alice", "Marie", "Pierre", "Fatima", "Wei", "Carlos", "Olga", "Kenji", "Amara"]
+LAST_NAMES = ["Smith", "Dupont", "Garcia", "Nguyen", "Kowalski", "Martin", "Okafor", "Rossi", "Tanaka", "Bernard"]
+CITIES = ["Paris", "London", "Lyon", "Berlin", "Madrid", "Toronto", "Nairobi", "Osaka"]
+WORDS = (
+    "the report was reviewed by our team before the meeting and everyone agreed that the new "
+    "approach should be tested carefully on staging while we wait for feedback from customers"
+).split()
+CODE_WORDS = ["config", "client", "request", "response", "handler", "payload", "result", "session", "retry"]
+
+
+def _rand(rng, alphabet, length):
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def _sentence(rng, words=WORDS):
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(8, 16))).capitalize() + '.'
+
+
+def _fill(rng, size, make):
+    parts = []
+    length = 0
+    while length < size:
+        part = make(rng)
+        parts.append(part)
+        length += len(part) + 1
+    return '\n'.join(parts)
+
+
+def prose_names(rng, size):
+    def paragraph(rng):
+        first, last, city = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice(CITIES)
+        return (f"{_sentence(rng)} {first} {last} met {rng.choice(FIRST_NAMES)} in {city} yesterday. "
+                f"{_sentence(rng)} Please ask {first} to send the notes to {rng.choice(LAST_NAMES)}.")
+    return _fill(rng, size, paragraph)
+
+
+def code_keys(rng, size):
+    alnum = string.ascii_letters + string.digits
+
+    def snippet(rng):
+        var = rng.choice(CODE_WORDS)
+        secret = rng.choice([
+            lambda: f'OPENAI_API_KEY = "sk-{_rand(rng, alnum, 48)}"',
+            lambda: f'api_key: "{_rand(rng, alnum, 32)}"',
+            lambda: f'aws_access_key_id = "AKIA{_rand(rng, string.ascii_uppercase + string.digits, 16)}"',
+            lambda: f'token = "ghp_{_rand(rng, alnum, 36)}"',
+            lambda: f'stripe.api_key = "sk_live_{_rand(rng, alnum, 24)}"',
+            lambda: f'DATABASE_URL = "postgres://app:{_rand(rng, alnum, 12)}@db:5432/app"',
+        ])()
+        return (f"def build_{var}(options):\n"
+                f"    {secret}\n"
+                f"    {var} = {rng.choice(CODE_WORDS)}.create(options, timeout={rng.randint(1, 60)})\n"
+                f"    return {var}\n")
+    return _fill(rng, size, snippet)
+
+
+def _jwt(rng):
+    def segment(payload):
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+    header = segment({"alg": "HS256", "typ": "JWT"})
+    claims = segment({"sub": _rand(rng, string.digits, 8), "iat": rng.randint(10 ** 9, 2 * 10 ** 9)})
+    return f"{header}.{claims}.{_rand(rng, string.ascii_letters + string.digits + '-_', 43)}"
+
+
+def jwt_logs(rng, size):
+    def line(rng):
+        return (f"2024-05-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z "
+                f"{rng.choice(['INFO', 'WARN', 'DEBUG'])} {rng.choice(['GET', 'POST'])} /api/{rng.choice(CODE_WORDS)} "
+                f"status={rng.choice([200, 201, 401, 500])} Authorization: Bearer {_jwt(rng)}")
+    return _fill(rng, size, line)
+
+
+def pem_blocks(rng, size):
+    def block(rng):
+        kind = rng.choice(["RSA PRIVATE KEY", "PRIVATE KEY", "CERTIFICATE"])
+        body = base64.b64encode(bytes(rng.getrandbits(8) for _ in range(rng.randint(600, 1800)))).decode()
+        lines = '\n'.join(body[i:i + 64] for i in range(0, len(body), 64))
+        return f"{_sentence(rng)}\n-----BEGIN {kind}-----\n{lines}\n-----END {kind}-----\n{_sentence(rng)}"
+    return _fill(rng, size, block)
+
+
+def secret_free(rng, size):
+    return _fill(rng, size, lambda rng: ' '.join(_sentence(rng) for _ in range(5)))
+
+
+# nom -> (générateur, taille d'un document, nombre de documents)
+CORPORA = {
+    "prose_names": (prose_names, 2000, 40),
+    "code_keys": (code_keys, 2000, 40),
+    "jwt_logs": (jwt_logs, 4000, 20),
+    "pem_blocks": (pem_blocks, 6000, 20),
+    "secret_free": (secret_free, 40000, 20),
+}
+
+
+def build_corpus(name, seed=SEED, scale=1.0):
+    """Liste de documents reproductible pour un corpus donné."""
+    generator, size, count = CORPORA[name]
+    rng = random.Random(f"{seed}:{name}")
+    return [generator(rng, size) for _ in range(max(1, int(count * scale)))]
+
+
+def patterns_digest(path=PATTERNS_FILE):
+    """Empreinte de patterns.json: une baseline n'est valable que pour les patterns mesurés."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def calibrate(rounds=7):
+    """
+    Durée médiane (ms) d'une charge de référence fixe, CPU et regex: sert à normaliser les
+    débits (médiane, comme les mesures: une machine chargée ralentit les deux).
+    """
+    text = ' '.join(WORDS) * 200
+    regex = re.compile(r'[a-z]+@[a-z]+\.[a-z]{2,}|\b\w{12,}\b')
+    durations = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        sum(i * i for i in range(200000))
+        for _ in range(20):
+            list(regex.finditer(text))
+        durations.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(durations), 3)
+
+
+def load_targets():
+    """nom de cible -> fonction(document)."""
+    with open(PATTERNS_FILE) as f:
+        patterns = json.load(f)
+
+    targets = {}
+    for name, pattern in patterns.items():
+        regex = re.compile(pattern)
+        targets[f"pattern:{name}"] = lambda text, regex=regex: list(regex.finditer(text))
+
+    from pattern_set import PatternSet, PatternSetDetector
+    detector = PatternSetDetector(PatternSet.from_dict(patterns))
+    targets["pattern_set"] = lambda text: list(detector.iter_filth(text))
+
+    from scrubadub.detectors import TextBlobNameDetector
+    name_detector = TextBlobNameDetector()
+    targets["text_blob_name"] = lambda text: list(name_detector.iter_filth(text))
+
+    def anonymize(text):
+        from app import app
+        response = app.test_client().post('/anonymize', json={'text': text})
+        if response.status_code != 200:
+            raise RuntimeError(f"/anonymize returned {response.status_code}: {response.get_json()}")
+        return response
+
+    def anonymize_lean(text):
+        # Forme utilisée par le gateway: champs minimaux, réponse MessagePack si disponible
+        from app import app
+        response = app.test_client().post(
+            '/anonymize', json={'text': text, 'fields': ['anonymized', 'anonymized_length', 'pii_count', 'secrets_count']},
+            headers={'Accept': 'application/msgpack, application/json;q=0.9'}
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"/anonymize returned {response.status_code}")
+        return response
+
+    def anonymize_chunked(text):
+        from app import app
+        response = app.test_client().post('/anonymize', data=text, content_type='text/plain')
+        last = response.get_data(as_text=True).rstrip('\n').rsplit('\n', 1)[-1]
+        if not json.loads(last).get('done'):
+            raise RuntimeError(f"chunked /anonymize failed: {last}")
+        return response
+
+    targets["anonymize"] = anonymize
+    targets["anonymize_lean"] = anonymize_lean
+    targets["anonymize_chunked"] = anonymize_chunked
+    return targets
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _interquartile(values):
+    q1, _, q3 = statistics.quantiles(values, n=4)
+    return q3 - q1
+
+
+def measure(func, documents, repeats, min_time=0.0):
+    """
+    Débit et latences d'une cible sur un corpus (une passe de chauffe non comptée).
+    Le corpus est rejoué au moins `repeats` fois et au moins `min_time` secondes; le débit
+    retenu est la médiane des tours, et spread (écart interquartile des tours, relatif à la
+    médiane) mesure le bruit de la machine pendant la mesure.
+    """
+    func(documents[0])
+    latencies = []
+    corpus_chars = sum(len(document) for document in documents)
+    round_times = []
+    while len(round_times) < repeats or sum(round_times) < min_time:
+        round_time = 0.0
+        for document in documents:
+            start = time.perf_counter()
+            func(document)
+            elapsed = time.perf_counter() - start
+            latencies.append(elapsed * 1000)
+            round_time += elapsed
+        round_times.append(round_time)
+    median_round = statistics.median(round_times)
+    return {
+        "chars_per_sec": round(corpus_chars / median_round) if median_round else None,
+        "spread": round(_interquartile(round_times) / median_round, 4) if median_round else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50), 4),
+        "p99_ms": round(_percentile(latencies, 0.99), 4),
+        "docs": len(documents),
+        "rounds": len(round_times),
+    }
+
+
+def run(target_filter="*", corpus_filter="*", scale=1.0, repeats=3, min_time=0.2, seed=SEED):
+    corpora = {name: build_corpus(name, seed, scale) for name in CORPORA if fnmatch.fnmatch(name, corpus_filter)}
+    results = {}
+    for target, func in load_targets().items():
+        if not fnmatch.fnmatch(target, target_filter):
+            continue
+        results[target] = {}
+        for corpus, documents in corpora.items():
+            try:
+                results[target][corpus] = measure(func, documents, repeats, min_time)
+            except Exception as e:
+                message = str(e).strip().splitlines()
+                results[target][corpus] = {"error": f"{type(e).__name__}: {message[0] if message else ''}"}
+            print(f"{target:32s} {corpus:12s} {_format(results[target][corpus])}", file=sys.stderr)
+    return {
+        "version": 1,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "calibration_ms": calibrate(),
+        },
+        "config": {
+            "seed": seed, "scale": scale, "repeats": repeats, "min_time": min_time, "patterns": patterns_digest(),
+        },
+        "results": results,
+    }
+
+
+# Exécuté dans un processus neuf par measure_startup: durées en ms sur une ligne JSON
+STARTUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+ready = app.warm_up()
+warmed = time.perf_counter()
+response = app.app.test_client().post('/anonymize', json={'text': 'Contact john@example.com'})
+done = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000, "warmup_ms": (warmed - imported) * 1000,
+    "first_request_ms": (done - warmed) * 1000, "ready": ready, "status": response.status_code,
+}))
+"""
+
+
+def measure_startup(profile="fast", runs=3):
+    """
+    Démarrage à froid: médiane sur `runs` processus neufs. total_ms (lancement de
+    l'interpréteur → première réponse) est mesuré depuis le processus parent.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "DETECTION_PROFILE": profile, "PATTERNS_WATCH_INTERVAL": "0"}
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT], cwd=directory, env=env,
+            capture_output=True, text=True, check=True
+        )
+        sample = json.loads(completed.stdout.strip().splitlines()[-1])
+        sample["total_ms"] = (time.perf_counter() - started) * 1000
+        samples.append(sample)
+    result = {
+        key: round(statistics.median(sample[key] for sample in samples), 1)
+        for key in ("import_ms", "warmup_ms", "first_request_ms", "total_ms")
+    }
+    result.update(ready=all(sample["ready"] for sample in samples), status=samples[-1]["status"], runs=runs)
+    return result
+
+
+def _format(entry):
+    if "error" in entry:
+        return f"ERROR {entry['error']}"
+    return f"{entry['chars_per_sec']:>14,} chars/s  p50 {entry['p50_ms']:>9.3f}ms  p99 {entry['p99_ms']:>9.3f}ms"
+
+
+def corpus_totals(report, targets):
+    """
+    Par corpus: (temps par caractère cumulé des cibles données, bruit relatif pondéré par
+    le temps de chaque cible). Les cibles en échec ou absentes du rapport sont ignorées.
+    """
+    totals = {}
+    for target in targets:
+        for corpus, entry in report["results"].get(target, {}).items():
+            if "error" in entry or not entry.get("chars_per_sec"):
+                continue
+            seconds = 1 / entry["chars_per_sec"]
+            total, noise = totals.get(corpus, (0.0, 0.0))
+            totals[corpus] = (total + seconds, noise + seconds * entry.get("spread", 0.0))
+    return {corpus: (total, noise / total) for corpus, (total, noise) in totals.items()}
+
+
+def corpus_ratios(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Par corpus: (débit normalisé / baseline, tolérance) sur l'ensemble des cibles réussies
+    dans les deux rapports (temps cumulé). La tolérance est `threshold`, ou le bruit mesuré
+    (spread) s'il est plus grand.
+    """
+    scale = current["environment"]["calibration_ms"] / baseline["environment"]["calibration_ms"]
+    common = [target for target in baseline["results"] if target in current["results"]]
+    expected_totals = corpus_totals(baseline, common)
+    ratios = {}
+    for corpus, (actual_total, actual_noise) in corpus_totals(current, common).items():
+        if corpus not in expected_totals:
+            continue
+        expected_total, expected_noise = expected_totals[corpus]
+        # Une machine 2x plus lente (calibration 2x plus longue) doit mettre 2x plus de temps
+        ratios[corpus] = (expected_total / (actual_total / scale), max(threshold, actual_noise, expected_noise))
+    return ratios
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare deux rapports. Retourne la liste des régressions:
+    - cible en échec alors qu'elle passait (déterministe, cible par cible);
+    - corpus dont le débit total est inférieur à la baseline de plus que sa tolérance
+      (voir corpus_ratios).
+    Une cible isolée n'est jamais comparée seule: la plupart durent quelques microsecondes
+    par document, et leur débit varie d'un run à l'autre bien au-delà du seuil.
+    Les cibles absentes de la baseline sont ignorées (nouveaux patterns).
+    """
+    regressions = []
+    for target, corpora in baseline["results"].items():
+        for corpus, expected in corpora.items():
+            actual = current["results"].get(target, {}).get(corpus)
+            if "error" not in expected and actual is not None and "error" in actual:
+                regressions.append(f"{target} on {corpus}: {actual['error']}")
+    for corpus, (ratio, tolerance) in corpus_ratios(current, baseline, threshold).items():
+        if ratio < 1 / (1 + tolerance):
+            regressions.append(f"{corpus}: {ratio:.2f}x baseline throughput (tolerance {tolerance:.0%})")
+    return regressions
+
+
+def write_report(path, report):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Anonymizer detector benchmarks")
+    parser.add_argument("--quick", action="store_true", help="Smaller corpora (CI)")
+    parser.add_argument("--repeats", type=int, default=None)
+    parser.add_argument("--targets", default="*", help="Target filter (glob), e.g. 'pattern:*'")
+    parser.add_argument("--corpora", default="*", help="Corpus filter (glob)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Fail if slower than this JSON baseline")
+    parser.add_argument("--update-baseline", metavar="PATH", help="Write the report as the new baseline")
+    parser.add_argument("--report", help="Compare this saved JSON report instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Tolerated slowdown before failing (0.30 = 30%%)")
+    parser.add_argument("--startup", nargs="?", const="fast", metavar="PROFILES",
+                        help="Also measure cold start for these detection profiles (comma-separated, default fast)")
+    args = parser.parse_args(argv)
+
+    if args.report:
+        with open(args.report) as f:
+            report = json.load(f)
+    else:
+        scale = 0.25 if args.quick else 1.0
+        repeats = args.repeats or (7 if args.quick else 9)
+        min_time = 0.1 if args.quick else 0.5
+        report = run(args.targets, args.corpora, scale=scale, repeats=repeats, min_time=min_time)
+    if args.startup:
+        report["startup"] = {}
+        for profile in args.startup.split(","):
+            report["startup"][profile] = measure_startup(profile, runs=3 if args.quick else 5)
+            print(f"{'startup:' + profile:32s} {json.dumps(report['startup'][profile])}", file=sys.stderr)
+
+    if args.output:
+        write_report(args.output, report)
+    if args.update_baseline:
+        # Seules les mesures réussies servent de référence (ex: sans modèles NLTK, TextBlob échoue)
+        results = {
+            target: {corpus: entry for corpus, entry in corpora.items() if "error" not in entry}
+            for target, corpora in report["results"].items()
+        }
+        write_report(args.update_baseline, {**report, "results": {k: v for k, v in results.items() if v}})
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for corpus, (ratio, tolerance) in corpus_ratios(report, baseline, args.threshold).items():
+            print(f"{'total:' + corpus:32s} {ratio:.2f}x baseline (tolerance {tolerance:.0%})", file=sys.stderr)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} performance regression(s):", file=sys.stderr)
+            for regression in regressions:
+                print(f"  - {regression}", file=sys.stderr)
+            return 1
+        print("✅ No performance regression against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Scan par fenêtres des très gros textes (logs collés, dumps de plusieurs Mo)
+
+Le texte est lu par morceaux et analysé par fenêtres qui se chevauchent: seule la partie
+de la fenêtre située avant le chevauchement est émise. Une détection qui traverse cette
+limite la repousse à son début, elle est donc retrouvée entière dans la fenêtre suivante.
+Tant qu'un secret est plus court que le chevauchement (clés privées et certificats PEM
+compris), le résultat est celui d'un scan du texte entier.
+
+La mémoire est bornée par la taille de fenêtre, quelle que soit la taille de l'entrée.
+"""
+import codecs
+
+from tiers import DetectionBlocked
+
+# Taille des fenêtres et du chevauchement (en caractères). La politique NLP (tiers.py)
+# s'applique par fenêtre: fenêtre + chevauchement doit rester sous NLP_MAX_CHARS
+WINDOW_CHARS = 40 * 1024
+# Doit dépasser la taille du plus long secret multi-lignes (une clé RSA 8192 bits fait ~6.5Ko)
+OVERLAP_CHARS = 8 * 1024
+# Une détection qui ne tient pas dans cette taille bloque le scan (fail closed)
+MAX_WINDOW_CHARS = 4 * WINDOW_CHARS
+
+READ_SIZE = 64 * 1024
+
+
+def iter_stream(stream, encoding='utf-8', read_size=READ_SIZE):
+    """Décode un flux binaire (corps de requête) morceau par morceau."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_string(text, read_size=READ_SIZE):
+    """Découpe un texte déjà en mémoire en morceaux."""
+    for start in range(0, len(text), read_size):
+        yield text[start:start + read_size]
+
+
+def scan_windows(pieces, scan_window, window=WINDOW_CHARS, overlap=OVERLAP_CHARS, max_window=MAX_WINDOW_CHARS):
+    """
+    Parcourt le texte fenêtre par fenêtre.
+
+    scan_window(texte) retourne les détections triées et fusionnées de la fenêtre
+    (dicts avec 'start' et 'end'). Produit des tuples (offset, segment, détections) où les
+    segments mis bout à bout redonnent le texte et les positions sont relatives au segment.
+    """
+    if not 0 < overlap < window:
+        raise ValueError("overlap must be positive and smaller than the window")
+
+    pieces = iter(pieces)
+    buffer = ''
+    offset = 0
+    target = window + overlap
+    eof = False
+
+    while True:
+        while not eof and len(buffer) < target:
+            piece = next(pieces, None)
+            if piece is None:
+                eof = True
+            else:
+                buffer += piece
+        if not buffer:
+            return
+
+        view = buffer[:target]
+        detections = scan_window(view)
+        boundary = len(view)
+        if not eof or len(buffer) > len(view):
+            boundary -= overlap
+            for detection in detections:
+                if detection['start'] < boundary < detection['end']:
+                    boundary = detection['start']
+
+        if boundary == 0:
+            # Une détection couvre tout le début de la fenêtre: il faut plus de contexte
+            if len(view) >= max_window:
+                raise DetectionBlocked("fast", "match_exceeds_window")
+            target = len(view) + window
+            continue
+
+        yield offset, view[:boundary], [d for d in detections if d['end'] <= boundary]
+        buffer = buffer[boundary:]
+        offset += boundary
+        target = window + overlap
+        if eof and not buffer:
+            return
+
+
+def replace_detections(text, detections):
+    """Remplace chaque détection (triées, sans chevauchement) par son placeholder."""
+    chunks = []
+    cursor = 0
+    for detection in detections:
+        chunks.append(text[cursor:detection['start']])
+        chunks.append(detection['replacement'])
+        cursor = detection['end']
+    chunks.append(text[cursor:])
+    return ''.join(chunks)
+
+
+def merge_tiers(total, tiers):
+    """Cumule les rapports de paliers des fenêtres (durées additionnées)."""
+    for name, info in tiers.items():
+        tier = total.setdefault(name, {"ran": False, "windows": 0, "ms": 0.0})
+        if info.get("ran"):
+            tier["ran"] = True
+            tier["windows"] += 1
+            tier["ms"] = round(tier["ms"] + info.get("ms", 0.0), 3)
+            tier.pop("reason", None)
+            if "detectors" in info:
+                detectors = tier.setdefault("detectors", {})
+                for detector, ms in info["detectors"].items():
+                    detectors[detector] = round(detectors.get(detector, 0.0) + ms, 3)
+        elif not tier["ran"]:
+            tier["reason"] = info.get("reason")
+    return total
@@ -0,0 +1,11 @@
+"""
+Modules partagés entre services (common/): copiés dans l'image au build, ajoutés ici au
+sys.path (et au PYTHONPATH des sous-processus lancés par les tests).
+"""
+import os
+import sys
+
+COMMON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")
+
+sys.path.insert(0, COMMON)
+os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [COMMON, os.environ.get("PYTHONPATH")]))
@@ -8,25 +8,26 @@ except AttributeError:
 else:
     ssl._create_default_https_context = _create_unverified_https_context
 
+# Seules ressources NLTK lues par le service: TextBlobNameDetector découpe le texte en phrases
+# (sent_tokenize → punkt_tab) puis étiquette avec le PatternTagger de TextBlob, qui embarque son
+# lexique (scrubadub remplace le tagger NLTK). brown, wordnet, conll2000, movie_reviews et les
+# taggers NLTK ne servent qu'à des fonctions TextBlob que le service n'appelle pas.
+MODELS = [
+    'punkt_tab',
+]
+
+
 def download_models():
-    """Download NLTK models required for TextBlob and anonymization."""
+    """Download the NLTK models used by TextBlobNameDetector."""
     print("Downloading NLTK models...")
-    
-    models = [
-        'brown',
-        'punkt',
-        'wordnet',
-        'averaged_perceptron_tagger',
-        'conll2000',
-        'movie_reviews',
-        'punkt_tab'  # Required for newer NLTK versions
-    ]
-    
-    for model in models:
+
+    for model in MODELS:
         print(f"Downloading {model}...")
-        nltk.download(model, quiet=True)
-        
+        if not nltk.download(model, quiet=True):
+            raise SystemExit(f"Failed to download {model}")
+
     print("All models downloaded successfully.")
 
+
 if __name__ == "__main__":
     download_models()
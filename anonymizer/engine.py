@@ -0,0 +1,336 @@
+"""
+Bibliothèque de scrubbing (importable hors du service Flask)
+
+Construction du scrubber (détecteurs natifs scrubadub + PatternSet compilé depuis
+patterns.json), garde ReDoS au chargement, et analyse d'un texte selon la politique de
+paliers. Le service (app.py) et le gateway en mode embarqué (ANONYMIZER_MODE=embedded|pool)
+s'appuient sur ce module: les détections sont identiques dans les deux cas.
+
+Ce module n'importe ni Flask ni les métriques/traces du service: seuls pattern_set.py,
+tiers.py, redos.py et pseudonyms.py doivent être accompagnés.
+
+Usage embarqué:
+    engine = ScrubEngine("patterns.json")
+    engine.load()
+    engine.anonymize("Contact john@example.com")["anonymized"]
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import nltk
+import scrubadub
+from scrubadub.detectors import TextBlobNameDetector
+
+from pattern_set import PatternSet, PatternSetDetector
+from pseudonyms import Pseudonymizer
+from redos import PatternGuard
+from tiers import NlpPolicy, scan
+
+logger = logging.getLogger(__name__)
+
+# Configurer NLTK pour TextBlob
+if os.path.exists('/app/nltk_data'):
+    nltk.data.path.append('/app/nltk_data')
+
+
+def compute_patterns_version(patterns, detectors):
+    """Hash court et stable des patterns et des détecteurs actifs."""
+    canonical = json.dumps({"patterns": patterns, "detectors": sorted(detectors)}, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def file_fingerprint(path):
+    """Empreinte (mtime, taille, inode) d'un fichier, None s'il n'existe pas."""
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+    except OSError:
+        return None
+
+
+def valid_patterns(patterns):
+    """Patterns dont la regex compile; les autres sont ignorés (et loggés)."""
+    valid = {}
+    for name, pattern in patterns.items():
+        try:
+            re.compile(pattern)
+        except (re.error, TypeError) as e:
+            logger.error(f"Invalid regex for {name}: {e}")
+            continue
+        valid[name] = pattern
+    return valid
+
+
+def build_scrubber(path, guard, patterns=None, previous=None, loaded=None):
+    """
+    Construit un nouveau scrubber depuis le fichier de patterns, sans toucher à celui en service.
+    patterns/previous: patterns et scrubber actuels (conservés si le fichier est absent;
+    les patterns inchangés sont repris du PatternSet en service, sans recompilation).
+    loaded: patterns déjà lus (le fichier n'est alors pas relu).
+    Retourne (scrubber, patterns, patterns signalés par la garde ReDoS). Lève en cas d'échec.
+    """
+    new_scrubber = scrubadub.Scrubber()
+
+    # Ajouter TextBlob pour les noms (si dispo)
+    try:
+        new_scrubber.add_detector(TextBlobNameDetector)
+        logger.info("✅ Added TextBlobNameDetector")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not add TextBlobNameDetector: {e}")
+
+    new_patterns = patterns or {}
+    flagged = guard.flagged
+    if loaded is not None or os.path.exists(path):
+        if loaded is not None:
+            loaded_patterns = loaded
+        else:
+            with open(path, 'r') as f:
+                loaded_patterns = json.load(f)
+
+        if isinstance(loaded_patterns, dict):
+            # Une regex invalide est ignorée (et loggée): elle ne fait pas échouer tout le chargement
+            loaded_patterns = valid_patterns(loaded_patterns)
+            # Structure à risque de backtracking: refusée avant toute substitution (policy reject)
+            flagged = guard.validate(loaded_patterns)
+            rejected = guard.rejected(flagged)
+            if rejected:
+                raise ValueError("ReDoS check failed: " + "; ".join(
+                    f"{name} has a {result['structure']}" for name, result in rejected.items()
+                ))
+            new_patterns = loaded_patterns
+            for name in new_patterns:
+                # Check for collision with default detectors (e.g. 'email', 'url')
+                # We want our custom patterns to take precedence (overwrite)
+                try:
+                    new_scrubber.remove_detector(name)
+                    logger.info(f"ℹ️ Overwriting default detector: {name}")
+                except KeyError:
+                    pass  # Detector didn't exist, safe to add
+
+            # Tous les patterns dans un seul détecteur (préfiltrage par littéraux + scan combiné)
+            pattern_set = PatternSet.from_dict(new_patterns, previous=current_pattern_set(previous))
+            new_scrubber.add_detector(PatternSetDetector(pattern_set))
+            logger.info(
+                f"✅ Loaded {len(pattern_set.names)} dynamic patterns from {path} "
+                f"({pattern_set.compiled} compiled, {len(pattern_set.names) - pattern_set.compiled} reused)"
+            )
+        else:
+            logger.error("patterns.json is not a dictionary")
+    return new_scrubber, new_patterns, flagged
+
+
+def current_pattern_set(active):
+    """PatternSet du scrubber donné."""
+    for detector in (active._detectors.values() if active else []):
+        if isinstance(detector, PatternSetDetector):
+            return detector.pattern_set
+    return None
+
+
+def detector_names(active):
+    """Noms des détecteurs actifs (le PatternSet est détaillé pattern par pattern)."""
+    names = []
+    for name, detector in (active._detectors.items() if active else []):
+        if isinstance(detector, PatternSetDetector):
+            names.extend(detector.pattern_set.names)
+        else:
+            names.append(name)
+    return names
+
+
+def replace_filth(text, filth_list, replacements=None):
+    """
+    Reconstruit le texte en remplaçant chaque Filth (triés et fusionnés) par son placeholder
+    (ou par replacements[i] s'ils sont fournis, ex: pseudonymes).
+    """
+    chunks = []
+    cursor = 0
+    for i, filth in enumerate(filth_list):
+        chunks.append(text[cursor:filth.beg])
+        chunks.append(replacements[i] if replacements is not None else placeholder(filth))
+        cursor = filth.end
+    chunks.append(text[cursor:])
+    return ''.join(chunks)
+
+
+def placeholder(filth):
+    """Texte de remplacement d'un Filth (ex: {{EMAIL}})."""
+    if filth.replacement_string is not None:
+        return filth.replacement_string
+    return filth.replace_with()
+
+
+def pseudonym(filth, pseudonymizer, scope):
+    """Placeholder stable du Filth dans le scope (ex: {{EMAIL_3f2a9c1b}}, voir pseudonyms.py)."""
+    return pseudonymizer.placeholder(scope, filth.placeholder, filth.text)
+
+
+def serialize_filth(filth):
+    """Convertit un Filth en dict JSON."""
+    return {
+        'type': filth.type,  # Le type défini dans nos classes dynamiques ou natif (ex: 'name', 'email')
+        'text': filth.text,
+        'start': filth.beg,
+        'end': filth.end,
+        'detector': filth.detector_name
+    }
+
+
+def anonymize_result(active, original_text, policy, pseudonymizer=None, scope=None):
+    """
+    Anonymise un texte et construit le payload de réponse (détections + compteurs).
+    Passe unique des détecteurs, palier par palier (voir tiers.py): les Filth triés et
+    fusionnés donnent à la fois le texte anonymisé et les détections.
+    Avec un scope (et un Pseudonymizer), chaque valeur est remplacée par son pseudonyme
+    stable, et "pseudonyms" ({placeholder: valeur}) alimente le coffre de réhydratation.
+    Lève DetectionBlocked si la politique l'impose.
+    """
+    filth_list, tiers = scan(active, original_text, policy)
+    replacements = None
+    if scope and pseudonymizer is not None:
+        replacements = [pseudonym(filth, pseudonymizer, scope) for filth in filth_list]
+    anonymized_text = replace_filth(original_text, filth_list, replacements)
+    detections = [serialize_filth(filth) for filth in filth_list]
+
+    # Legacy counts for Gateway compatibility
+    # Secrets = nos patterns custom (dans patterns.json)
+    # PII = le reste (TextBlob, etc.)
+    pattern_set = current_pattern_set(active)
+    custom_detectors = set(pattern_set.names if pattern_set else [])
+    secrets_count = sum(1 for d in detections if d['detector'] in custom_detectors)
+    pii_count = len(detections) - secrets_count
+
+    result = {
+        "anonymized": anonymized_text,
+        "original_length": len(original_text),
+        "anonymized_length": len(anonymized_text),
+        "detections_count": len(detections),
+        "detections": detections,
+        "pii_count": pii_count,
+        "secrets_count": secrets_count,
+        "tiers": tiers
+    }
+    if replacements is not None:
+        result["pseudonyms"] = {name: filth.text for name, filth in zip(replacements, filth_list)}
+    return result
+
+
+def detect_result(active, text, policy):
+    """Détections seules (sans remplacement)."""
+    filth_list, tiers = scan(active, text, policy)
+    detections = [serialize_filth(filth) for filth in filth_list]
+    return {
+        "detections": detections,
+        "count": len(detections),
+        "tiers": tiers
+    }
+
+
+def window_result(active, text, policy):
+    """
+    Scan d'une fenêtre du mode chunked. Les détections sont retournées sérialisées
+    (avec leur placeholder): les classes Filth dynamiques ne traversent pas un pool de processus.
+    """
+    filth_list, tiers = scan(active, text, policy)
+    detections = []
+    for filth in filth_list:
+        detection = serialize_filth(filth)
+        detection['replacement'] = placeholder(filth)
+        detections.append(detection)
+    return detections, tiers
+
+
+class ScrubEngine:
+    """
+    Scrubber prêt à l'emploi pour un appelant embarqué: chargement, rechargement quand le
+    fichier de patterns change (check_file), analyse avec la politique de paliers.
+    La garde ReDoS et la politique viennent par défaut de l'environnement, comme pour le service.
+    """
+
+    def __init__(self, patterns_file, policy=None, guard=None, pseudonymizer=None):
+        self.patterns_file = patterns_file
+        self.policy = policy or NlpPolicy.from_env()
+        self.guard = guard or PatternGuard.from_env()
+        self.pseudonymizer = pseudonymizer or Pseudonymizer.from_env()
+        self.scrubber = None
+        self.patterns = {}
+        self.version = None
+        self.loaded_at = None
+        self.reloads = 0
+        # Instantané (version, patterns) transmis avec chaque tâche d'un pool de processus (sync)
+        self.snapshot = (None, {})
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """(Re)charge le fichier de patterns. Retourne True si la version a changé; lève en cas d'échec."""
+        with self._lock:
+            fingerprint = file_fingerprint(self.patterns_file)
+            new_scrubber, new_patterns, flagged = build_scrubber(
+                self.patterns_file, self.guard, self.patterns, self.scrubber
+            )
+            self._fingerprint = fingerprint
+            self.guard.flagged = flagged
+            version = compute_patterns_version(new_patterns, list(new_scrubber._detectors.keys()))
+            if self.scrubber is not None and version == self.version:
+                return False
+            # Substitution atomique: les analyses en cours gardent leur instantané
+            self.scrubber = new_scrubber
+            self.patterns = new_patterns
+            self.version = version
+            self.snapshot = (version, new_patterns)
+            self.loaded_at = time.time()
+            self.reloads += 1
+            logger.info(f"🔄 Pattern set version {version} active")
+            return True
+
+    def sync(self, version, patterns):
+        """
+        Processus d'un pool: aligne le scrubber sur l'instantané du processus parent (patterns
+        déjà validés par sa garde ReDoS, pas de nouvelle sonde ici). Retourne True si reconstruit.
+        """
+        if version == self.version:
+            return False
+        with self._lock:
+            self.scrubber, self.patterns, _ = build_scrubber(
+                self.patterns_file, PatternGuard("off"), self.patterns, self.scrubber, loaded=patterns
+            )
+            self.version = version
+            self.snapshot = (version, self.patterns)
+            self.loaded_at = time.time()
+        logger.info(f"🔄 Scrub process {os.getpid()} switched to pattern set version {version}")
+        return True
+
+    def check_file(self):
+        """Recharge si le fichier a changé. Un échec est journalisé, la version en service est gardée."""
+        if self.scrubber is not None and file_fingerprint(self.patterns_file) == self._fingerprint:
+            return False
+        try:
+            return self.load()
+        except Exception as e:
+            if self.scrubber is None:
+                raise
+            logger.error(f"❌ Failed to load patterns: {e}")
+            return False
+
+    def anonymize(self, text, scope=None):
+        return anonymize_result(self.scrubber, text, self.policy, self.pseudonymizer, scope)
+
+    def detect(self, text):
+        return detect_result(self.scrubber, text, self.policy)
+
+    def describe(self):
+        detectors = detector_names(self.scrubber)
+        return {
+            "patterns_version": self.version,
+            "patterns_loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "detectors_count": len(detectors),
+            "detection": self.policy.describe(),
+            "redos": self.guard.describe(),
+        }
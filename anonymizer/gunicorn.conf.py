@@ -0,0 +1,57 @@
+"""
+Configuration Gunicorn de l'Anonymizer (service CPU-bound)
+
+- preload_app: NLTK/TextBlob et le PatternSet sont chargés une seule fois dans le master,
+  puis partagés en copy-on-write par les workers (gc.freeze() évite que le GC ne touche
+  ces pages et ne les duplique).
+- ANONYMIZER_WORKERS: un worker par cœur alloué au conteneur (1 par défaut, comme la limite cpus des fichiers compose).
+- SCRUB_PROCESSES > 0: front multi-threads (gthread) et scrubbing dans un pool de processus.
+- Hot reload: chaque worker surveille PATTERNS_FILE (PATTERNS_WATCH_INTERVAL).
+- PROMETHEUS_MULTIPROC_DIR: métriques agrégées entre workers, répertoire vidé au démarrage.
+"""
+import gc
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+
+workers = int(os.getenv("ANONYMIZER_WORKERS", "1"))
+scrub_processes = int(os.getenv("SCRUB_PROCESSES", "0"))
+worker_class = os.getenv("ANONYMIZER_WORKER_CLASS", "gthread" if scrub_processes > 0 else "sync")
+# Threads du front gthread uniquement: avec threads > 1, gunicorn bascule un worker sync en gthread
+# (le scan ne serait plus dans le thread principal, hors de portée de SCAN_TIMEOUT_MS)
+threads = int(os.getenv("ANONYMIZER_THREADS", "8")) if worker_class == "gthread" else 1
+timeout = int(os.getenv("ANONYMIZER_TIMEOUT", "60"))
+
+preload_app = True
+
+# Chargé avant l'application (preload): les fichiers d'une exécution précédente sont effacés
+multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if multiproc_dir:
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    """Master: scrub de chauffe avant le fork, pour partager aussi les données chargées à la demande."""
+    import app as anonymizer_app
+    anonymizer_app.warm_up()
+
+
+def pre_fork(server, worker):
+    # Objets du master en génération permanente: pas de copie des pages par le GC des workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app as anonymizer_app
+    if scrub_processes > 0:
+        anonymizer_app.start_scrub_pool(scrub_processes)
+    # Chaque worker surveille PATTERNS_FILE et recharge en arrière-plan
+    anonymizer_app.start_patterns_watcher()
+
+
+def child_exit(server, worker):
+    if multiproc_dir:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
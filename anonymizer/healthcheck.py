@@ -3,7 +3,8 @@ import urllib.request
 import os
 
 PORT = os.environ.get("PORT", "5001")
-URL = f"http://127.0.0.1:{PORT}/health"
+# Readiness: 200 seulement après le scrub de chauffe (/health répond dès le chargement)
+URL = f"http://127.0.0.1:{PORT}/ready"
 
 try:
     with urllib.request.urlopen(URL) as response:
@@ -0,0 +1,81 @@
+"""
+Métriques Prometheus de l'Anonymizer (exposées sur /metrics)
+
+- anonymizer_detector_scan_seconds{tier,detector}: durée de chaque détecteur par texte analysé
+- anonymizer_scanned_bytes_total: volume de texte analysé (UTF-8)
+- anonymizer_detections_total{type}: détections par type
+- anonymizer_detection_blocked_total{tier,reason}: textes bloqués par la politique de détection
+- anonymizer_pattern_reloads_total{outcome} / anonymizer_pattern_reload_seconds: rechargements des patterns
+
+Les mesures sont prises dans le processus qui sert la requête, à partir du rapport des
+paliers (tiers.py): elles restent justes avec le pool de processus de scrubbing.
+Avec plusieurs workers gunicorn, PROMETHEUS_MULTIPROC_DIR active le mode multiprocess
+de prometheus_client (un fichier par processus, agrégés à la lecture de /metrics).
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+# De 50µs (regex sur un message court) à 10s (NLP sur un gros texte)
+SCAN_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                2.5, 10.0)
+RELOAD_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+DETECTOR_SCAN_SECONDS = Histogram(
+    'anonymizer_detector_scan_seconds', 'Scan time per detector and text',
+    ['tier', 'detector'], buckets=SCAN_BUCKETS
+)
+SCANNED_BYTES = Counter('anonymizer_scanned_bytes', 'UTF-8 bytes of text scanned')
+DETECTIONS = Counter('anonymizer_detections', 'Detections by filth type', ['type'])
+BLOCKED = Counter('anonymizer_detection_blocked', 'Texts blocked by the detection policy', ['tier', 'reason'])
+RELOADS = Counter('anonymizer_pattern_reloads', 'Pattern set reloads by outcome', ['outcome'])
+RELOAD_SECONDS = Histogram('anonymizer_pattern_reload_seconds', 'Pattern set reload duration', buckets=RELOAD_BUCKETS)
+
+
+# Séries déjà résolues: labels() (verrou + validation) n'est appelé qu'une fois par série
+_detector_series = {}
+_detection_series = {}
+
+
+def observe_scan(text, tiers):
+    """Durées par détecteur (rapport des paliers) et volume analysé."""
+    SCANNED_BYTES.inc(len(text.encode('utf-8', 'surrogatepass')))
+    for tier, info in tiers.items():
+        for detector, ms in info.get('detectors', {}).items():
+            series = _detector_series.get((tier, detector))
+            if series is None:
+                series = _detector_series[(tier, detector)] = DETECTOR_SCAN_SECONDS.labels(tier, detector)
+            series.observe(ms / 1000)
+
+
+def observe_detections(detections):
+    counts = {}
+    for detection in detections:
+        counts[detection['type']] = counts.get(detection['type'], 0) + 1
+    for filth_type, count in counts.items():
+        series = _detection_series.get(filth_type)
+        if series is None:
+            series = _detection_series[filth_type] = DETECTIONS.labels(filth_type)
+        series.inc(count)
+
+
+def observe_blocked(error):
+    BLOCKED.labels(error.tier, error.reason).inc()
+
+
+def observe_reload(outcome, seconds):
+    """outcome: reloaded | unchanged | error"""
+    RELOADS.labels(outcome).inc()
+    RELOAD_SECONDS.observe(seconds)
+
+
+def render():
+    """Retourne (corps, content-type) de /metrics (agrégé sur tous les processus en mode multiprocess)."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
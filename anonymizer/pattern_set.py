@@ -0,0 +1,367 @@
+"""
+Pattern Set - Moteur multi-patterns compilé pour les détecteurs de patterns.json
+Architecture: Un seul détecteur Scrubadub remplace les 17+ RegexDetector dynamiques
+
+1. Au chargement, chaque regex est analysée pour extraire ses littéraux obligatoires
+   (ex: 'akia', 'sk-', '-----begin', 'eyj', 'hooks.slack.com', 'bearer').
+2. À chaque requête, un passage de préfiltrage vérifie la présence de ces littéraux
+   et écarte les patterns qui ne peuvent pas matcher.
+3. Les patterns restants sont fusionnés dans une seule regex à groupes nommés qui
+   localise le premier match; chaque pattern restant n'est exécuté qu'à partir de là.
+
+Le résultat est strictement identique à un finditer() par pattern.
+"""
+import logging
+import re
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants  # Python >= 3.11
+except ImportError:  # pragma: no cover
+    import sre_parse
+    import sre_constants
+
+from scrubadub.detectors import Detector
+from scrubadub.filth import Filth
+
+logger = logging.getLogger(__name__)
+
+# Au-delà, une classe de caractères ou un produit d'alternatives n'est plus développé en littéraux
+MAX_CLASS_SIZE = 8
+MAX_ALTERNATIVES = 32
+
+# Flags autorisés dans un groupe local (?flags:...) lors de la fusion
+_SCOPED_FLAGS = {'i': re.IGNORECASE, 'm': re.MULTILINE, 's': re.DOTALL, 'x': re.VERBOSE}
+_LEADING_FLAGS = re.compile(r'^\(\?([aiLmsux]+)\)')
+
+# Taille max du cache de regex combinées (une par combinaison de patterns actifs)
+COMBINED_CACHE_SIZE = 64
+
+
+def fold(text):
+    """
+    Normalisation insensible à la casse, compatible avec re.IGNORECASE pour les littéraux ASCII:
+    même longueur que le texte, et chaque caractère que re.IGNORECASE confond avec une lettre
+    ASCII ('İ', 'ı', 'ſ', 'K' en plus des majuscules) devient cette lettre. casefold() ne
+    convient pas: 'İ' y devient 'i' + point combinant, et 'AKİA' ne contiendrait plus 'akia'.
+    """
+    return text.replace('İ', 'i').lower().replace('ı', 'i').replace('ſ', 's')
+
+
+def _class_chars(items, ignorecase):
+    """Retourne l'ensemble des caractères d'une classe [...] si elle est petite et positive."""
+    chars = set()
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            chars.add(chr(av))
+        elif op is sre_constants.RANGE and av[1] - av[0] < MAX_CLASS_SIZE:
+            chars.update(chr(c) for c in range(av[0], av[1] + 1))
+        else:
+            return None
+        if len(chars) > MAX_CLASS_SIZE:
+            return None
+    if ignorecase:
+        if not all(c.isascii() for c in chars):
+            return None  # fold() n'est exact que pour l'ASCII
+        chars = {fold(c) for c in chars}
+    return chars
+
+
+def _product(left, right):
+    if len(left) * len(right) > MAX_ALTERNATIVES:
+        return None
+    return {a + b for a in left for b in right}
+
+
+def _exact(seq, ignorecase):
+    """Ensemble fini des chaînes matchées par une séquence, ou None si trop grand/inconnu."""
+    result = {''}
+    for item in seq:
+        alts = _exact_item(item, ignorecase)
+        if alts is None:
+            return None
+        result = _product(result, alts)
+        if result is None:
+            return None
+    return result
+
+
+def _exact_item(item, ignorecase):
+    op, av = item
+    if op is sre_constants.LITERAL:
+        if ignorecase and av > 127:
+            return None
+        return {fold(chr(av)) if ignorecase else chr(av)}
+    if op is sre_constants.IN:
+        return _class_chars(av, ignorecase)
+    if op is sre_constants.AT:
+        return {''}
+    if op is sre_constants.SUBPATTERN:
+        return _exact(av[3], ignorecase)
+    if op is sre_constants.BRANCH:
+        result = set()
+        for alternative in av[1]:
+            alts = _exact(alternative, ignorecase)
+            if alts is None:
+                return None
+            result |= alts
+            if len(result) > MAX_ALTERNATIVES:
+                return None
+        return result
+    if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        low, high, sub = av
+        if low != high or low > 4:
+            return None
+        alts = _exact(sub, ignorecase)
+        if alts is None:
+            return None
+        result = {''}
+        for _ in range(low):
+            result = _product(result, alts)
+            if result is None:
+                return None
+        return result
+    return None
+
+
+def _best(requirements):
+    """Choisit l'exigence la plus sélective (alternative la plus courte la plus longue possible)."""
+    if not requirements:
+        return None
+    return max(requirements, key=lambda req: (min(len(lit) for lit in req), -len(req)))
+
+
+def _required(seq, ignorecase):
+    """
+    Liste d'exigences (conjonction) d'une séquence: chaque exigence est un frozenset de
+    littéraux dont au moins un doit apparaître dans le texte pour que la séquence matche.
+    """
+    requirements = []
+    run = {''}
+
+    def flush():
+        nonlocal run
+        if run != {''} and all(run):
+            requirements.append(frozenset(run))
+        run = {''}
+
+    for item in seq:
+        op, av = item
+        alts = _exact_item(item, ignorecase)
+        if alts is not None:
+            extended = _product(run, alts)
+            if extended is not None:
+                run = extended
+                continue
+            flush()
+            run = alts
+            continue
+        flush()
+        if op is sre_constants.SUBPATTERN:
+            requirements.extend(_required(av[3], ignorecase))
+        elif op is sre_constants.BRANCH:
+            union = set()
+            for alternative in av[1]:
+                best = _best(_required(alternative, ignorecase))
+                if best is None:
+                    union = None
+                    break
+                union |= best
+            if union:
+                requirements.append(frozenset(union))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+            requirements.extend(_required(av[2], ignorecase))
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            requirements.extend(_required(av, ignorecase))
+    flush()
+    return requirements
+
+
+def _walk(seq):
+    """Itère récursivement sur tous les (op, av) d'un arbre sre_parse."""
+    for op, av in seq:
+        yield op, av
+        if op is sre_constants.SUBPATTERN:
+            yield from _walk(av[3])
+        elif op is sre_constants.BRANCH:
+            for alternative in av[1]:
+                yield from _walk(alternative)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                    getattr(sre_constants, 'POSSESSIVE_REPEAT', None)):
+            yield from _walk(av[2])
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            yield from _walk(av[1])
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            yield from _walk(av)
+
+
+def analyze_pattern(pattern):
+    """
+    Analyse une regex source et retourne (requirements, ignorecase, combinable).
+    - requirements: liste de frozenset de littéraux (tous requis, un de chaque suffit)
+    - ignorecase: les littéraux sont comparés au texte normalisé par fold()
+    - combinable: la regex peut être fusionnée dans une alternance à groupes nommés
+    """
+    parsed = sre_parse.parse(pattern)
+    flags = parsed.state.flags
+    ignorecase = bool(flags & re.IGNORECASE)
+    combinable = parsed.state.groupdict == {}  # pas de groupes nommés (collisions)
+    for op, av in _walk(parsed):
+        if op is sre_constants.SUBPATTERN and av[1] & re.IGNORECASE:
+            ignorecase = True  # approximation conservatrice
+        elif op in (sre_constants.GROUPREF, getattr(sre_constants, 'GROUPREF_EXISTS', None)):
+            combinable = False  # les numéros de groupes changent une fois fusionnés
+    requirements = _required(parsed, ignorecase)
+    return requirements, ignorecase, combinable
+
+
+def _scoped_source(pattern):
+    """Transforme '(?i)body' en '(?i:body)' pour pouvoir fusionner les patterns, ou None."""
+    flags = ''
+    body = pattern
+    while True:
+        match = _LEADING_FLAGS.match(body)
+        if not match:
+            break
+        flags += match.group(1)
+        body = body[match.end():]
+    if any(flag not in _SCOPED_FLAGS for flag in flags):
+        return None
+    if flags:
+        # En mode verbeux, un commentaire final avalerait la parenthèse fermante
+        closing = '\n)' if 'x' in flags else ')'
+        return f"(?{''.join(sorted(set(flags)))}:{body}{closing}"
+    return f"(?:{body})"
+
+
+class PatternEntry:
+    """Un pattern compilé de patterns.json avec ses littéraux obligatoires."""
+
+    def __init__(self, name, pattern):
+        self.name = name
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        # Le 'type' définira le placeholder {{TYPE}}
+        self.filth_cls = type(f"{name.capitalize()}Filth", (Filth,), {'type': name})
+        try:
+            self.requirements, self.ignorecase, combinable = analyze_pattern(pattern)
+        except Exception:  # pragma: no cover - re.compile a déjà validé la syntaxe
+            self.requirements, self.ignorecase, combinable = [], False, False
+        self.source = _scoped_source(pattern) if combinable else None
+        if self.source is not None:
+            try:
+                re.compile(self.source)
+            except re.error:
+                self.source = None
+
+    def literals(self):
+        return {lit for req in self.requirements for lit in req}
+
+    def __repr__(self):
+        return f"PatternEntry({self.name!r}, requirements={[sorted(r) for r in self.requirements]})"
+
+
+class PatternSet:
+    """Ensemble de patterns compilés partagé par un PatternSetDetector."""
+
+    def __init__(self, entries, compiled=None):
+        self.entries = list(entries)
+        self.names = [entry.name for entry in self.entries]
+        # Nombre de patterns réellement (re)compilés lors de la construction
+        self.compiled = len(self.entries) if compiled is None else compiled
+        self._combined = {}
+
+    @classmethod
+    def from_dict(cls, patterns, previous=None):
+        """
+        Compile un dict {nom: regex}. Les regex invalides sont ignorées (et loggées).
+        Avec previous, les entrées dont le nom et la regex n'ont pas changé sont réutilisées.
+        """
+        reusable = {(entry.name, entry.pattern): entry for entry in previous.entries} if previous else {}
+        entries = []
+        compiled = 0
+        for name, pattern in patterns.items():
+            entry = reusable.get((name, pattern))
+            if entry is None:
+                try:
+                    entry = PatternEntry(name, pattern)
+                    compiled += 1
+                except re.error as e:
+                    logger.error(f"Invalid regex for {name}: {e}")
+                    continue
+            entries.append(entry)
+        return cls(entries, compiled=compiled)
+
+    def active_entries(self, text):
+        """Préfiltrage: patterns dont tous les littéraux obligatoires sont présents dans le texte."""
+        folded = None
+        present = {}
+        active = []
+        for entry in self.entries:
+            haystack = text
+            if entry.ignorecase:
+                if folded is None:
+                    folded = fold(text)
+                haystack = folded
+            ok = True
+            for requirement in entry.requirements:
+                found = False
+                for literal in requirement:
+                    key = (literal, entry.ignorecase)
+                    hit = present.get(key)
+                    if hit is None:
+                        hit = present[key] = literal in haystack
+                    if hit:
+                        found = True
+                        break
+                if not found:
+                    ok = False
+                    break
+            if ok:
+                active.append(entry)
+        return active
+
+    def _combined_regex(self, entries):
+        key = tuple(entry.name for entry in entries)
+        combined = self._combined.get(key)
+        if combined is None:
+            if len(self._combined) >= COMBINED_CACHE_SIZE:
+                self._combined.clear()
+            alternatives = [f"(?P<p{i}>{entry.source})" for i, entry in enumerate(entries)]
+            combined = self._combined[key] = re.compile('|'.join(alternatives))
+        return combined
+
+    def iter_matches(self, text):
+        """Itère sur les (PatternEntry, re.Match) du texte, comme un finditer() par pattern."""
+        active = self.active_entries(text)
+        if not active:
+            return
+        combinable = [entry for entry in active if entry.source is not None]
+        start = len(text) + 1
+        if combinable:
+            first = self._combined_regex(combinable).search(text)
+            if first is not None:
+                start = first.start()
+        for entry in active:
+            if entry.source is None:
+                yield from ((entry, match) for match in entry.regex.finditer(text))
+            elif start <= len(text):
+                yield from ((entry, match) for match in entry.regex.finditer(text, start))
+
+
+class PatternSetDetector(Detector):
+    """Détecteur Scrubadub unique qui exécute tout un PatternSet."""
+    name = 'pattern_set'
+    autoload = False
+
+    def __init__(self, pattern_set, **kwargs):
+        super().__init__(**kwargs)
+        self.pattern_set = pattern_set
+
+    def iter_filth(self, text, document_name=None):
+        for entry, match in self.pattern_set.iter_matches(text):
+            yield entry.filth_cls(
+                match=match,
+                detector_name=entry.name,
+                document_name=document_name,
+                locale=self.locale,
+            )
@@ -0,0 +1,246 @@
+"""
+Pseudonymes déterministes par conversation
+
+Les placeholders génériques ({{EMAIL}}) ne distinguent pas deux valeurs du même type, et
+le moindre écart d'un tour à l'autre change le préfixe du prompt: le cache de prompt du
+fournisseur rate, sur des conversations longues où il rapporte le plus. Avec un scope
+(clé de conversation ou de tenant fournie par le gateway), chaque valeur détectée devient
+un placeholder stable {{EMAIL_3f2a9c1b}}: HMAC(PSEUDONYM_SECRET, scope, type, valeur).
+La même valeur donne le même placeholder à chaque tour, deux scopes ne se recoupent pas.
+
+Le coffre (PseudonymVault) garde placeholder → valeur par scope, avec un TTL, pour la
+réhydratation des réponses (/rehydrate). Il conserve les valeurs d'origine en clair: il est
+désactivé par défaut. Backends (PSEUDONYM_VAULT_BACKEND):
+- none (défaut): pseudonymes sans coffre (pas de réhydratation)
+- memory: LRU borné + TTL, propre à chaque worker: avec plusieurs workers gunicorn, une
+  réhydratation servie par un autre worker que l'anonymisation ne retrouve rien
+- disk: SQLite (PSEUDONYM_VAULT_PATH), partagé par les workers de l'hôte
+
+PSEUDONYM_SECRET doit être identique sur tous les workers et réplicas (et stable entre
+redémarrages) pour que les placeholders le soient: sans lui, un secret aléatoire est tiré
+au chargement du module (partagé par les workers grâce au preload, perdu au redémarrage).
+"""
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Placeholders produits par Pseudonymizer: {{TYPE_hex}}
+PLACEHOLDER_RE = re.compile(r"\{\{[A-Z0-9_]+_[0-9a-f]{4,64}\}\}")
+
+
+class Pseudonymizer:
+    """Placeholder stable d'une valeur détectée, pour un scope donné."""
+
+    def __init__(self, secret: bytes, length: int = 8):
+        if not 4 <= length <= 64:
+            raise ValueError(f"PSEUDONYM_LENGTH must be between 4 and 64 (got {length})")
+        self.secret = secret
+        self.length = length
+
+    @classmethod
+    def from_env(cls):
+        """PSEUDONYM_SECRET (aléatoire si absent), PSEUDONYM_LENGTH (caractères hexadécimaux)."""
+        secret = os.getenv("PSEUDONYM_SECRET", "")
+        if not secret:
+            logger.info("ℹ️ PSEUDONYM_SECRET not set: pseudonyms change on restart and differ between replicas")
+        return cls(
+            secret.encode("utf-8") if secret else secrets.token_bytes(32),
+            int(os.getenv("PSEUDONYM_LENGTH", "8"))
+        )
+
+    def placeholder(self, scope: str, label: str, value: str) -> str:
+        """{{LABEL_hash}}: même (scope, type, valeur) → même placeholder."""
+        message = f"{scope}\0{label}\0{value}".encode("utf-8")
+        digest = hmac.new(self.secret, message, hashlib.sha256).hexdigest()[:self.length]
+        label = re.sub(r"[^A-Z0-9]+", "_", label.upper()).strip("_") or "PII"
+        return f"{{{{{label}_{digest}}}}}"
+
+    def describe(self) -> dict:
+        return {"length": self.length}
+
+
+class MemoryVault:
+    """Coffre LRU en mémoire avec TTL, thread-safe."""
+
+    def __init__(self, max_entries: int = 100000, ttl: float = 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put_many(self, scope: str, mapping: dict):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for placeholder, value in mapping.items():
+                key = (scope, placeholder)
+                self._data.pop(key, None)
+                self._data[key] = (value, expires_at)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_many(self, scope: str, placeholders) -> dict:
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for placeholder in placeholders:
+                key = (scope, placeholder)
+                item = self._data.get(key)
+                if item is None:
+                    continue
+                if item[1] < now:
+                    del self._data[key]
+                    continue
+                self._data.move_to_end(key)
+                found[placeholder] = item[0]
+        return found
+
+    def size(self):
+        return len(self._data)
+
+
+class SqliteVault:
+    """
+    Coffre sur disque (SQLite en mode WAL), partagé entre les workers d'un même hôte.
+    Une connexion par processus (rouverte après un fork), TTL rafraîchi à chaque écriture.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000, ttl: float = 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pid = None
+        self._db = None
+
+    def _conn(self):
+        if self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS pseudonyms "
+                "(scope TEXT, placeholder TEXT, value TEXT, expires_at REAL, PRIMARY KEY (scope, placeholder))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS pseudonyms_expires_at ON pseudonyms (expires_at)")
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def put_many(self, scope: str, mapping: dict):
+        with self._lock:
+            db = self._conn()
+            now = time.time()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany(
+                    "INSERT OR REPLACE INTO pseudonyms VALUES (?, ?, ?, ?)",
+                    [(scope, placeholder, value, now + self.ttl) for placeholder, value in mapping.items()]
+                )
+                db.execute("DELETE FROM pseudonyms WHERE expires_at < ?", (now,))
+                # Au-delà de la limite: les entrées qui expirent le plus tôt d'abord
+                excess = db.execute("SELECT COUNT(*) FROM pseudonyms").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    db.execute(
+                        "DELETE FROM pseudonyms WHERE rowid IN "
+                        "(SELECT rowid FROM pseudonyms ORDER BY expires_at LIMIT ?)", (excess,)
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def get_many(self, scope: str, placeholders) -> dict:
+        placeholders = list(placeholders)
+        if not placeholders:
+            return {}
+        with self._lock:
+            rows = self._conn().execute(
+                f"SELECT placeholder, value FROM pseudonyms WHERE scope = ? AND expires_at >= ? "
+                f"AND placeholder IN ({','.join('?' * len(placeholders))})",
+                (scope, time.time(), *placeholders)
+            ).fetchall()
+        return dict(rows)
+
+    def size(self):
+        with self._lock:
+            return self._conn().execute("SELECT COUNT(*) FROM pseudonyms").fetchone()[0]
+
+
+class PseudonymVault:
+    """Placeholder → valeur d'origine par scope, pour réhydrater les réponses du LLM."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.recorded = 0
+        self.rehydrated = 0
+        self.errors = 0
+
+    def record(self, scope: str, mapping: dict):
+        """Enregistre les pseudonymes d'un texte. Un coffre indisponible n'empêche pas l'anonymisation."""
+        if not mapping:
+            return
+        try:
+            self.backend.put_many(scope, mapping)
+            self.recorded += len(mapping)
+        except Exception as e:
+            logger.warning(f"⚠️ Pseudonym vault unavailable: {e}")
+            self.errors += 1
+
+    def rehydrate(self, scope: str, text: str) -> tuple:
+        """Remplace les placeholders connus du scope par leur valeur. Retourne (texte, remplacements)."""
+        placeholders = set(PLACEHOLDER_RE.findall(text))
+        known = self.backend.get_many(scope, placeholders) if placeholders else {}
+        if not known:
+            return text, 0
+        count = 0
+
+        def restore(match):
+            nonlocal count
+            value = known.get(match.group(0))
+            if value is None:
+                return match.group(0)
+            count += 1
+            return value
+
+        text = PLACEHOLDER_RE.sub(restore, text)
+        self.rehydrated += count
+        return text, count
+
+    @classmethod
+    def from_env(cls):
+        """None si PSEUDONYM_VAULT_BACKEND=none. PSEUDONYM_VAULT_TTL, _MAX_ENTRIES, _PATH."""
+        backend_name = os.getenv("PSEUDONYM_VAULT_BACKEND", "none").lower()
+        ttl = float(os.getenv("PSEUDONYM_VAULT_TTL", "86400"))
+        max_entries = int(os.getenv("PSEUDONYM_VAULT_MAX_ENTRIES", "100000"))
+        if backend_name == "none":
+            return None
+        if backend_name == "disk":
+            path = os.getenv("PSEUDONYM_VAULT_PATH", "/tmp/pseudonym-vault/vault.sqlite3")
+            logger.info(f"✅ Pseudonym vault: disk ({path}, ttl={ttl}s)")
+            return cls(SqliteVault(path, max_entries, ttl))
+        if backend_name != "memory":
+            logger.warning(f"⚠️ Unknown PSEUDONYM_VAULT_BACKEND '{backend_name}', using memory")
+        if int(os.getenv("ANONYMIZER_WORKERS", "1")) > 1:
+            logger.warning("⚠️ Pseudonym vault 'memory' is per worker: use 'disk' with ANONYMIZER_WORKERS > 1")
+        logger.info(f"✅ Pseudonym vault: memory ({max_entries} entries, ttl={ttl}s)")
+        return cls(MemoryVault(max_entries, ttl))
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "recorded": self.recorded,
+            "rehydrated": self.rehydrated,
+            "errors": self.errors,
+        }
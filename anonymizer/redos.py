@@ -0,0 +1,573 @@
+"""
+Garde-fous ReDoS pour les patterns de patterns.json
+
+1. Analyse structurelle (structural_risk): quantificateurs imbriqués ou alternatives qui se
+   chevauchent sous une répétition non bornée. Déterministe, c'est le seul critère de rejet.
+2. Sondes au chargement/rechargement: chaque regex nouvelle ou modifiée est exécutée
+   sur des entrées adverses construites à partir de sa structure (préfixe du match répété
+   sans jamais le terminer, répétition "pompée" suivie d'un caractère qui le fait échouer),
+   à deux tailles. Un temps de scan qui croît nettement plus vite que la taille du texte
+   signale un backtracking super-linéaire; une sonde qui dépasse PROBE_TIMEOUT_S est
+   catastrophique. Les sondes tournent dans un processus forké sous limite de temps:
+   une regex exponentielle ne peut pas bloquer le chargement. Mesurés en temps réel, ces
+   verdicts dépendent de la charge de la machine: ils sont signalés, jamais rejetés.
+   Les résultats des sondes peuvent être calculés au build de l'image (cache REDOS_PROBE_CACHE,
+   cf. __main__): au démarrage, seuls les patterns absents du cache sont sondés.
+3. Limite de temps par scan (time_limit): SIGALRM interrompt le moteur regex, qui vérifie
+   les signaux pendant le matching. Disponible dans le thread principal d'un processus,
+   c'est-à-dire dans les workers sync et dans les processus du pool de scrubbing.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants  # Python >= 3.11
+except ImportError:  # pragma: no cover
+    import sre_parse
+    import sre_constants
+
+logger = logging.getLogger(__name__)
+
+# Tailles des textes adverses (caractères): un scan linéaire prend ~4x plus de temps sur le second
+PROBE_SIZES = (1024, 4096)
+# Croissance au-delà de laquelle le scan est super-linéaire (quadratique: ~16x)
+GROWTH_LIMIT = 9.0
+# En dessous de cette durée sur le grand texte, la croissance mesurée n'est que du bruit
+MIN_FLAGGED_MS = 1.0
+# Une sonde plus lente est catastrophique (exponentielle ou quadratique très coûteuse)
+PROBE_TIMEOUT_S = 0.25
+# Durée max de la validation d'un pattern set complet
+CHECK_TIMEOUT_S = 60.0
+
+POLICIES = ("reject", "flag", "off")
+# Résultat d'un pattern qui n'a pas été sondé (PatternGuard(probe=False))
+UNPROBED = {"verdict": None, "input": None, "ms": None, "growth": None}
+
+_REPEATS = tuple(op for op in (
+    sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, getattr(sre_constants, 'POSSESSIVE_REPEAT', None)
+) if op is not None)
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+_POSSESSIVE_REPEAT = getattr(sre_constants, 'POSSESSIVE_REPEAT', None)
+_CATEGORY_SAMPLES = {
+    sre_constants.CATEGORY_DIGIT: ('0', r'\d'),
+    sre_constants.CATEGORY_NOT_DIGIT: ('a', r'\D'),
+    sre_constants.CATEGORY_SPACE: (' ', r'\s'),
+    sre_constants.CATEGORY_NOT_SPACE: ('a', r'\S'),
+    sre_constants.CATEGORY_WORD: ('a', r'\w'),
+    sre_constants.CATEGORY_NOT_WORD: (' ', r'\W'),
+}
+
+
+class ScanTimeout(Exception):
+    """Le scan a dépassé sa limite de temps (levée depuis le gestionnaire SIGALRM)."""
+
+
+_unenforced_warned = False
+
+
+@contextmanager
+def time_limit(seconds):
+    """
+    Interrompt le bloc par ScanTimeout au-delà de `seconds`. Produit True si la limite est
+    appliquée, False hors du thread principal (la limite est alors ignorée).
+    """
+    global _unenforced_warned
+    if not seconds or seconds <= 0:
+        yield False
+        return
+    if threading.current_thread() is not threading.main_thread():
+        if not _unenforced_warned:
+            _unenforced_warned = True
+            logger.warning("⚠️ Scan time limit not enforced outside the main thread (use SCRUB_PROCESSES > 0)")
+        yield False
+        return
+
+    armed = [True]
+
+    def on_alarm(signum, frame):
+        # Le signal peut arriver juste après la fin du bloc: il est alors ignoré
+        if armed[0]:
+            raise ScanTimeout(seconds)
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield True
+    finally:
+        armed[0] = False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous if previous is not None else signal.SIG_DFL)
+
+
+# --- Entrées adverses ---
+
+def _in_class(char, items):
+    for op, av in items:
+        if op is sre_constants.LITERAL and ord(char) == av:
+            return True
+        if op is sre_constants.RANGE and av[0] <= ord(char) <= av[1]:
+            return True
+        if op is sre_constants.CATEGORY and av in _CATEGORY_SAMPLES and re.match(_CATEGORY_SAMPLES[av][1], char):
+            return True
+    return False
+
+
+def _class_sample(items):
+    """Un caractère accepté par la classe [...]."""
+    if items and items[0][0] is sre_constants.NEGATE:
+        for char in 'a0xZ_.-! ':
+            if not _in_class(char, items[1:]):
+                return char
+        return '\x00'
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            return chr(av)
+        if op is sre_constants.RANGE:
+            return chr(av[0])
+        if op is sre_constants.CATEGORY and av in _CATEGORY_SAMPLES:
+            return _CATEGORY_SAMPLES[av][0]
+    return 'a'
+
+
+def _render(items):
+    """Texte minimal accepté par une séquence sre_parse (meilleur effort)."""
+    out = []
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            out.append(chr(av))
+        elif op is sre_constants.NOT_LITERAL:
+            out.append('b' if av == ord('a') else 'a')
+        elif op is sre_constants.ANY:
+            out.append('a')
+        elif op is sre_constants.IN:
+            out.append(_class_sample(av))
+        elif op in _REPEATS:
+            out.append(_render(av[2]) * av[0])
+        elif op is sre_constants.SUBPATTERN:
+            out.append(_render(av[3]))
+        elif op is sre_constants.BRANCH:
+            out.append(_render(av[1][0]))
+        elif op is _ATOMIC_GROUP:
+            out.append(_render(av))
+    return ''.join(out)
+
+
+def _flatten(items):
+    """Aplatit les groupes: les entrées sont construites élément par élément."""
+    flat = []
+    for op, av in items:
+        if op is sre_constants.SUBPATTERN:
+            flat.extend(_flatten(av[3]))
+        else:
+            flat.append((op, av))
+    return flat
+
+
+def adversarial_inputs(pattern):
+    """
+    Gabarits (unité, tête, queue): le texte sondé est tête + unité répétée + queue.
+    Pour chaque préfixe de la regex: le préfixe répété, éventuellement suivi de l'élément
+    suivant ou d'un caractère qui fait échouer le match; pour chaque répétition: son motif
+    pompé après le début de la regex.
+    """
+    items = _flatten(list(sre_parse.parse(pattern)))
+    seen = set()
+    for k in range(1, len(items) + 1):
+        prefix = _render(items[:k])
+        following = _render(items[k:k + 1])
+        forms = [(prefix, '', ''), (prefix, '', following), (prefix, '', '\x00')] if prefix else []
+        op, av = items[k - 1]
+        if op in _REPEATS and (av[1] is sre_constants.MAXREPEAT or av[1] > 1):
+            unit = _render(av[2])
+            if unit:
+                head = _render(items[:k - 1])
+                forms += [(unit, head, following), (unit, head, '\x00')]
+        for form in forms:
+            if form[0] and form not in seen:
+                seen.add(form)
+                yield form
+
+
+# --- Analyse structurelle ---
+
+# Caractères testés pour décider si deux classes se chevauchent
+_OVERLAP_ALPHABET = [chr(c) for c in range(256)] + ['İ', 'ı', 'ſ', 'K', ' ', '中']
+_SINGLE_CHAR = (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN)
+
+
+def _class_matches(items, char):
+    negate = bool(items) and items[0][0] is sre_constants.NEGATE
+    for op, av in (items[1:] if negate else items):
+        if op is sre_constants.LITERAL and ord(char) == av:
+            break
+        if op is sre_constants.RANGE and av[0] <= ord(char) <= av[1]:
+            break
+        if op is sre_constants.CATEGORY and (av not in _CATEGORY_SAMPLES or re.match(_CATEGORY_SAMPLES[av][1], char)):
+            break  # catégorie inconnue: supposée contenir le caractère
+    else:
+        return negate
+    return not negate
+
+
+def _char_matches(item, char, ignorecase):
+    op, av = item
+    for candidate in ({char, char.lower(), char.upper()} if ignorecase else (char,)):
+        if op is sre_constants.LITERAL and ord(candidate) == av:
+            return True
+        if op is sre_constants.NOT_LITERAL and ord(candidate) != av:
+            return True
+        if op is sre_constants.ANY:
+            return True
+        if op is sre_constants.IN and _class_matches(av, candidate):
+            return True
+    return False
+
+
+def _overlap(left, right, ignorecase):
+    """Deux ensembles de classes (un caractère chacune) acceptent-ils un même caractère ?"""
+    return any(
+        any(_char_matches(a, char, ignorecase) for a in left) and any(_char_matches(b, char, ignorecase) for b in right)
+        for char in _OVERLAP_ALPHABET
+    )
+
+
+def _first(items):
+    """(classes des premiers caractères possibles, séquence pouvant matcher le vide)."""
+    firsts = []
+    for item in items:
+        item_firsts, nullable = _item_first(item)
+        firsts.extend(item_firsts)
+        if not nullable:
+            return firsts, False
+    return firsts, True
+
+
+def _item_first(item):
+    op, av = item
+    if op in _SINGLE_CHAR:
+        return [item], False
+    if op is sre_constants.SUBPATTERN:
+        return _first(av[3])
+    if op is _ATOMIC_GROUP:
+        return _first(av)
+    if op is sre_constants.BRANCH:
+        firsts, nullable = [], False
+        for alternative in av[1]:
+            alt_firsts, alt_nullable = _first(alternative)
+            firsts.extend(alt_firsts)
+            nullable = nullable or alt_nullable
+        return firsts, nullable
+    if op in _REPEATS:
+        firsts, nullable = _first(av[2])
+        return firsts, nullable or av[0] == 0
+    return [], True  # assertions, ancres, références: largeur nulle (ou inconnue)
+
+
+def _trailing_repeats(items):
+    """Répétitions de longueur variable par lesquelles une séquence peut se terminer."""
+    for item in reversed(items):
+        op, av = item
+        if op in _REPEATS:
+            if av[0] != av[1] and op is not _POSSESSIVE_REPEAT:
+                yield av[2]
+            yield from _trailing_repeats(av[2])
+        elif op is sre_constants.SUBPATTERN:
+            yield from _trailing_repeats(av[3])
+        elif op is _ATOMIC_GROUP:
+            yield from _trailing_repeats(av)
+        elif op is sre_constants.BRANCH:
+            for alternative in av[1]:
+                yield from _trailing_repeats(alternative)
+        if not _item_first(item)[1]:
+            return
+
+
+def _literal_text(items):
+    """Texte d'une séquence de littéraux, None si elle contient autre chose."""
+    if all(op is sre_constants.LITERAL for op, _ in items):
+        return ''.join(chr(av) for _, av in items)
+    return None
+
+
+def _ambiguous_branch(alternatives, ignorecase):
+    """Deux alternatives peuvent-elles commencer un même texte ?"""
+    for i, left in enumerate(alternatives):
+        for right in alternatives[i + 1:]:
+            left_text, right_text = _literal_text(left), _literal_text(right)
+            if left_text is not None and right_text is not None and not ignorecase:
+                if left_text.startswith(right_text) or right_text.startswith(left_text):
+                    return True
+            elif _overlap(_first(left)[0], _first(right)[0], ignorecase):
+                return True
+    return False
+
+
+def _branches(items):
+    """Alternations d'une séquence, hors répétitions imbriquées (analysées séparément)."""
+    for op, av in items:
+        if op is sre_constants.BRANCH:
+            yield av[1]
+            for alternative in av[1]:
+                yield from _branches(alternative)
+        elif op is sre_constants.SUBPATTERN:
+            yield from _branches(av[3])
+        elif op is _ATOMIC_GROUP:
+            yield from _branches(av)
+
+
+def _repeats(items):
+    """Toutes les répétitions d'une séquence (y compris dans les groupes et assertions)."""
+    for op, av in items:
+        if op in _REPEATS:
+            yield op, av
+            yield from _repeats(av[2])
+        elif op is sre_constants.SUBPATTERN:
+            yield from _repeats(av[3])
+        elif op is _ATOMIC_GROUP:
+            yield from _repeats(av)
+        elif op is sre_constants.BRANCH:
+            for alternative in av[1]:
+                yield from _repeats(alternative)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            yield from _repeats(av[1])
+
+
+def structural_risk(pattern):
+    """
+    Analyse déterministe (sans mesure de temps) d'une regex. Pour chaque répétition non
+    bornée (hors répétition possessive), retourne le premier risque de backtracking exponentiel:
+    - nested_quantifier: le corps peut se terminer par une répétition de longueur variable
+      dont les caractères peuvent aussi commencer le corps, ex: (a+)+, (\\w+\\s?)+
+      (ou le corps peut matcher le vide, ex: (a*)*)
+    - overlapping_alternation: deux alternatives du corps peuvent commencer un même texte,
+      ex: (a|ab)*, (ab|abc)+
+    None si aucune de ces structures n'est présente.
+    """
+    parsed = sre_parse.parse(pattern)
+    ignorecase = bool(parsed.state.flags & re.IGNORECASE)
+    for op, (low, high, body) in _repeats(list(parsed)):
+        if high is not sre_constants.MAXREPEAT or op is _POSSESSIVE_REPEAT:
+            continue
+        firsts, nullable = _first(body)
+        if nullable or any(_overlap(firsts, _first(inner)[0], ignorecase) for inner in _trailing_repeats(body)):
+            return "nested_quantifier"
+        if any(_ambiguous_branch(alternatives, ignorecase) for alternatives in _branches(body)):
+            return "overlapping_alternation"
+    return None
+
+
+def _describe(unit, head, tail):
+    return f"{head[:24]!r} + {unit[:24]!r} * N + {tail[:24]!r}"
+
+
+def _probe(regex, unit, head, tail, size):
+    text = head + unit * max(1, size // len(unit)) + tail
+    best = None
+    for _ in range(2):
+        started = time.perf_counter()
+        for _ in regex.finditer(text):
+            pass
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def probe_pattern(pattern):
+    """
+    Sonde une regex sur ses entrées adverses. Retourne un dict:
+    verdict (ok | superlinear | catastrophic), input (pire entrée), ms (grand texte), growth.
+    """
+    regex = re.compile(pattern)
+    worst = {"verdict": "ok", "input": None, "ms": 0.0, "growth": None}
+    small, large = PROBE_SIZES
+    for unit, head, tail in adversarial_inputs(pattern):
+        try:
+            with time_limit(PROBE_TIMEOUT_S):
+                t_small = _probe(regex, unit, head, tail, small)
+                t_large = _probe(regex, unit, head, tail, large)
+        except ScanTimeout:
+            return {"verdict": "catastrophic", "input": _describe(unit, head, tail),
+                    "ms": PROBE_TIMEOUT_S * 1000, "growth": None}
+        growth = t_large / max(t_small, 1e-7)
+        superlinear = t_large * 1000 >= MIN_FLAGGED_MS and growth >= GROWTH_LIMIT
+        if superlinear or (worst["verdict"] == "ok" and t_large * 1000 > worst["ms"]):
+            worst = {"verdict": "superlinear" if superlinear else "ok", "input": _describe(unit, head, tail),
+                     "ms": round(t_large * 1000, 3), "growth": round(growth, 1)}
+    return worst
+
+
+def _check_worker(patterns, conn):
+    try:
+        conn.send({name: probe_pattern(pattern) for name, pattern in patterns.items()})
+    except Exception as e:  # pragma: no cover - transmis au parent
+        conn.send(e)
+    finally:
+        conn.close()
+
+
+def check_patterns(patterns, timeout=CHECK_TIMEOUT_S):
+    """
+    Sonde les patterns dans un processus forké (les sondes y sont interrompues par SIGALRM,
+    quel que soit le thread appelant). Retourne {nom: résultat de probe_pattern}.
+    """
+    if not patterns:
+        return {}
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_check_worker, args=(patterns, sender), name="redos-check", daemon=True)
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            return {name: {"verdict": "catastrophic", "input": None, "ms": timeout * 1000, "growth": None}
+                    for name in patterns}
+        results = receiver.recv()
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.kill()
+        process.join()
+    if isinstance(results, Exception):
+        raise results
+    return results
+
+
+def probe_settings():
+    """Paramètres dont dépendent les verdicts: un cache produit avec d'autres est ignoré."""
+    return {
+        "python": f"{sys.version_info.major}.{sys.version_info.minor}",
+        "probe_sizes": list(PROBE_SIZES),
+        "growth_limit": GROWTH_LIMIT,
+        "min_flagged_ms": MIN_FLAGGED_MS,
+        "probe_timeout_s": PROBE_TIMEOUT_S,
+    }
+
+
+class PatternGuard:
+    """
+    Validation des patterns au chargement selon PATTERN_REDOS_POLICY:
+    - reject (défaut): un pattern dont la structure est à risque (structural_risk) fait échouer
+      le chargement (la version en service est conservée); un verdict de sonde est seulement signalé
+    - flag: le pattern est chargé, signalé dans les logs et /health (la limite de temps par scan s'applique)
+    - off: pas de validation
+    Les résultats sont mis en cache par source de regex: seuls les patterns modifiés sont sondés.
+    """
+
+    def __init__(self, policy="reject", probe=True):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown ReDoS policy '{policy}' (expected one of {list(POLICIES)})")
+        self.policy = policy
+        # False: analyse structurelle seule (pas de sonde, donc pas de processus forké)
+        self.probe = probe
+        self.flagged = {}
+        self._results = {}
+        self._structures = {}
+        self.preloaded = 0
+
+    @classmethod
+    def from_env(cls, probe=True):
+        """PATTERN_REDOS_POLICY, REDOS_PROBE_CACHE (résultats de sondes déjà calculés, optionnel)."""
+        guard = cls(os.getenv("PATTERN_REDOS_POLICY", "reject").lower(), probe)
+        cache = os.getenv("REDOS_PROBE_CACHE", "")
+        if cache and guard.policy != "off":
+            guard.load_probe_cache(cache)
+        return guard
+
+    def preload(self, results):
+        """Reprend des résultats déjà calculés ({source de regex: résultat}). Retourne leur nombre."""
+        for pattern, result in results.items():
+            self._results.setdefault(pattern, result)
+        self.preloaded += len(results)
+        return len(results)
+
+    def load_probe_cache(self, path):
+        """
+        Reprend les résultats de sondes produits par export(). Un cache absent, illisible
+        ou produit avec d'autres paramètres de sonde est ignoré: les patterns seront sondés.
+        """
+        try:
+            with open(path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ ReDoS probe cache {path} ignored: {e}")
+            return 0
+        if not isinstance(cache, dict) or cache.get("settings") != probe_settings():
+            logger.warning(f"⚠️ ReDoS probe cache {path} ignored: built with other probe settings")
+            return 0
+        count = self.preload(cache.get("results") or {})
+        logger.info(f"✅ Loaded {count} cached ReDoS probe results from {path}")
+        return count
+
+    def export(self):
+        """Cache JSON des résultats de sondes connus (cf. load_probe_cache)."""
+        return {"settings": probe_settings(), "results": dict(self._results)}
+
+    def validate(self, patterns):
+        """
+        Analyse et sonde les nouveaux patterns. Retourne {nom: résultat} des patterns signalés:
+        structure à risque ("structure", déterministe) ou verdict de sonde autre que ok (mesure
+        de temps, indicative: elle dépend de la charge de la machine).
+        """
+        if self.policy == "off":
+            return {}
+        for name, pattern in patterns.items():
+            if pattern not in self._structures:
+                self._structures[pattern] = structural_risk(pattern)
+                if self._structures[pattern]:
+                    logger.warning(f"⚠️ Pattern '{name}' has a {self._structures[pattern]}")
+        unchecked = {name: pattern for name, pattern in patterns.items() if pattern not in self._results}
+        for name, result in (check_patterns(unchecked) if unchecked and self.probe else {}).items():
+            self._results[patterns[name]] = result
+            if result["verdict"] != "ok":
+                logger.warning(f"⚠️ Pattern '{name}' is {result['verdict']} on {result['input']} ({result['ms']}ms)")
+        flagged = {}
+        for name, pattern in patterns.items():
+            result = {**self._results.get(pattern, UNPROBED), "structure": self._structures[pattern]}
+            if result["structure"] or result["verdict"] not in ("ok", None):
+                flagged[name] = result
+        return flagged
+
+    def rejected(self, flagged):
+        """
+        Patterns signalés que la politique refuse: avec reject, ceux dont la structure est à
+        risque. Un verdict de sonde seul ne fait jamais échouer le chargement.
+        """
+        if self.policy != "reject":
+            return {}
+        return {name: result for name, result in flagged.items() if result.get("structure")}
+
+    def describe(self):
+        return {"policy": self.policy, "probe": self.probe, "flagged": self.flagged, "preloaded": self.preloaded}
+
+
+def main(argv=None):
+    """
+    Calcule le cache des résultats de sondes au build de l'image:
+        python redos.py patterns.json redos_probes.json
+    Les patterns signalés sont écrits dans le cache (le chargement applique ensuite la politique).
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("usage: python redos.py PATTERNS_FILE PROBE_CACHE", file=sys.stderr)
+        return 2
+    with open(argv[0]) as f:
+        patterns = json.load(f)
+    guard = PatternGuard("flag")
+    flagged = guard.validate(patterns)
+    with open(argv[1], "w") as f:
+        json.dump(guard.export(), f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"✅ {len(patterns)} patterns checked ({len(flagged)} flagged) -> {argv[1]}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Projection des résultats et négociation du format de réponse
+
+Un résultat /anonymize complet contient la liste des détections, avec une copie de
+chaque secret trouvé. Le gateway n'en lit que le texte anonymisé et deux compteurs:
+- fields: liste des champs de résultat à retourner (corps JSON "fields", liste ou chaîne
+  séparée par des virgules, ou paramètre ?fields=). Sans fields, le résultat est complet.
+  Les items en erreur d'un batch gardent leurs champs d'erreur.
+- Accept: application/msgpack: réponse encodée en MessagePack (plus compacte, plus rapide
+  à produire et à décoder que JSON). Les corps de requête MessagePack sont aussi acceptés.
+  Dépendance optionnelle: sans le paquet msgpack, les réponses restent en JSON.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+MSGPACK_MIMETYPE = "application/msgpack"
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, "application/x-msgpack")
+
+# Champs d'un résultat /anonymize (anonymize_result)
+RESULT_FIELDS = (
+    "anonymized", "original_length", "anonymized_length", "detections_count", "detections",
+    "pii_count", "secrets_count", "tiers",
+)
+
+try:
+    import msgpack
+except ImportError:  # dépendance optionnelle
+    msgpack = None
+
+
+def parse_fields(value):
+    """
+    Champs demandés (tuple), ou None pour le résultat complet.
+    Lève ValueError si un champ est inconnu.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)) or not all(isinstance(name, str) for name in value):
+        raise ValueError("'fields' must be a list of field names")
+    fields = tuple(dict.fromkeys(name.strip() for name in value if name.strip()))
+    unknown = [name for name in fields if name not in RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields {unknown} (expected some of {list(RESULT_FIELDS)})")
+    return fields or None
+
+
+def project(result, fields):
+    """Ne garde que les champs demandés d'un résultat (inchangé si fields est None)."""
+    if fields is None:
+        return result
+    return {name: result[name] for name in fields if name in result}
+
+
+def accepts_msgpack(accept_mimetypes):
+    """True si le client préfère MessagePack à JSON (et que msgpack est installé)."""
+    if msgpack is None:
+        return False
+    # JSON en premier: à qualité égale (*/*, absence d'Accept), JSON reste le format par défaut
+    best = accept_mimetypes.best_match(("application/json",) + MSGPACK_MIMETYPES)
+    return best in MSGPACK_MIMETYPES
+
+
+def is_msgpack(mimetype):
+    return mimetype in MSGPACK_MIMETYPES
+
+
+def decode_msgpack(body):
+    """Corps de requête MessagePack → objet Python (None si illisible ou msgpack absent)."""
+    if msgpack is None:
+        return None
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        logger.warning(f"⚠️ Invalid MessagePack body: {e}")
+        return None
+
+
+def encode_msgpack(payload):
+    return msgpack.packb(payload, use_bin_type=True)
@@ -0,0 +1,114 @@
+"""
+Unit Tests for the benchmark corpus and regression gate
+"""
+import json
+import os
+
+import pytest
+
+import benchmark
+from pattern_set import PatternSet
+
+with open(benchmark.PATTERNS_FILE) as f:
+    PATTERN_SET = PatternSet.from_dict(json.load(f))
+
+
+def found(documents):
+    return {entry.name for document in documents for entry, _ in PATTERN_SET.iter_matches(document)}
+
+
+def report(calibration_ms, results):
+    return {"environment": {"calibration_ms": calibration_ms}, "results": results}
+
+
+class TestCorpus:
+    """Tests for the synthetic corpora."""
+
+    @pytest.mark.parametrize('name', benchmark.CORPORA)
+    def test_corpus_is_reproducible(self, name):
+        assert benchmark.build_corpus(name, scale=0.1) == benchmark.build_corpus(name, scale=0.1)
+        assert benchmark.build_corpus(name, seed=1, scale=0.1) != benchmark.build_corpus(name, seed=2, scale=0.1)
+
+    def test_corpora_contain_their_secrets(self):
+        assert {'openai_key', 'aws_access_key', 'github_token', 'stripe_key', 'connection_string'} <= \
+            found(benchmark.build_corpus('code_keys'))
+        assert {'bearer_token', 'jwt_token'} <= found(benchmark.build_corpus('jwt_logs'))
+        assert {'private_key', 'certificate'} <= found(benchmark.build_corpus('pem_blocks'))
+
+    def test_secret_free_corpus_has_no_secret(self):
+        assert found(benchmark.build_corpus('secret_free', scale=0.25)) == set()
+
+
+class TestRegressionGate:
+    """Tests for the baseline comparison."""
+
+    BASELINE = report(10.0, {"pattern:email": {"code_keys": {"chars_per_sec": 1000000, "p50_ms": 0.1}}})
+
+    def test_slowdown_is_reported(self):
+        current = report(10.0, {"pattern:email": {"code_keys": {"chars_per_sec": 500000, "p50_ms": 0.2}}})
+        regressions = benchmark.compare(current, self.BASELINE, threshold=0.3)
+        assert len(regressions) == 1
+        assert regressions[0].startswith('code_keys: 0.50x')
+
+    def test_slower_machine_is_not_a_regression(self):
+        current = report(20.0, {"pattern:email": {"code_keys": {"chars_per_sec": 500000, "p50_ms": 0.2}}})
+        assert benchmark.compare(current, self.BASELINE, threshold=0.3) == []
+
+    def test_failing_target_is_a_regression(self):
+        current = report(10.0, {"pattern:email": {"code_keys": {"error": "boom"}}})
+        assert benchmark.compare(current, self.BASELINE) == ['pattern:email on code_keys: boom']
+
+    def test_new_targets_are_ignored(self):
+        current = report(10.0, {"pattern:new": {"code_keys": {"chars_per_sec": 1, "p50_ms": 1}}})
+        assert benchmark.compare(current, self.BASELINE) == []
+
+    def test_single_target_is_not_gated_alone(self):
+        baseline = report(10.0, {
+            "pattern:email": {"code_keys": {"chars_per_sec": 1000000, "p50_ms": 2.0}},
+            "pattern:url": {"code_keys": {"chars_per_sec": 100000000, "p50_ms": 0.002}},
+        })
+        current = report(10.0, {
+            "pattern:email": {"code_keys": {"chars_per_sec": 1000000, "p50_ms": 2.0}},
+            "pattern:url": {"code_keys": {"chars_per_sec": 50000000, "p50_ms": 0.004}},
+        })
+        assert benchmark.compare(current, baseline, threshold=0.3) == []
+
+    def test_corpus_total_is_gated(self):
+        baseline = report(10.0, {
+            "pattern:email": {"code_keys": {"chars_per_sec": 1000000, "p50_ms": 2.0}},
+            "pattern:url": {"code_keys": {"chars_per_sec": 1000000, "p50_ms": 2.0}},
+        })
+        current = report(10.0, {
+            "pattern:email": {"code_keys": {"chars_per_sec": 500000, "p50_ms": 4.0}},
+            "pattern:url": {"code_keys": {"chars_per_sec": 1000000, "p50_ms": 2.0}},
+        })
+        regressions = benchmark.compare(current, baseline, threshold=0.3)
+        assert len(regressions) == 1
+        assert regressions[0] == 'code_keys: 0.67x baseline throughput (tolerance 30%)'
+
+    def test_measured_noise_widens_the_tolerance(self):
+        current = report(10.0, {"pattern:email": {"code_keys": {"chars_per_sec": 600000, "spread": 0.8}}})
+        assert benchmark.compare(current, self.BASELINE, threshold=0.3) == []
+        current["results"]["pattern:email"]["code_keys"]["spread"] = 0.05
+        assert len(benchmark.compare(current, self.BASELINE, threshold=0.3)) == 1
+
+    def test_saved_reports_are_compared_without_running(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(benchmark, 'run', lambda *args, **kwargs: pytest.fail('benchmarks ran'))
+        baseline, current = tmp_path / 'base.json', tmp_path / 'head.json'
+        baseline.write_text(json.dumps(self.BASELINE))
+        current.write_text(json.dumps(report(10.0, {"pattern:email": {"code_keys": {"chars_per_sec": 500000}}})))
+        assert benchmark.main(['--report', str(current), '--baseline', str(baseline), '--threshold', '0.5']) == 1
+        assert benchmark.main(['--report', str(current), '--baseline', str(baseline), '--threshold', '1.5']) == 0
+
+    def test_shipped_baseline_matches_patterns(self):
+        # Un changement de patterns.json s'accompagne d'une baseline régénérée (--update-baseline)
+        with open(os.path.join(os.path.dirname(benchmark.PATTERNS_FILE), 'benchmark_baseline.json')) as f:
+            assert json.load(f)['config']['patterns'] == benchmark.patterns_digest()
+
+    def test_measure(self):
+        result = benchmark.measure(len, ['abc', 'defg'], repeats=2)
+        assert result['docs'] == 2
+        assert result['chars_per_sec'] > 0
+        assert result['p50_ms'] <= result['p99_ms']
+        assert result['rounds'] >= 2
+        assert result['spread'] >= 0
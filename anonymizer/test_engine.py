@@ -0,0 +1,95 @@
+"""
+Unit Tests for the importable scrubbing library
+"""
+import json
+import os
+
+import pytest
+
+import app as app_module
+from engine import ScrubEngine
+from pseudonyms import Pseudonymizer
+from redos import PatternGuard
+from tiers import DetectionBlocked, NlpPolicy
+
+PATTERNS_PATH = os.path.join(os.path.dirname(__file__), 'patterns.json')
+SAMPLE = "John Smith (john@example.com) used key sk-abcdefghijklmnopqrstuvwxyz123456"
+
+
+@pytest.fixture
+def patterns_file(tmp_path):
+    path = tmp_path / 'patterns.json'
+    path.write_text(json.dumps({'tok': 'tok_[a-z]+'}))
+    return path
+
+
+class TestScrubEngine:
+    """Tests for the embeddable engine."""
+
+    def test_same_results_as_the_service(self):
+        engine = ScrubEngine(PATTERNS_PATH, policy=app_module.DETECTION_POLICY, guard=PatternGuard('off'))
+        engine.load()
+        result = engine.anonymize(SAMPLE)
+        expected = app_module.anonymize_result(SAMPLE)
+        for key in ('anonymized', 'detections', 'pii_count', 'secrets_count'):
+            assert result[key] == expected[key]
+        assert engine.version == app_module.PATTERNS_VERSION
+
+    def test_reloads_when_the_file_changes(self, patterns_file):
+        engine = ScrubEngine(str(patterns_file), guard=PatternGuard('off'))
+        assert engine.check_file() is True
+        version = engine.version
+        assert engine.check_file() is False
+        patterns_file.write_text(json.dumps({'tok': 'tok_[a-z]+', 'ref': 'REF-[0-9]{6}'}))
+        assert engine.check_file() is True
+        assert engine.version != version
+        assert 'REF-123456' not in engine.anonymize('order REF-123456')['anonymized']
+
+    def test_failed_reload_keeps_the_active_set(self, patterns_file):
+        engine = ScrubEngine(str(patterns_file), guard=PatternGuard('reject'))
+        engine.load()
+        version = engine.version
+        patterns_file.write_text(json.dumps({'evil': '(a+)+$'}))
+        assert engine.check_file() is False
+        assert engine.version == version
+
+    def test_first_load_failure_raises(self, patterns_file):
+        patterns_file.write_text(json.dumps({'evil': '(a+)+$'}))
+        with pytest.raises(ValueError):
+            ScrubEngine(str(patterns_file), guard=PatternGuard('reject')).load()
+
+    def test_policy_is_enforced(self, patterns_file):
+        engine = ScrubEngine(str(patterns_file), policy=NlpPolicy.from_profile('balanced', max_chars=20),
+                             guard=PatternGuard('off'))
+        engine.load()
+        with pytest.raises(DetectionBlocked):
+            engine.anonymize("Please forward this long message to John Smith today.")
+
+    def test_scoped_pseudonyms(self):
+        engine = ScrubEngine(PATTERNS_PATH, policy=app_module.DETECTION_POLICY, guard=PatternGuard('off'),
+                             pseudonymizer=Pseudonymizer(b'secret'))
+        engine.load()
+        first = engine.anonymize("mail john@example.com", scope='conv-1')
+        assert first['anonymized'] == engine.anonymize("mail john@example.com", scope='conv-1')['anonymized']
+        placeholder = first['anonymized'].split(' ')[1]
+        assert first['pseudonyms'] == {placeholder: 'john@example.com'}
+        assert engine.anonymize("mail john@example.com", scope='conv-2')['anonymized'] != first['anonymized']
+
+    def test_invalid_regex_is_skipped(self, patterns_file):
+        patterns_file.write_text(json.dumps({'bad': '([a-z', 'ok': r'foo\d+'}))
+        engine = ScrubEngine(str(patterns_file), policy=NlpPolicy.from_profile('fast'), guard=PatternGuard('reject'))
+        engine.load()
+        assert engine.patterns == {'ok': r'foo\d+'}
+        assert engine.anonymize('ref foo123')['anonymized'] == 'ref {{OK}}'
+
+    def test_sync_follows_a_snapshot_without_probing(self, patterns_file):
+        source = ScrubEngine(str(patterns_file), policy=NlpPolicy.from_profile('fast'), guard=PatternGuard('off'))
+        source.load()
+        replica = ScrubEngine(str(patterns_file), policy=NlpPolicy.from_profile('fast'), guard=PatternGuard('reject'))
+        replica.load()
+        patterns_file.write_text(json.dumps({'tok': 'tok_[a-z]+', 'ref': 'REF-[0-9]{6}'}))
+        source.load()
+        assert replica.sync(*source.snapshot) is True
+        assert replica.sync(*source.snapshot) is False
+        assert replica.version == source.version
+        assert replica.anonymize('order REF-123456')['anonymized'] == 'order {{REF}}'
@@ -0,0 +1,85 @@
+"""
+Unit Tests for deterministic pseudonyms and the rehydration vault
+"""
+from unittest.mock import patch
+
+import pytest
+
+from pseudonyms import MemoryVault, PLACEHOLDER_RE, Pseudonymizer, PseudonymVault, SqliteVault
+
+
+class TestPseudonymizer:
+    """Tests for keyed-hash placeholders."""
+
+    def test_same_value_same_placeholder(self):
+        pseudonymizer = Pseudonymizer(b'secret')
+        first = pseudonymizer.placeholder('conv-1', 'EMAIL', 'john@example.com')
+        assert first == pseudonymizer.placeholder('conv-1', 'EMAIL', 'john@example.com')
+        assert PLACEHOLDER_RE.fullmatch(first)
+        assert first.startswith('{{EMAIL_') and len(first) == len('{{EMAIL_}}') + 8
+
+    def test_scopes_values_and_secrets_differ(self):
+        pseudonymizer = Pseudonymizer(b'secret')
+        placeholder = pseudonymizer.placeholder('conv-1', 'EMAIL', 'john@example.com')
+        assert placeholder != pseudonymizer.placeholder('conv-2', 'EMAIL', 'john@example.com')
+        assert placeholder != pseudonymizer.placeholder('conv-1', 'EMAIL', 'jane@example.com')
+        assert placeholder != Pseudonymizer(b'other').placeholder('conv-1', 'EMAIL', 'john@example.com')
+
+    def test_merged_labels_are_sanitized(self):
+        placeholder = Pseudonymizer(b'secret', length=4).placeholder('s', 'EMAIL+URL', 'x')
+        assert PLACEHOLDER_RE.fullmatch(placeholder)
+        assert placeholder.startswith('{{EMAIL_URL_')
+
+    def test_invalid_length(self):
+        with pytest.raises(ValueError):
+            Pseudonymizer(b'secret', length=2)
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def vault(request, tmp_path):
+    if request.param == 'disk':
+        return PseudonymVault(SqliteVault(str(tmp_path / 'vault.sqlite3'), max_entries=3, ttl=60))
+    return PseudonymVault(MemoryVault(max_entries=3, ttl=60))
+
+
+class TestPseudonymVault:
+    """Tests for the rehydration vault backends."""
+
+    def test_rehydrates_known_placeholders_only(self, vault):
+        vault.record('conv-1', {'{{EMAIL_3f2a9c1b}}': 'john@example.com'})
+        text, count = vault.rehydrate('conv-1', 'Write to {{EMAIL_3f2a9c1b}} and {{EMAIL_00000000}} ({{EMAIL}})')
+        assert text == 'Write to john@example.com and {{EMAIL_00000000}} ({{EMAIL}})'
+        assert count == 1
+
+    def test_scopes_are_isolated(self, vault):
+        vault.record('conv-1', {'{{EMAIL_3f2a9c1b}}': 'john@example.com'})
+        assert vault.rehydrate('conv-2', '{{EMAIL_3f2a9c1b}}') == ('{{EMAIL_3f2a9c1b}}', 0)
+
+    def test_entry_limit(self, vault):
+        for i in range(5):
+            vault.record('conv-1', {f'{{{{NAME_{i:08x}}}}}': f'name {i}'})
+        assert vault.backend.size() == 3
+        assert vault.rehydrate('conv-1', '{{NAME_00000000}} {{NAME_00000004}}')[0] == '{{NAME_00000000}} name 4'
+
+    def test_expired_entries_are_not_served(self, vault):
+        vault.record('conv-1', {'{{EMAIL_3f2a9c1b}}': 'john@example.com'})
+        later = 10 ** 10
+        with patch('pseudonyms.time.time', return_value=later), \
+                patch('pseudonyms.time.monotonic', return_value=later):
+            assert vault.rehydrate('conv-1', '{{EMAIL_3f2a9c1b}}')[1] == 0
+
+    def test_unavailable_backend_does_not_raise_on_record(self, vault):
+        with patch.object(vault.backend, 'put_many', side_effect=OSError('disk full')):
+            vault.record('conv-1', {'{{EMAIL_3f2a9c1b}}': 'john@example.com'})
+        assert vault.errors == 1
+
+    def test_from_env(self, monkeypatch, tmp_path):
+        monkeypatch.delenv('PSEUDONYM_VAULT_BACKEND', raising=False)
+        assert PseudonymVault.from_env() is None  # désactivé par défaut
+        monkeypatch.setenv('PSEUDONYM_VAULT_BACKEND', 'memory')
+        assert isinstance(PseudonymVault.from_env().backend, MemoryVault)
+        monkeypatch.setenv('PSEUDONYM_VAULT_BACKEND', 'none')
+        assert PseudonymVault.from_env() is None
+        monkeypatch.setenv('PSEUDONYM_VAULT_BACKEND', 'disk')
+        monkeypatch.setenv('PSEUDONYM_VAULT_PATH', str(tmp_path / 'v.sqlite3'))
+        assert isinstance(PseudonymVault.from_env().backend, SqliteVault)
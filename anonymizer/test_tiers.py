@@ -0,0 +1,121 @@
+"""
+Unit Tests for tiered detection policies
+"""
+import time
+
+import pytest
+import scrubadub
+from scrubadub.detectors import TextBlobNameDetector
+from unittest.mock import patch
+
+import tiers
+from tiers import DetectionBlocked, NlpPolicy, TierStats, prose_stats, scan, split_segments
+
+PROSE = 'Please send the quarterly report to John Smith before the meeting. '
+
+
+@pytest.fixture
+def scrubber():
+    scrubber = scrubadub.Scrubber()
+    scrubber.add_detector(TextBlobNameDetector)
+    return scrubber
+
+
+class TestNlpPolicy:
+    """Tests for the gating decision."""
+
+    def test_prose_stats(self):
+        assert prose_stats('Hello there, John!') == (3, 1.0)
+        assert prose_stats('') == (0, 0.0)
+        words, ratio = prose_stats('x = foo(bar) + 42  # ok then')
+        assert ratio < 0.5
+
+    def test_low_prose_is_skipped(self):
+        policy = NlpPolicy.from_profile('balanced')
+        assert policy.decide('{"a": 1, "b": [2, 3]}') == 'low_prose'
+        assert policy.decide(PROSE) is None
+
+    def test_too_long_blocks_instead_of_skipping(self):
+        policy = NlpPolicy.from_profile('balanced', max_chars=10)
+        with pytest.raises(DetectionBlocked) as excinfo:
+            policy.decide(PROSE)
+        assert excinfo.value.reason == 'text_too_long'
+
+    def test_full_profile_has_no_limits(self):
+        policy = NlpPolicy.from_profile('full')
+        assert policy.decide('{}' * 100000) is None
+
+    def test_unknown_profile(self):
+        with pytest.raises(ValueError):
+            NlpPolicy.from_profile('turbo')
+
+    def test_env_overrides(self, monkeypatch):
+        monkeypatch.setenv('DETECTION_PROFILE', 'full')
+        monkeypatch.setenv('NLP_BUDGET_MS', '50')
+        monkeypatch.setenv('SCAN_TIMEOUT_MS', '250')
+        policy = NlpPolicy.from_env()
+        assert policy.profile == 'full'
+        assert policy.budget_ms == 50.0
+        assert policy.scan_timeout_ms == 250.0
+
+
+class TestScan:
+    """Tests for the tiered scan."""
+
+    def test_split_segments_keeps_text(self):
+        text = PROSE * 100
+        segments = split_segments(text, size=500)
+        assert ''.join(segments) == text
+        assert all(len(segment) <= 500 for segment in segments)
+        assert all(segment.endswith(' ') for segment in segments)
+
+    def test_segmented_nlp_matches_whole_text(self, scrubber):
+        text = PROSE * 100
+        whole, _ = scan(scrubber, text, NlpPolicy.from_profile('full'))
+        segmented, report = scan(scrubber, text, NlpPolicy.from_profile('balanced', budget_ms=60000))
+        assert report['nlp']['ran']
+        assert [(f.beg, f.end) for f in segmented] == [(f.beg, f.end) for f in whole]
+
+    def test_budget_exceeded_blocks(self, scrubber):
+        policy = NlpPolicy.from_profile('balanced', budget_ms=1)
+        clock = iter(range(0, 1000))
+        with patch('tiers.time.perf_counter', side_effect=lambda: next(clock)):
+            with pytest.raises(DetectionBlocked) as excinfo:
+                scan(scrubber, PROSE * 100, policy)
+        assert excinfo.value.reason == 'budget_exceeded'
+
+    def test_scan_timeout_blocks_regex_tier(self, scrubber):
+        policy = NlpPolicy.from_profile('full', scan_timeout_ms=50)
+        with patch.object(scrubadub.detectors.EmailDetector, 'iter_filth', side_effect=lambda text: time.sleep(2) or []):
+            with pytest.raises(DetectionBlocked) as excinfo:
+                scan(scrubber, PROSE, policy)
+        assert (excinfo.value.tier, excinfo.value.reason) == ('fast', 'scan_timeout')
+
+    def test_large_prompt_under_full_is_not_cut_by_scan_timeout(self, scrubber):
+        # Le palier NLP d'un long texte dépasse la limite de scan sans être interrompu
+        policy = NlpPolicy.from_profile('full', scan_timeout_ms=50)
+        with patch.object(TextBlobNameDetector, 'iter_filth', side_effect=lambda text: time.sleep(0.2) or []):
+            _, report = scan(scrubber, PROSE * 2000, policy)
+        assert report['nlp']['ran'] is True
+        assert report['nlp']['ms'] >= 200
+
+    def test_blocked_error_survives_pickling(self):
+        import pickle
+        error = pickle.loads(pickle.dumps(DetectionBlocked('nlp', 'budget_exceeded')))
+        assert (error.tier, error.reason) == ('nlp', 'budget_exceeded')
+
+
+class TestTierStats:
+    """Tests for per-tier counters."""
+
+    def test_snapshot(self):
+        stats = TierStats()
+        stats.record({'fast': {'ran': True, 'ms': 1.0}, 'nlp': {'ran': False, 'reason': 'low_prose', 'ms': 0.0}})
+        stats.record({'fast': {'ran': True, 'ms': 3.0}, 'nlp': {'ran': True, 'ms': 20.0}})
+        stats.record_blocked(DetectionBlocked('nlp', 'budget_exceeded'))
+        snapshot = stats.snapshot()
+        assert snapshot['fast']['runs'] == 2
+        assert snapshot['fast']['p99_ms'] == 3.0
+        assert snapshot['nlp']['skipped'] == {'low_prose': 1}
+        assert snapshot['nlp']['blocked'] == {'budget_exceeded': 1}
+        assert tiers.NLP_DETECTORS == {'text_blob_name'}
@@ -0,0 +1,279 @@
+"""
+Détection par paliers avec budget de latence
+
+- fast: détecteurs regex (PatternSet + détecteurs natifs scrubadub), toujours exécutés
+- nlp: détection de noms par étiquetage morpho-syntaxique (TextBlob), coûteuse,
+  exécutée selon une politique explicite (profil):
+    * quantité minimale de texte en langue naturelle (le code et les logs n'en ont pas besoin)
+    * longueur maximale du texte
+    * budget de temps par requête
+
+Le palier fast est en outre borné par scan_timeout_ms (SCAN_TIMEOUT_MS): une regex qui
+dérape sur un texte adverse est interrompue (redos.time_limit) au lieu de bloquer le worker.
+Le palier NLP, dont la durée croît avec la longueur du texte, n'est borné que par le budget
+de son profil (aucun pour full).
+
+La politique échoue en mode fermé: un texte qui devrait passer par le palier NLP mais
+dépasse la longueur ou le budget lève DetectionBlocked (la requête est bloquée), il n'est
+jamais renvoyé avec une analyse partielle. Chaque résultat indique les paliers exécutés
+et leur durée.
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import scrubadub
+from scrubadub.detectors import TextBlobNameDetector
+
+from redos import ScanTimeout, time_limit
+
+# Détecteurs du palier NLP (tous les autres font partie du palier fast)
+NLP_DETECTORS = {TextBlobNameDetector.name}
+
+# Profils: paramètres de la politique NLP (surchargés par les variables NLP_*)
+PROFILES = {
+    # Regex uniquement
+    "fast": {"nlp": False},
+    # NLP seulement sur du texte rédigé, avec plafond de longueur et budget (opt-in: les noms
+    # d'un texte court ou peu rédigé, "Hi John", ne sont pas détectés)
+    "balanced": {"nlp": True, "min_prose_words": 3, "min_prose_ratio": 0.3, "max_chars": 50000, "budget_ms": 1000},
+    # NLP sur tout, sans limite (comportement historique, défaut)
+    "full": {"nlp": True, "min_prose_words": 0, "min_prose_ratio": 0.0, "max_chars": 0, "budget_ms": 0},
+}
+DEFAULT_PROFILE = "full"
+
+# Limite de temps du palier fast (regex), tous profils (0 = pas de limite)
+DEFAULT_SCAN_TIMEOUT_MS = 5000
+
+# Taille des segments analysés entre deux vérifications du budget
+NLP_SEGMENT_CHARS = 2000
+
+# Mot "rédigé": lettres uniquement, ponctuation de phrase autour tolérée
+PROSE_WORD = re.compile(r"""[("'«]?[^\W\d_]{2,}[.,;:!?'")»]*""")
+SEGMENT_BREAK = re.compile(r"\n\s*\n|(?<=[.!?])\s+|\n")
+
+
+class DetectionBlocked(Exception):
+    """Un palier requis n'a pas pu s'exécuter dans les limites de la politique."""
+
+    def __init__(self, tier, reason):
+        super().__init__(tier, reason)
+        self.tier = tier
+        self.reason = reason
+
+    def __str__(self):
+        return f"Detection blocked: {self.tier} tier {self.reason}"
+
+
+class NlpPolicy:
+    """Politique d'exécution du palier NLP (0 = pas de limite)."""
+
+    def __init__(self, profile=DEFAULT_PROFILE, nlp=True, min_prose_words=0, min_prose_ratio=0.0,
+                 max_chars=0, budget_ms=0, scan_timeout_ms=DEFAULT_SCAN_TIMEOUT_MS):
+        self.profile = profile
+        self.nlp = nlp
+        self.min_prose_words = min_prose_words
+        self.min_prose_ratio = min_prose_ratio
+        self.max_chars = max_chars
+        self.budget_ms = budget_ms
+        self.scan_timeout_ms = scan_timeout_ms
+
+    @classmethod
+    def from_profile(cls, profile, **overrides):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown detection profile '{profile}' (expected one of {sorted(PROFILES)})")
+        settings = dict(PROFILES[profile])
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(profile=profile, **settings)
+
+    @classmethod
+    def from_env(cls):
+        """DETECTION_PROFILE=fast|balanced|full, paramètres surchargeables via NLP_*."""
+        def env(name, cast):
+            value = os.getenv(name)
+            return cast(value) if value not in (None, "") else None
+
+        return cls.from_profile(
+            os.getenv("DETECTION_PROFILE", DEFAULT_PROFILE).lower(),
+            min_prose_words=env("NLP_MIN_PROSE_WORDS", int),
+            min_prose_ratio=env("NLP_MIN_PROSE_RATIO", float),
+            max_chars=env("NLP_MAX_CHARS", int),
+            budget_ms=env("NLP_BUDGET_MS", float),
+            scan_timeout_ms=env("SCAN_TIMEOUT_MS", float),
+        )
+
+    def decide(self, text):
+        """
+        Retourne None si le palier NLP doit s'exécuter, sinon la raison de l'en exclure.
+        Lève DetectionBlocked si le texte en relève mais dépasse la longueur autorisée.
+        """
+        if not self.nlp:
+            return "disabled"
+        if self.min_prose_words or self.min_prose_ratio:
+            words, ratio = prose_stats(text)
+            if words < self.min_prose_words or ratio < self.min_prose_ratio:
+                return "low_prose"
+        if self.max_chars and len(text) > self.max_chars:
+            raise DetectionBlocked("nlp", "text_too_long")
+        return None
+
+    def describe(self):
+        return {
+            "profile": self.profile,
+            "nlp": self.nlp,
+            "min_prose_words": self.min_prose_words,
+            "min_prose_ratio": self.min_prose_ratio,
+            "max_chars": self.max_chars,
+            "budget_ms": self.budget_ms,
+            "scan_timeout_ms": self.scan_timeout_ms,
+        }
+
+
+def prose_stats(text):
+    """(nombre de mots rédigés, proportion de mots rédigés parmi les tokens)."""
+    tokens = text.split()
+    if not tokens:
+        return 0, 0.0
+    words = sum(1 for token in tokens if PROSE_WORD.fullmatch(token))
+    return words, words / len(tokens)
+
+
+def split_segments(text, size=NLP_SEGMENT_CHARS):
+    """Découpe le texte en segments d'environ `size` caractères, sur des fins de phrase/ligne si possible."""
+    segments = []
+    start = 0
+    while len(text) - start > size:
+        end = start + size
+        breaks = [m.end() for m in SEGMENT_BREAK.finditer(text, start + size // 2, end)]
+        if breaks:
+            end = breaks[-1]
+        else:
+            space = text.rfind(' ', start + size // 2, end)
+            end = space + 1 if space != -1 else end
+        segments.append(text[start:end])
+        start = end
+    segments.append(text[start:])
+    return segments
+
+
+def _valid(filths):
+    return [filth for filth in filths if filth.is_valid()]
+
+
+def _run_nlp_detector(detector, text, deadline):
+    """
+    Exécute un détecteur NLP segment par segment en vérifiant le budget entre deux segments.
+    Les termes trouvés sont ensuite recherchés dans tout le texte, comme le fait le détecteur
+    sur un texte d'un seul tenant.
+    """
+    segments = split_segments(text) if deadline else [text]
+    if len(segments) == 1:
+        return _valid(detector.iter_filth(text))
+
+    terms = set()
+    for segment in segments:
+        if time.perf_counter() > deadline:
+            raise DetectionBlocked("nlp", "budget_exceeded")
+        terms.update(filth.text for filth in detector.iter_filth(segment))
+    if not terms:
+        return []
+    regex = re.compile('|'.join(r'\b' + re.escape(term) + r'\b' for term in sorted(terms, key=len, reverse=True)))
+    return _valid(
+        detector.filth_cls(match=match, detector_name=detector.name, locale=detector.locale)
+        for match in regex.finditer(text)
+    )
+
+
+def scan(scrubber, text, policy):
+    """
+    Passe unique par palier. Retourne (filth triés et fusionnés, rapport des paliers avec
+    la durée de chaque détecteur). Lève DetectionBlocked si la politique l'impose, ou si
+    le palier fast dépasse scan_timeout_ms (raison scan_timeout).
+    """
+    fast, nlp = [], []
+    for name, detector in scrubber._detectors.items():
+        (nlp if name in NLP_DETECTORS else fast).append(detector)
+
+    try:
+        with time_limit(policy.scan_timeout_ms / 1000):
+            started = time.perf_counter()
+            filth_list = []
+            timings = {}
+            for detector in fast:
+                detector_started = time.perf_counter()
+                filth_list.extend(_valid(detector.iter_filth(text)))
+                timings[detector.name] = round((time.perf_counter() - detector_started) * 1000, 3)
+            fast_ms = (time.perf_counter() - started) * 1000
+    except ScanTimeout:
+        raise DetectionBlocked("fast", "scan_timeout") from None
+    tiers = {"fast": {"ran": True, "ms": round(fast_ms, 3), "detectors": timings}}
+
+    if nlp:
+        skipped = policy.decide(text)
+        if skipped:
+            tiers["nlp"] = {"ran": False, "reason": skipped, "ms": 0.0}
+        else:
+            started = time.perf_counter()
+            deadline = started + policy.budget_ms / 1000 if policy.budget_ms else None
+            timings = {}
+            for detector in nlp:
+                detector_started = time.perf_counter()
+                filth_list.extend(_run_nlp_detector(detector, text, deadline))
+                timings[detector.name] = round((time.perf_counter() - detector_started) * 1000, 3)
+            nlp_ms = (time.perf_counter() - started) * 1000
+            tiers["nlp"] = {"ran": True, "ms": round(nlp_ms, 3), "detectors": timings}
+
+    merged = list(scrubadub.Scrubber._merge_filths(filth_list))
+    return list(scrubber._post_process_filth_list(merged)), tiers
+
+
+class TierStats:
+    """Compteurs et latences par palier (fenêtre glissante pour les percentiles)."""
+
+    def __init__(self, window=1024):
+        self.window = window
+        self._tiers = {}
+        self._lock = threading.Lock()
+
+    def _tier(self, name):
+        if name not in self._tiers:
+            self._tiers[name] = {"runs": 0, "skipped": {}, "blocked": {}, "latencies": deque(maxlen=self.window)}
+        return self._tiers[name]
+
+    def record(self, tiers):
+        with self._lock:
+            for name, info in tiers.items():
+                tier = self._tier(name)
+                if info.get("ran"):
+                    tier["runs"] += 1
+                    tier["latencies"].append(info.get("ms", 0.0))
+                else:
+                    reason = info.get("reason", "unknown")
+                    tier["skipped"][reason] = tier["skipped"].get(reason, 0) + 1
+
+    def record_blocked(self, error):
+        with self._lock:
+            blocked = self._tier(error.tier)["blocked"]
+            blocked[error.reason] = blocked.get(error.reason, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for name, tier in self._tiers.items():
+                latencies = sorted(tier["latencies"])
+                result[name] = {
+                    "runs": tier["runs"],
+                    "skipped": dict(tier["skipped"]),
+                    "blocked": dict(tier["blocked"]),
+                    "p50_ms": _percentile(latencies, 0.50),
+                    "p99_ms": _percentile(latencies, 0.99),
+                }
+            return result
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
@@ -0,0 +1,224 @@
+"""
+Journalisation hors du chemin des requêtes (module partagé par l'anonymizer et le gateway)
+
+Les lignes de log partent dans une file bornée vidée par un thread d'arrière-plan (un par
+processus, démarré au premier log): le thread de la requête ne fait qu'un put_nowait,
+le formatage et l'écriture sur stdout se font ailleurs. File pleine: la ligne est
+abandonnée (compteur dropped), jamais d'attente.
+
+- LOG_FORMAT: json (défaut, un objet JSON par ligne, champs structurés inclus) ou text
+- LOG_MODE=request (défaut): lignes de détail par requête (detail), échantillonnées par
+  requête avec LOG_SAMPLE_RATE (toutes les lignes d'une requête ou aucune)
+- LOG_MODE=summary: aucune ligne de détail; les compteurs (count) sont agrégés et écrits en
+  une ligne toutes les LOG_SUMMARY_INTERVAL secondes au plus
+- LOG_PAYLOAD_EXCERPT_CHARS: longueur des extraits de texte (anonymisé) dans les lignes de
+  détail; 0 (défaut): aucun extrait
+Les warnings et erreurs ne sont jamais échantillonnés.
+
+Le nom du service (champ "service" des lignes JSON) est passé à configure().
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from flask import g, has_request_context
+
+SERVICE_NAME = None
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MODE = os.getenv("LOG_MODE", "request").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_SUMMARY_INTERVAL = float(os.getenv("LOG_SUMMARY_INTERVAL", "60"))
+LOG_PAYLOAD_EXCERPT_CHARS = int(os.getenv("LOG_PAYLOAD_EXCERPT_CHARS", "0"))
+# Lignes en attente d'écriture au-delà desquelles les suivantes sont abandonnées
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objet JSON par ligne: horodatage, niveau, logger, message et champs structurés."""
+
+    def format(self, record):
+        payload = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": SERVICE_NAME,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Format texte historique, champs structurés ajoutés en key=value."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class QueuedHandler(logging.Handler):
+    """File bornée vidée par un thread d'arrière-plan qui écrit via le handler cible."""
+
+    def __init__(self, target, size=LOG_QUEUE_SIZE):
+        super().__init__()
+        self.target = target
+        self.size = size
+        self.dropped = 0
+        self._queue = None
+        self._pid = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Après un fork (workers gunicorn), le thread du parent n'existe plus
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.size)
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def emit(self, record):
+        # Message figé dans le thread appelant: les arguments peuvent changer ensuite
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        records = self._queue
+        while True:
+            record = records.get()
+            try:
+                if record is not None:
+                    self.target.handle(record)
+            except Exception:
+                pass  # un log illisible ne doit pas arrêter l'écriture des suivants
+            finally:
+                records.task_done()
+            if record is None:
+                return
+
+    def flush(self):
+        """Attend l'écriture des lignes en file (tests, arrêt du processus)."""
+        if self._pid == os.getpid():
+            self._queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=1)
+                self._thread.join(timeout=1)
+            except queue.Full:
+                pass
+        super().close()
+
+
+class Summary:
+    """Compteurs agrégés, écrits en une ligne au plus toutes les `interval` secondes."""
+
+    def __init__(self, interval, logger):
+        self.interval = interval
+        self.logger = logger
+        self.counts = Counter()
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, **values):
+        now = time.monotonic()
+        with self._lock:
+            self.counts.update(values)
+            if now - self._started < self.interval:
+                return
+            counts, self.counts = dict(self.counts), Counter()
+            elapsed, self._started = now - self._started, now
+        self.logger.info("📊 Résumé", extra={"fields": {"interval_s": round(elapsed, 1), **counts}})
+
+
+handler = None
+summary = Summary(LOG_SUMMARY_INTERVAL, logging.getLogger("summary")) if LOG_MODE == "summary" else None
+
+
+def configure(service):
+    """Remplace les handlers du logger racine par la file d'écriture asynchrone."""
+    global SERVICE_NAME, handler
+    SERVICE_NAME = service
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter(TEXT_FORMAT))
+    handler = QueuedHandler(stream)
+    root = logging.getLogger()
+    for previous in list(root.handlers):
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    atexit.register(handler.close)
+    return handler
+
+
+def sampled():
+    """Les lignes de détail de la requête en cours sont-elles gardées (tirage unique par requête)?"""
+    if LOG_MODE != "request" or LOG_SAMPLE_RATE <= 0:
+        return False
+    if LOG_SAMPLE_RATE >= 1:
+        return True
+    if not has_request_context():
+        return random.random() < LOG_SAMPLE_RATE
+    if "log_sampled" not in g:
+        g.log_sampled = random.random() < LOG_SAMPLE_RATE
+    return g.log_sampled
+
+
+def detail(logger, message, **fields):
+    """Ligne de détail par requête (INFO), échantillonnée; supprimée en mode summary."""
+    if sampled():
+        logger.info(message, extra={"fields": fields} if fields else None)
+
+
+def count(**values):
+    """Compteurs du mode summary (sans effet en mode request)."""
+    if summary is not None:
+        summary.add(**values)
+
+
+def excerpt(text):
+    """Extrait d'un texte pour une ligne de détail, None si les extraits sont désactivés."""
+    if LOG_PAYLOAD_EXCERPT_CHARS <= 0 or not isinstance(text, str):
+        return None
+    return text[:LOG_PAYLOAD_EXCERPT_CHARS]
+
+
+def stats():
+    return {
+        "mode": LOG_MODE,
+        "format": LOG_FORMAT,
+        "sample_rate": LOG_SAMPLE_RATE,
+        "dropped": handler.dropped if handler else 0,
+    }
@@ -0,0 +1,210 @@
+"""
+Traces par requête: durées des étapes (en-tête Server-Timing) et export de spans (module
+partagé par l'anonymizer et le gateway)
+
+Le trace ID vient de l'en-tête W3C traceparent reçu s'il est valide (sinon il est généré).
+Le gateway le transmet à l'anonymizer et à LiteLLM (upstream.py): les spans de l'anonymizer
+se rattachent à l'étape "anonymize" de la requête du gateway. Le nom du service (ressource
+service.name des spans) est passé à chaque Trace.
+
+TRACE_EXPORT: export des spans (JSON au format OpenTelemetry) par un thread d'arrière-plan
+- chemin de fichier: une ligne JSON par span (JSONL, ouvert en ajout)
+- URL http(s)://: POST par lots {"spans": [...]} vers un collecteur
+Vide (défaut): pas d'export, seul l'en-tête Server-Timing est produit.
+"""
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# Spans en attente d'export au-delà desquels les suivants sont abandonnés (jamais bloquant)
+EXPORT_QUEUE_SIZE = 10000
+EXPORT_BATCH_SIZE = 256
+
+
+class Span:
+    __slots__ = ("name", "span_id", "started", "ended", "attributes")
+
+    def __init__(self, name, started, ended=None, attributes=None):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.started = started
+        self.ended = ended
+        self.attributes = attributes or {}
+
+    @property
+    def ms(self):
+        return (self.ended - self.started) * 1000
+
+
+class Trace:
+    """Étapes d'une requête (temps perf_counter) rattachées à un span racine."""
+
+    def __init__(self, name, traceparent=None, *, service):
+        match = TRACEPARENT.match((traceparent or "").strip().lower())
+        if match and match.group(1) != "0" * 32 and match.group(2) != "0" * 16:
+            self.trace_id, self.parent_id = match.group(1), match.group(2)
+        else:
+            self.trace_id, self.parent_id = secrets.token_hex(16), None
+        self.service = service
+        self.root = Span(name, time.perf_counter())
+        self.spans = []
+        self.timings = {}
+        self._active = []
+        # Ancrage des horodatages absolus (les durées restent mesurées en perf_counter)
+        self._epoch_ns = time.time_ns() - int(self.root.started * 1e9)
+        self._finished = False
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(name, time.perf_counter(), attributes=attributes)
+        self._active.append(span)
+        try:
+            yield span
+        finally:
+            span.ended = time.perf_counter()
+            self._active.pop()
+            self.spans.append(span)
+
+    def add_span(self, name, started, ended, **attributes):
+        self.spans.append(Span(name, started, ended, attributes))
+
+    def timing(self, name, ms):
+        """Durée rapportée sans span (ex: mesurée dans un autre processus), cumulée par nom."""
+        self.timings[name] = self.timings.get(name, 0.0) + ms
+
+    def traceparent(self):
+        """En-tête traceparent à transmettre aux services appelés (parent: l'étape en cours)."""
+        parent = self._active[-1] if self._active else self.root
+        return f"00-{self.trace_id}-{parent.span_id}-01"
+
+    def server_timing(self):
+        """
+        En-tête Server-Timing: une entrée par étape (durées cumulées si l'étape se répète),
+        puis total (jusqu'à la production des en-têtes de réponse).
+        """
+        stages = {}
+        for span in self.spans:
+            stages[span.name] = stages.get(span.name, 0.0) + span.ms
+        stages.update(self.timings)
+        entries = [f"{name};dur={ms:.1f}" for name, ms in stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.root.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def finish(self, **attributes):
+        """Termine le span racine et exporte la trace (une seule fois)."""
+        if self._finished:
+            return
+        self._finished = True
+        self.root.ended = time.perf_counter()
+        self.root.attributes.update(attributes)
+        for name, ms in self.timings.items():
+            self.root.attributes[f"timing.{name}_ms"] = round(ms, 3)
+        if exporter is not None:
+            exporter.export(self.to_dicts())
+
+    def _span_dict(self, span, parent_id, kind):
+        return {
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": parent_id,
+            "name": span.name,
+            "kind": kind,
+            "startTimeUnixNano": self._epoch_ns + int(span.started * 1e9),
+            "endTimeUnixNano": self._epoch_ns + int(span.ended * 1e9),
+            "attributes": span.attributes,
+            "resource": {"service.name": self.service},
+        }
+
+    def to_dicts(self):
+        spans = [self._span_dict(self.root, self.parent_id, "SERVER")]
+        spans.extend(self._span_dict(span, self.root.span_id, "INTERNAL") for span in self.spans)
+        return spans
+
+
+class SpanExporter:
+    """File d'attente bornée vidée par un thread d'arrière-plan (un par processus, démarré au premier export)."""
+
+    def __init__(self, target):
+        self.target = target
+        self.dropped = 0
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Après un fork (workers gunicorn), le thread du parent n'existe plus
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(EXPORT_QUEUE_SIZE)
+                threading.Thread(target=self._run, name="span-exporter", daemon=True).start()
+                self._pid = os.getpid()
+
+    def export(self, spans):
+        self._ensure_thread()
+        for span in spans:
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                self.dropped += 1
+
+    def _run(self):
+        spans_queue = self._queue
+        while True:
+            batch = [spans_queue.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(spans_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.warning(f"⚠️ Span export failed ({len(batch)} spans): {e}")
+
+    def write(self, batch):
+        if self.target.startswith(("http://", "https://")):
+            body = json.dumps({"spans": batch}).encode()
+            post = urllib.request.Request(self.target, data=body, headers={"Content-Type": "application/json"})
+            urllib.request.urlopen(post, timeout=5).close()
+        else:
+            with open(self.target, "a") as f:
+                f.write("".join(json.dumps(span) + "\n" for span in batch))
+
+
+def create_exporter(target=None):
+    target = os.getenv("TRACE_EXPORT", "") if target is None else target
+    return SpanExporter(target) if target else None
+
+
+exporter = create_exporter()
+
+
+def current():
+    """Trace de la requête en cours (None hors requête ou si elle n'est pas tracée)."""
+    return g.get("trace") if has_request_context() else None
+
+
+@contextmanager
+def span(name, **attributes):
+    """Span de la requête en cours; sans trace, ne mesure rien."""
+    trace = current()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attributes) as active:
+        yield active
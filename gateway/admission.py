@@ -0,0 +1,250 @@
+"""
+Contrôle d'admission des requêtes chat/completions (par worker)
+
+nginx limite le débit par IP (limit_req), sans tenir compte de la taille des prompts ni
+de la durée des appels amont: quelques gros prompts saturent l'anonymizer pendant que
+les petits attendent derrière eux. Le gateway borne donc ce qu'il a en vol:
+- limite globale (ADMISSION_MAX_IN_FLIGHT) et limite par modèle (litellm-config.yaml),
+  exprimées en unités de poids: une requête pèse 1, ou plus selon sa taille (ADMISSION_WEIGHT)
+- limite par client (ADMISSION_MAX_PER_CLIENT requêtes en vol, refus immédiat au-delà)
+- file d'attente FIFO bornée: au-delà de ADMISSION_QUEUE_SIZE requêtes en attente, ou après
+  ADMISSION_QUEUE_TIMEOUT secondes d'attente, la requête est refusée (429 + Retry-After).
+  Les requêtes qui n'attendent que la limite de leur modèle ont leur propre borne (la même
+  taille, par modèle): un modèle saturé ne remplit pas la file des autres modèles
+
+Les limites par modèle viennent du fichier de configuration LiteLLM (LITELLM_CONFIG), par
+model_name: model_info.max_in_flight, ou à défaut litellm_params.max_parallel_requests.
+Une requête bloquée sur la limite de son modèle ne bloque pas celles des autres modèles.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+WEIGHT_MODES = ("none", "bytes", "messages")
+# Taille d'une unité de poids par mode (octets du corps, nombre de messages)
+DEFAULT_WEIGHT_UNITS = {"bytes": 16384, "messages": 8}
+
+
+class AdmissionRejected(Exception):
+    """Requête refusée par le contrôle d'admission (429)."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Request rejected by admission control ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Place réservée par une requête admise, à rendre via AdmissionController.release()."""
+    __slots__ = ("client", "model", "weight", "admitted_at", "waited")
+
+    def __init__(self, client, model, weight):
+        self.client = client
+        self.model = model
+        self.weight = weight
+        self.admitted_at = None
+        self.waited = 0.0
+
+
+class AdmissionController:
+    """Limites en vol globales, par modèle et par client, avec file d'attente bornée (thread-safe)."""
+
+    def __init__(self, max_in_flight=200, max_per_client=0, queue_size=100, queue_timeout=10.0,
+                 weight="none", weight_unit=None, model_limits=None, on_change=None):
+        if weight not in WEIGHT_MODES:
+            raise ValueError(f"Unknown admission weight '{weight}' (expected one of {list(WEIGHT_MODES)})")
+        self.max_in_flight = max_in_flight
+        self.max_per_client = max_per_client
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.weight_mode = weight
+        self.weight_unit = weight_unit or DEFAULT_WEIGHT_UNITS.get(weight, 1)
+        self.model_limits = model_limits or {}
+        # on_change(in_flight, queued): appelé à chaque changement (métriques)
+        self.on_change = on_change
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._models = {}
+        self._clients = {}
+        self._queue = deque()
+        # Moyenne glissante de la durée de détention d'une place (estimation de Retry-After)
+        self._hold_seconds = 1.0
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        weight = os.getenv("ADMISSION_WEIGHT", "none").lower()
+        unit = os.getenv("ADMISSION_WEIGHT_UNIT")
+        return cls(
+            max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "200")),
+            max_per_client=int(os.getenv("ADMISSION_MAX_PER_CLIENT", "0")),
+            queue_size=int(os.getenv("ADMISSION_QUEUE_SIZE", "100")),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+            weight=weight,
+            weight_unit=int(unit) if unit else None,
+            model_limits=load_model_limits(os.getenv("LITELLM_CONFIG", "")),
+            **kwargs
+        )
+
+    @property
+    def enabled(self):
+        return self.max_in_flight > 0 or self.max_per_client > 0 or bool(self.model_limits)
+
+    def weigh(self, body_bytes=0, messages=0):
+        """Poids d'une requête: 1 + une unité par tranche de taille (plafonné à la limite globale)."""
+        if self.weight_mode == "bytes":
+            weight = 1 + (body_bytes or 0) // self.weight_unit
+        elif self.weight_mode == "messages":
+            weight = 1 + max(0, (messages or 0) - 1) // self.weight_unit
+        else:
+            weight = 1
+        # Une requête plus lourde que la capacité totale passe seule plutôt que jamais
+        return min(weight, self.max_in_flight) if self.max_in_flight > 0 else weight
+
+    def _fits_global(self, ticket):
+        return self.max_in_flight <= 0 or self._in_flight + ticket.weight <= self.max_in_flight
+
+    def _fits_model(self, ticket):
+        limit = self.model_limits.get(ticket.model)
+        if not limit:
+            return True
+        # Comme pour la limite globale: une requête plus lourde que la limite passe seule
+        in_flight = self._models.get(ticket.model, 0)
+        return in_flight == 0 or in_flight + ticket.weight <= limit
+
+    def _next_admissible(self):
+        """
+        Premier ticket en attente admissible. Un ticket bloqué par la limite de son modèle
+        est dépassé; un ticket bloqué par la limite globale garde sa place (pas de famine
+        des requêtes lourdes).
+        """
+        for ticket in self._queue:
+            if not self._fits_global(ticket):
+                return None
+            if self._fits_model(ticket):
+                return ticket
+        return None
+
+    def _queue_full(self, ticket):
+        """
+        File pleine pour ce ticket. Les tickets en attente bloqués par la limite de leur modèle
+        sont comptés par modèle, les autres ensemble: chaque groupe est borné par queue_size.
+        """
+        shared = own = 0
+        for queued in self._queue:
+            if self._fits_model(queued):
+                shared += 1
+            elif queued.model == ticket.model:
+                own += 1
+        return (shared if self._fits_model(ticket) else own) >= self.queue_size
+
+    def _grant(self, ticket):
+        ticket.admitted_at = time.monotonic()
+        self._in_flight += ticket.weight
+        self._models[ticket.model] = self._models.get(ticket.model, 0) + ticket.weight
+        self._clients[ticket.client] = self._clients.get(ticket.client, 0) + 1
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change(self._in_flight, len(self._queue))
+
+    def _retry_after(self):
+        # Temps estimé pour écouler la file actuelle, au moins 1 seconde
+        capacity = self.max_in_flight if self.max_in_flight > 0 else 1
+        return max(1, math.ceil(self._hold_seconds * (len(self._queue) + 1) / capacity))
+
+    def admit(self, client, model, weight=1):
+        """Retourne un Ticket, après une attente éventuelle. Lève AdmissionRejected."""
+        ticket = Ticket(client, model, weight)
+        with self._cond:
+            if self.max_per_client > 0 and self._clients.get(client, 0) >= self.max_per_client:
+                raise AdmissionRejected("client_limit", self._retry_after())
+            if not self._queue and self._fits_global(ticket) and self._fits_model(ticket):
+                self._grant(ticket)
+                self._notify()
+                return ticket
+            if self._queue_full(ticket):
+                raise AdmissionRejected("queue_full", self._retry_after())
+
+            started = time.monotonic()
+            deadline = started + self.queue_timeout
+            self._queue.append(ticket)
+            self._notify()
+            try:
+                while self._next_admissible() is not ticket:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise AdmissionRejected("queue_timeout", self._retry_after())
+                    self._cond.wait(remaining)
+                self._queue.remove(ticket)
+                self._grant(ticket)
+                ticket.waited = time.monotonic() - started
+                return ticket
+            finally:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                # Le départ de ce ticket peut débloquer les suivants
+                self._cond.notify_all()
+                self._notify()
+
+    def release(self, ticket):
+        with self._cond:
+            self._in_flight -= ticket.weight
+            self._models[ticket.model] -= ticket.weight
+            if not self._models[ticket.model]:
+                del self._models[ticket.model]
+            self._clients[ticket.client] -= 1
+            if not self._clients[ticket.client]:
+                del self._clients[ticket.client]
+            held = time.monotonic() - ticket.admitted_at
+            self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * held
+            self._cond.notify_all()
+            self._notify()
+
+    def describe(self):
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queued": len(self._queue),
+                "max_in_flight": self.max_in_flight,
+                "max_per_client": self.max_per_client,
+                "queue_size": self.queue_size,
+                "queue_timeout": self.queue_timeout,
+                "weight": self.weight_mode,
+                "model_limits": self.model_limits,
+                "models_in_flight": dict(self._models),
+            }
+
+
+def load_model_limits(path):
+    """
+    Limites par modèle depuis le fichier de configuration LiteLLM:
+    {model_name: model_info.max_in_flight ou litellm_params.max_parallel_requests}.
+    """
+    if not path:
+        return {}
+    try:
+        import yaml  # dépendance optionnelle, seulement pour les limites par modèle
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+    except Exception as e:
+        logger.warning(f"⚠️ Per-model admission limits not loaded from {path}: {e}")
+        return {}
+
+    limits = {}
+    for entry in config.get("model_list") or []:
+        if not isinstance(entry, dict) or not entry.get("model_name"):
+            continue
+        limit = (entry.get("model_info") or {}).get("max_in_flight")
+        if limit is None:
+            limit = (entry.get("litellm_params") or {}).get("max_parallel_requests")
+        if limit:
+            # Plusieurs déploiements d'un même model_name: leurs limites s'additionnent
+            limits[entry["model_name"]] = limits.get(entry["model_name"], 0) + int(limit)
+    if limits:
+        logger.info(f"✅ Per-model admission limits: {limits}")
+    return limits
@@ -5,94 +5,474 @@ Architecture: Client → Gateway → Anonymizer → LiteLLM → LLM externe
 SÉCURITÉ: Mode fail-safe - si l'anonymisation échoue, la requête est BLOQUÉE
 """
 import logging
+import math
 import os
+import sys
+import time
 import requests
-from flask import Flask, request, jsonify, Response
+try:
+    import msgpack
+except ImportError:  # dépendance optionnelle: réponses de l'anonymizer en JSON
+    msgpack = None
+from flask import Flask, g, request, jsonify, Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import logs
+    import tracing
+except ImportError:  # lancement hors de l'image (python app.py): modules partagés dans ../common
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+    import logs
+    import tracing
+import metrics
+import spans
+import upstream
+import walker
+from admission import AdmissionController, AdmissionRejected
+from cache import CompletionCache, create_anonymization_cache, create_completion_cache
+from circuit import CircuitBreaker, CircuitOpenError, HealthProber
+from embedded import LocalAnonymizer
 
 app = Flask(__name__)
 
+# Taille max du corps des requêtes (octets, 0 = pas de limite): 413 avant lecture si Content-Length
+# la dépasse, pendant la lecture pour un corps chunked (cf. spans.py)
+GATEWAY_MAX_BODY_BYTES = int(os.getenv("GATEWAY_MAX_BODY_BYTES", str(10 * 1024 * 1024)))
+app.config["MAX_CONTENT_LENGTH"] = GATEWAY_MAX_BODY_BYTES or None
+
 # Configuration des services
 ANONYMIZER_URL = os.getenv("ANONYMIZER_URL", "http://anonymizer:5001")
+# remote (HTTP), embedded (dans le worker) ou pool (processus locaux), cf. embedded.py
+ANONYMIZER_MODE = os.getenv("ANONYMIZER_MODE", "remote").lower()
 LITELLM_URL = os.getenv("LITELLM_URL", "http://litellm:4000")
 
-# Configure logging pour voir clairement l'anonymisation
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Taille des pools de connexions keep-alive vers chaque service
+ANONYMIZER_POOL_SIZE = int(os.getenv("ANONYMIZER_POOL_SIZE", "50"))
+LITELLM_POOL_SIZE = int(os.getenv("LITELLM_POOL_SIZE", "200"))
+
+# Timeouts des appels à l'anonymizer (connexion, lecture) en secondes
+ANONYMIZER_CONNECT_TIMEOUT = float(os.getenv("ANONYMIZER_CONNECT_TIMEOUT", "2"))
+ANONYMIZER_TIMEOUT = float(os.getenv("ANONYMIZER_TIMEOUT", "10"))
+
+# Seuls champs lus dans les résultats de l'anonymizer (pas de détections: ni copie des secrets, ni octets inutiles)
+ANONYMIZER_FIELDS = ["anonymized", "anonymized_length", "pii_count", "secrets_count"]
+MSGPACK_MIMETYPE = "application/msgpack"
+# Textes max par appel /anonymize/batch (BATCH_MAX_ITEMS de l'anonymizer): au-delà, plusieurs appels
+ANONYMIZER_BATCH_MAX_ITEMS = int(os.getenv("ANONYMIZER_BATCH_MAX_ITEMS", "512"))
+# Caractères max par appel (0 = sans limite): le batch encodé et sa réponse restent bornés
+# quelle que soit la taille de la requête, au lieu de grandir avec elle
+ANONYMIZER_BATCH_MAX_CHARS = int(os.getenv("ANONYMIZER_BATCH_MAX_CHARS", str(256 * 1024)))
+
+# Pseudonymes stables par conversation: en-tête portant la clé de conversation/tenant
+# ("" = désactivé, défaut), ex: X-Conversation-Id
+PSEUDONYM_SCOPE_HEADER = os.getenv("PSEUDONYM_SCOPE_HEADER", "")
+PSEUDONYM_SCOPE_MAX_LENGTH = 256
+
+# Contrôle d'admission: identifiant du client (posé par nginx, adresse du pair à défaut)
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "X-Real-IP")
+
+# Sonde de santé de l'anonymizer en arrière-plan (0 = sonde synchrone à chaque /health)
+ANONYMIZER_PROBE_INTERVAL = float(os.getenv("ANONYMIZER_PROBE_INTERVAL", "2"))
+ANONYMIZER_PROBE_TIMEOUT = float(os.getenv("ANONYMIZER_PROBE_TIMEOUT", "2"))
+
+# Logs écrits par un thread d'arrière-plan, détail par requête échantillonné (LOG_*, cf. logs.py)
+logs.configure("gateway")
 logger = logging.getLogger(__name__)
 
 
+def create_http_session() -> requests.Session:
+    """
+    Session HTTP partagée avec un pool keep-alive par service amont.
+    pool_block: au-delà de la taille du pool, on attend une connexion libre
+    au lieu d'ouvrir (puis jeter) des connexions supplémentaires.
+    Les adaptateurs transmettent le traceparent et mesurent les étapes amont (upstream.py).
+    """
+    session = requests.Session()
+    session.mount(ANONYMIZER_URL, upstream.TracingHTTPAdapter(
+        pool_connections=1, pool_maxsize=ANONYMIZER_POOL_SIZE, pool_block=True
+    ))
+    session.mount(LITELLM_URL, upstream.TracingHTTPAdapter(
+        timed=True, pool_connections=1, pool_maxsize=LITELLM_POOL_SIZE, pool_block=True
+    ))
+    return session
+
+
+http = create_http_session()
+
+# Limites en vol et file d'attente des requêtes chat/completions (ADMISSION_*, LITELLM_CONFIG)
+admission = AdmissionController.from_env(on_change=metrics.observe_admission)
+
+# Anonymiseur local (None en mode remote): chargé au démarrage, une erreur empêche le démarrage
+local_anonymizer = LocalAnonymizer.from_env(ANONYMIZER_MODE)
+
+# Cache des contenus déjà anonymisés (None si ANON_CACHE_BACKEND=none)
+anonymization_cache = create_anonymization_cache()
+
+# Cache des réponses LiteLLM, indexé par la requête anonymisée (None si COMPLETION_CACHE_BACKEND=none)
+completion_cache = create_completion_cache()
+
+
 class AnonymizationError(Exception):
     """Exception levée quand l'anonymisation échoue."""
-    pass
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        # Renseigné quand le disjoncteur refuse l'appel (en-tête Retry-After du 503)
+        self.retry_after = retry_after
+
+
+# Disjoncteur autour des appels à l'anonymizer (ANONYMIZER_BREAKER_FAILURES/_RESET/_HALF_OPEN_CALLS)
+anonymizer_breaker = CircuitBreaker.from_env("anonymizer", "ANONYMIZER_BREAKER", on_change=metrics.observe_circuit)
+
+
+def probe_anonymizer() -> dict:
+    """Corps du /health de l'anonymizer (exception si injoignable ou en erreur)."""
+    if local_anonymizer is not None:
+        return local_anonymizer.health()
+    response = http.get(f"{ANONYMIZER_URL}/health", timeout=ANONYMIZER_PROBE_TIMEOUT)
+    if response.status_code != 200:
+        raise AnonymizationError(f"Anonymizer health returned {response.status_code}")
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = None
+    return payload if isinstance(payload, dict) else {}
+
+
+def observe_anonymizer_health(payload: dict):
+    patterns_version = payload.get("patterns_version")
+    if anonymization_cache and isinstance(patterns_version, str):
+        anonymization_cache.observe_version(patterns_version)
+
+
+anonymizer_prober = HealthProber(
+    probe_anonymizer, interval=ANONYMIZER_PROBE_INTERVAL, breaker=anonymizer_breaker,
+    on_result=observe_anonymizer_health
+)
 
 
-def anonymize_text(text: str) -> str:
+def anonymizer_patterns_version():
     """
-    Envoie le texte à l'anonymizer et retourne la version anonymisée.
-    FAIL-SAFE: Si l'anonymisation échoue, une exception est levée (pas de fallback).
+    Version du pattern set en service: celle du moteur local, sinon celle de la dernière
+    sonde de l'anonymizer (aucun appel sur le chemin de la requête). None si inconnue.
     """
+    if local_anonymizer is not None:
+        return local_anonymizer.engine.version
+    version = (anonymizer_prober.last_payload() or {}).get("patterns_version")
+    return version if isinstance(version, str) else None
+
+
+def anonymize_texts(texts: list, scope: str = None) -> tuple:
+    """
+    Envoie tous les textes à l'anonymizer en un seul appel (/anonymize/batch, ou la
+    bibliothèque en mode embedded/pool) et retourne (versions anonymisées dans le même
+    ordre, version du pattern set). Avec un scope, les valeurs détectées deviennent des
+    pseudonymes stables pour toute la conversation.
+    FAIL-SAFE: Si un seul texte échoue, une exception est levée (pas de fallback).
+    Disjoncteur ouvert: l'exception est levée immédiatement, sans appel.
+    """
+    anonymizer_prober.ensure_started()
     try:
-        response = requests.post(
-            f"{ANONYMIZER_URL}/anonymize",
-            json={"text": text},
-            timeout=10
-        )
-        if response.status_code == 200:
-            result = response.json()
-            logger.info(f"🔒 Anonymisé ({result['anonymized_length']} chars): {result['anonymized'][:200]}...")
-            logger.info(f"   → PII détectés: {result['pii_count']}, Secrets: {result['secrets_count']}")
-            return result["anonymized"]
+        anonymizer_breaker.before_call()
+    except CircuitOpenError as e:
+        logger.error(f"❌ Anonymizer unavailable: {e}")
+        raise AnonymizationError(f"Anonymizer unavailable ({e})", retry_after=e.retry_after)
+
+    with tracing.span("anonymize", texts=len(texts)) as span:
+        if local_anonymizer is not None:
+            payload = anonymize_locally(texts, scope)
+        else:
+            payload = anonymize_remotely(texts, span, scope)
+    results = payload.get("results")
+    if not isinstance(results, list) or len(results) != len(texts):
+        raise AnonymizationError("Anonymizer returned an incomplete batch")
+
+    anonymized = []
+    pii_count = secrets_count = 0
+    for i, result in enumerate(results):
+        if not isinstance(result, dict) or "error" in result or "anonymized" not in result:
+            detail = result.get("error") if isinstance(result, dict) else result
+            logger.error(f"❌ Anonymizer failed on item {i}: {detail}")
+            raise AnonymizationError(f"Anonymizer failed on item {i}: {detail}")
+        pii_count += result.get("pii_count", 0)
+        secrets_count += result.get("secrets_count", 0)
+        anonymized.append(result["anonymized"])
+
+    logs.count(texts=len(texts), pii=pii_count, secrets=secrets_count)
+    fields = {"texts": len(texts), "pii": pii_count, "secrets": secrets_count}
+    if logs.LOG_PAYLOAD_EXCERPT_CHARS > 0:
+        # Extraits du texte ANONYMISÉ seulement, et uniquement si demandé
+        fields["excerpts"] = [logs.excerpt(text) for text in anonymized]
+    logs.detail(logger, "🔒 Textes anonymisés", **fields)
+    return anonymized, payload.get("patterns_version")
+
+
+def anonymize_locally(texts: list, scope: str = None) -> dict:
+    """Batch traité par la bibliothèque de l'anonymizer (mode embedded ou pool)."""
+    started = time.perf_counter()
+    try:
+        payload = local_anonymizer.anonymize_batch(texts, ANONYMIZER_FIELDS, scope)
+    except Exception as e:
+        # Pool de processus cassé (processus tué...): compté comme un échec d'appel
+        anonymizer_breaker.record_failure()
+        metrics.ANONYMIZER_SECONDS.labels("connection_error").observe(time.perf_counter() - started)
+        logger.error(f"❌ Local anonymizer error: {e}")
+        raise AnonymizationError(f"Local anonymizer failed: {e}")
+    anonymizer_breaker.record_success()
+    metrics.ANONYMIZER_SECONDS.labels("ok").observe(time.perf_counter() - started)
+    return payload
+
+
+def anonymize_remotely(texts: list, span, scope: str = None) -> dict:
+    """Batch envoyé à l'anonymizer (/anonymize/batch)."""
+    started = time.perf_counter()
+    body = {"texts": texts, "fields": ANONYMIZER_FIELDS}
+    if scope:
+        body["scope"] = scope
+    try:
+        # MessagePack dans les deux sens: un seul tampon d'octets pour tout le batch (JSON:
+        # chaîne puis octets), et une réponse décodée sans passer par une chaîne
+        packed = msgpack.packb(body, use_bin_type=True) if msgpack else None
+    except (TypeError, ValueError) as e:
+        # Texte non encodable en UTF-8 (surrogate isolé venu d'un échappement JSON "\ud800"):
+        # la requête est bloquée, l'anonymizer n'a pas été appelé
+        logger.error(f"❌ Cannot encode texts for the anonymizer: {e}")
+        raise AnonymizationError(f"Cannot encode texts for the anonymizer: {e}")
+    try:
+        if msgpack:
+            response = http.post(
+                f"{ANONYMIZER_URL}/anonymize/batch",
+                data=packed,
+                headers={"Content-Type": MSGPACK_MIMETYPE, "Accept": f"{MSGPACK_MIMETYPE}, application/json;q=0.9"},
+                timeout=(ANONYMIZER_CONNECT_TIMEOUT, ANONYMIZER_TIMEOUT)
+            )
         else:
-            logger.error(f"❌ Anonymizer HTTP error: {response.status_code}")
-            raise AnonymizationError(f"Anonymizer returned {response.status_code}")
+            response = http.post(
+                f"{ANONYMIZER_URL}/anonymize/batch",
+                json=body,
+                headers={"Accept": "application/json"},
+                timeout=(ANONYMIZER_CONNECT_TIMEOUT, ANONYMIZER_TIMEOUT)
+            )
     except requests.exceptions.RequestException as e:
+        anonymizer_breaker.record_failure()
+        metrics.ANONYMIZER_SECONDS.labels("connection_error").observe(time.perf_counter() - started)
         logger.error(f"❌ Anonymizer connection error: {e}")
         raise AnonymizationError(f"Cannot reach anonymizer: {e}")
+    # 4xx: l'anonymizer répond (requête refusée), seules les erreurs serveur comptent
+    if response.status_code >= 500:
+        anonymizer_breaker.record_failure()
+    else:
+        anonymizer_breaker.record_success()
+    metrics.ANONYMIZER_SECONDS.labels(
+        "ok" if response.status_code == 200 else "http_error"
+    ).observe(time.perf_counter() - started)
+    if span is not None:
+        # Durées par palier et par détecteur mesurées par l'anonymizer
+        span.attributes["anonymizer.server_timing"] = response.headers.get("Server-Timing", "")
+
+    if response.status_code != 200:
+        logger.error(f"❌ Anonymizer HTTP error: {response.status_code}")
+        raise AnonymizationError(f"Anonymizer returned {response.status_code}")
+
+    try:
+        if msgpack and str(response.headers.get("Content-Type", "")).startswith(MSGPACK_MIMETYPE):
+            payload = msgpack.unpackb(response.content, raw=False)
+        else:
+            payload = response.json()
+    except ValueError:
+        payload = None
+    return payload if isinstance(payload, dict) else {}
+
 
+def split_batches(texts: list):
+    """Batchs d'au plus ANONYMIZER_BATCH_MAX_ITEMS textes et ANONYMIZER_BATCH_MAX_CHARS caractères (un texte au moins)."""
+    batch, chars = [], 0
+    for text in texts:
+        full = len(batch) >= ANONYMIZER_BATCH_MAX_ITEMS or (
+            ANONYMIZER_BATCH_MAX_CHARS and chars + len(text) > ANONYMIZER_BATCH_MAX_CHARS)
+        if batch and full:
+            yield batch
+            batch, chars = [], 0
+        batch.append(text)
+        chars += len(text)
+    if batch:
+        yield batch
 
-def anonymize_messages(messages: list) -> list:
+
+def anonymize_messages(messages: list, scope: str = None) -> list:
     """
-    Anonymise tous les messages de la conversation.
-    FAIL-SAFE: Si un message ne peut pas être anonymisé, une exception est levée.
+    Anonymise toutes les chaînes de la conversation (contenus texte ou en parts, résultats
+    d'outils, arguments d'appels d'outils, noms) en un seul appel à l'anonymizer, puis les
+    réécrit en place (walker.py). Chaque texte distinct n'est envoyé qu'une fois, et ceux déjà
+    vus (historique renvoyé à chaque tour) sont servis par le cache.
+    Retourne les emplacements (conteneur, clé) modifiés, seuls réencodés dans le corps transmis.
+    FAIL-SAFE: Si un texte ne peut pas être anonymisé, une exception est levée (rien n'est réécrit).
     """
-    anonymized = []
-    for i, msg in enumerate(messages):
-        content = msg.get("content", "")
-        if isinstance(content, str) and content:
-            try:
-                anonymized_content = anonymize_text(content)
-                anonymized.append({**msg, "content": anonymized_content})
-            except AnonymizationError as e:
-                logger.error(f"❌ Failed to anonymize message {i}: {e}")
-                raise
-        else:
-            # Message vide ou format non-string (multi-modal)
-            anonymized.append(msg)
-    return anonymized
+    leaves = walker.collect(messages)
+    texts = leaves.texts
+    if not texts:
+        return []
+
+    # La sonde suit les reloads de l'anonymizer même quand tout est servi par le cache
+    anonymizer_prober.ensure_started()
+    with tracing.span("cache", texts=len(texts)):
+        cached = anonymization_cache.get_many(texts, scope, anonymizer_patterns_version()) if anonymization_cache else {}
+    resolved = {texts[pos]: anonymized for pos, anonymized in cached.items()}
+    missing = [text for text in texts if text not in resolved]
+
+    for batch in split_batches(missing):
+        try:
+            anonymized_batch, patterns_version = anonymize_texts(batch, scope)
+        except AnonymizationError as e:
+            logger.error(f"❌ Failed to anonymize messages: {e}")
+            raise
+        # Texte inchangé: l'original est gardé, la copie décodée de la réponse est libérée tout de suite
+        resolved.update((text, text if anonymized == text else anonymized) for text, anonymized in zip(batch, anonymized_batch))
+        if anonymization_cache:
+            anonymization_cache.put_many(batch, anonymized_batch, patterns_version, scope)
+    logs.count(cache_hits=len(cached))
+    logs.detail(logger, "   → Cache d'anonymisation", cached=len(cached), texts=len(texts), fields=len(leaves.slots))
+
+    return leaves.write(resolved)
 
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint."""
-    # Vérifie aussi que l'anonymizer est accessible
-    try:
-        resp = requests.get(f"{ANONYMIZER_URL}/health", timeout=5)
-        anonymizer_ok = resp.status_code == 200
-    except Exception:
-        anonymizer_ok = False
+    # État de l'anonymizer: dernier résultat de la sonde d'arrière-plan (pas d'appel synchrone)
+    probe = anonymizer_prober.status()
+    circuit = anonymizer_breaker.describe()
+    anonymizer_ok = bool(probe["ok"]) and circuit["state"] != "open"
 
     status = "healthy" if anonymizer_ok else "degraded"
     return jsonify({
         "status": status,
         "service": "gateway",
-        "anonymizer": "ok" if anonymizer_ok else "unreachable"
+        "anonymizer": "ok" if anonymizer_ok else "unreachable",
+        "anonymizer_patterns_version": (probe["payload"] or {}).get("patterns_version"),
+        "anonymizer_probe": {
+            "checked_at": probe["checked_at"], "latency_ms": probe["latency_ms"], "error": probe["error"]
+        },
+        "anonymizer_circuit": circuit,
+        "admission": admission.describe(),
+        "anonymization_cache": anonymization_cache.stats() if anonymization_cache else None,
+        "completion_cache": completion_cache.stats() if completion_cache else None,
+        "logs": logs.stats()
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métriques Prometheus (interne: non exposé par nginx)."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.before_request
+def track_in_flight():
+    if request.endpoint == 'chat_completions':
+        metrics.IN_FLIGHT.inc()
+        g.in_flight = True
+
+
+@app.after_request
+def untrack_in_flight_on_close(response):
+    # Décrémenté à la fermeture de la réponse: fin du stream SSE ou déconnexion du client
+    if g.pop('in_flight', False):
+        response.call_on_close(metrics.IN_FLIGHT.dec)
+    return response
+
+
+@app.teardown_request
+def untrack_in_flight(exc=None):
+    # Aucune réponse n'a été construite (exception non gérée)
+    if g.pop('in_flight', False):
+        metrics.IN_FLIGHT.dec()
+
+
+def admit_request(data: dict):
+    """
+    Réserve une place pour la requête (attente éventuelle dans la file d'admission).
+    La place est rendue à la fermeture de la réponse (fin du stream compris).
+    Lève AdmissionRejected si la requête doit être refusée.
+    """
+    if not admission.enabled:
+        return
+    model = data.get("model") if isinstance(data.get("model"), str) else None
+    messages = data.get("messages")
+    weight = admission.weigh(request.content_length or 0, len(messages) if isinstance(messages, list) else 0)
+    client = request.headers.get(ADMISSION_CLIENT_HEADER) or request.remote_addr
+    try:
+        ticket = admission.admit(client, model, weight)
+    except AdmissionRejected as e:
+        metrics.ADMISSION_SHED.labels(e.reason, metrics.model_label(model)).inc()
+        raise
+    g.admission_ticket = ticket
+    metrics.ADMISSION_WAIT_SECONDS.observe(ticket.waited)
+
+
+@app.after_request
+def release_admission_on_close(response):
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        response.call_on_close(lambda: admission.release(ticket))
+    return response
+
+
+@app.teardown_request
+def release_admission(exc=None):
+    # Aucune réponse n'a été construite (exception non gérée)
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        admission.release(ticket)
+
+
+@app.before_request
+def start_trace():
+    if request.endpoint == 'chat_completions':
+        g.trace = tracing.Trace("chat_completions", request.headers.get("traceparent"), service="gateway")
+
+
+@app.after_request
+def finish_trace_on_close(response):
+    # Server-Timing: étapes jusqu'aux en-têtes; le span racine couvre tout le stream
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Trace-Id"] = trace.trace_id
+        response.call_on_close(lambda: trace.finish(status=response.status_code))
+    return response
+
+
+@app.teardown_request
+def finish_trace(exc=None):
+    trace = g.get('trace')
+    if trace is not None and exc is not None:
+        trace.finish(error=str(exc))
+
+
+@app.after_request
+def add_cache_status(response):
+    # X-Cache: HIT, MISS ou BYPASS quand le cache de complétions est actif
+    cache_status = g.get('cache_status')
+    if cache_status:
+        response.headers["X-Cache"] = cache_status
+    return response
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def body_too_large(error):
+    limit = app.config["MAX_CONTENT_LENGTH"]
+    logger.warning(f"🚫 Corps de requête refusé: plus de {limit} octets")
+    metrics.BLOCKED.labels("body_too_large").inc()
+    return jsonify({"error": f"Request body too large (max {limit} bytes)"}), 413
+
+
 @app.route('/v1/models', methods=['GET'])
 def list_models():
     """Proxy la liste des modèles depuis LiteLLM."""
     try:
-        response = requests.get(f"{LITELLM_URL}/v1/models", timeout=10)
+        response = http.get(f"{LITELLM_URL}/v1/models", timeout=10)
         return Response(
             response.content,
             status=response.status_code,
@@ -112,42 +492,113 @@ def chat_completions():
     4. Retourne la réponse
 
     SÉCURITÉ: Si l'anonymisation échoue, la requête est BLOQUÉE (503).
+    Le corps est lu une fois (taille bornée) et transmis à LiteLLM sans réencodage, à
+    l'exception des chaînes modifiées par l'anonymisation (spans.py).
     """
-    data = request.get_json()
+    if not request.is_json:
+        return jsonify({"error": "Content-Type must be application/json"}), 415
+    with tracing.span("parse"):
+        raw = spans.read_body(request.stream, request.content_length)
+        metrics.REQUEST_BODY_BYTES.observe(len(raw))
+        try:
+            document = spans.Document.parse(raw)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid JSON: {e}"}), 400
+    data = document.data
 
     if not data:
         return jsonify({"error": "No JSON data"}), 400
 
-    logger.info("=" * 60)
-    logger.info("🚀 Nouvelle requête chat/completions")
-    logger.info(f"   Modèle: {data.get('model', 'unknown')}")
+    # Admission avant tout travail: un gateway saturé refuse vite (429) plutôt que d'empiler
+    try:
+        with tracing.span("admission"):
+            admit_request(data)
+    except AdmissionRejected as e:
+        logger.warning(f"⏳ Requête refusée ({e.reason}), Retry-After {e.retry_after}s")
+        return jsonify({
+            "error": "Gateway overloaded - retry later",
+            "reason": e.reason
+        }), 429, {"Retry-After": str(e.retry_after)}
+
+    logs.count(requests=1)
+    logs.detail(logger, "🚀 Nouvelle requête chat/completions", model=data.get("model", "unknown"))
+
+    # Clé de conversation: les mêmes valeurs reçoivent les mêmes pseudonymes à chaque tour
+    scope = request.headers.get(PSEUDONYM_SCOPE_HEADER) if PSEUDONYM_SCOPE_HEADER else None
+    if scope and len(scope) > PSEUDONYM_SCOPE_MAX_LENGTH:
+        return jsonify({"error": f"{PSEUDONYM_SCOPE_HEADER} is too long (max {PSEUDONYM_SCOPE_MAX_LENGTH})"}), 400
 
     # Anonymiser les messages (OBLIGATOIRE - fail-safe)
+    changed = []
     if "messages" in data:
+        if isinstance(data["messages"], list):
+            metrics.MESSAGES_PER_REQUEST.observe(len(data["messages"]))
         try:
-            original_messages = data["messages"]
-            anonymized_messages = anonymize_messages(original_messages)
-            data["messages"] = anonymized_messages
+            changed = anonymize_messages(data["messages"], scope)
         except AnonymizationError as e:
             logger.error(f"🚫 REQUÊTE BLOQUÉE - Anonymisation échouée: {e}")
+            logs.count(blocked=1)
+            # Disjoncteur ouvert: bloqué sans appel à l'anonymizer
+            unavailable = e.retry_after is not None
+            metrics.BLOCKED.labels("anonymizer_unavailable" if unavailable else "anonymization_failed").inc()
+            headers = {"Retry-After": str(max(1, math.ceil(e.retry_after)))} if unavailable else {}
             return jsonify({
                 "error": "Anonymization failed - request blocked for security",
                 "detail": str(e)
-            }), 503
+            }), 503, headers
 
-    logger.info("📤 Envoi à LiteLLM...")
+    # Cache de complétions: la clé est calculée sur la requête anonymisée, jamais sur le texte brut
+    cache_key = None
+    if completion_cache:
+        cache_control = request.headers.get("Cache-Control", "").lower()
+        reason = CompletionCache.bypass_reason(data)
+        if reason is None:
+            cache_key = CompletionCache.key(data)
+            if "no-cache" not in cache_control:
+                with tracing.span("completion_cache"):
+                    cached = completion_cache.get(cache_key)
+                if cached is not None:
+                    metrics.COMPLETION_CACHE.labels("hit").inc()
+                    logs.count(completion_cache_hits=1)
+                    logs.detail(logger, "📦 Réponse servie par le cache de complétions")
+                    g.cache_status = "HIT"
+                    content_type, body = cached
+                    return Response(body, status=200, content_type=content_type)
+            g.cache_status = "MISS"
+            metrics.COMPLETION_CACHE.labels("miss").inc()
+            if "no-store" in cache_control:
+                cache_key = None
+        else:
+            # stream: jamais rejoué depuis le cache (ni mis en cache)
+            completion_cache.bypasses += 1
+            g.cache_status = "BYPASS"
+            metrics.COMPLETION_CACHE.labels(f"bypass_{reason}").inc()
+
+    # Octets reçus, chaînes anonymisées réencodées à leur place
+    body = document.body(changed)
+    if data.get("stream"):
+        return stream_completion(data, body)
+
+    logs.detail(logger, "📤 Envoi à LiteLLM...", bytes=len(body), rewritten=len(changed))
 
     # Forward à LiteLLM
+    started = time.perf_counter()
     try:
-        response = requests.post(
+        response = http.post(
             f"{LITELLM_URL}/v1/chat/completions",
-            json=data,
+            data=body,
             headers={"Content-Type": "application/json"},
             timeout=60
         )
+        metrics.observe_upstream(data.get("model"), False, response.status_code, time.perf_counter() - started)
+
+        logs.detail(logger, "📥 Réponse LiteLLM", status=response.status_code)
+        if response.status_code >= 400:
+            logs.count(upstream_errors=1)
 
-        logger.info(f"📥 Réponse LiteLLM: {response.status_code}")
-        logger.info("=" * 60)
+        # Seules les réponses réussies sont mises en cache (pas les 429/5xx transitoires)
+        if cache_key and response.status_code == 200:
+            completion_cache.put(cache_key, response.headers.get('content-type'), response.content)
 
         return Response(
             response.content,
@@ -155,10 +606,64 @@ def chat_completions():
             content_type=response.headers.get('content-type')
         )
     except Exception as e:
+        metrics.observe_upstream(data.get("model"), False, "error", time.perf_counter() - started)
         logger.error(f"LiteLLM error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+def stream_completion(data: dict, body: spans.Body):
+    """
+    Relaie les chunks SSE de LiteLLM au client au fil de l'eau (stream: true).
+    Mémoire bornée: rien n'est bufferisé. Si le client se déconnecte, le serveur WSGI
+    ferme le générateur et la connexion amont est fermée: LiteLLM annule la génération.
+    """
+    logs.detail(logger, "📤 Envoi à LiteLLM (streaming)...", bytes=len(body))
+    started = time.perf_counter()
+    try:
+        upstream = http.post(
+            f"{LITELLM_URL}/v1/chat/completions",
+            data=body,
+            headers={"Content-Type": "application/json"},
+            timeout=60,
+            stream=True
+        )
+    except Exception as e:
+        metrics.observe_upstream(data.get("model"), True, "error", time.perf_counter() - started)
+        logger.error(f"LiteLLM error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    metrics.observe_upstream(data.get("model"), True, upstream.status_code, time.perf_counter() - started)
+    logs.detail(logger, "📥 Réponse LiteLLM (stream)", status=upstream.status_code)
+    if upstream.status_code >= 400:
+        logs.count(upstream_errors=1)
+    if upstream.status_code != 200:
+        # Erreur amont: corps court, renvoyé tel quel
+        try:
+            return Response(
+                upstream.content,
+                status=upstream.status_code,
+                content_type=upstream.headers.get('content-type')
+            )
+        finally:
+            upstream.close()
+
+    def relay():
+        try:
+            for chunk in upstream.iter_content(chunk_size=None):
+                if chunk:
+                    yield chunk
+        finally:
+            # Fin normale ou déconnexion client (GeneratorExit): on libère l'amont
+            upstream.close()
+
+    return Response(
+        stream_with_context(relay()),
+        status=upstream.status_code,
+        content_type=upstream.headers.get('content-type', 'text/event-stream'),
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 if __name__ == '__main__':
     logger.info("🌐 Gateway démarré - Port 4000")
     logger.info(f"   Anonymizer: {ANONYMIZER_URL}")
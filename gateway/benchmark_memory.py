@@ -0,0 +1,258 @@
+"""
+Mémoire de pointe d'une requête /v1/chat/completions en fonction de la taille du corps
+
+Pour chaque taille, la requête est rejouée dans un processus forké (même mémoire de
+départ, requête de chauffe déjà faite dans le parent), le corps étant déjà en mémoire
+comme dans le tampon du serveur:
+- rss: hausse du pic de RSS (VmHWM, remis à zéro juste avant la requête; Linux)
+- python: pic des allocations Python (tracemalloc), dans un second fork
+Chaque mesure est aussi exprimée en multiple de la taille du corps. La référence
+json_roundtrip (json.loads puis json.dumps().encode() du corps, coût minimal de l'ancien
+chemin get_json() + json=data) est mesurée de la même façon.
+Temps CPU de l'analyse du corps (meilleur de plusieurs essais), dans le processus parent:
+- get_json: json.loads du corps, ce que faisait request.get_json()
+- parse: spans.Document.parse (arbre et détection des clés répétées)
+- spans: relevé des plages des chaînes, fait en plus quand l'anonymisation modifie une chaîne
+
+L'anonymizer et LiteLLM sont remplacés par un serveur HTTP factice dans un processus
+séparé (anonymisation des adresses e-mail, corps LiteLLM lu puis jeté): seuls les
+allocations et tampons du gateway sont mesurés. Cache d'anonymisation désactivé par défaut
+(ANON_CACHE_BACKEND=none): seule la mémoire propre à la requête compte.
+
+Usage:
+    python benchmark_memory.py
+    python benchmark_memory.py --sizes 1,4,16 --output memory.json
+"""
+import argparse
+import gc
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("ANON_CACHE_BACKEND", "none")
+os.environ.setdefault("ANONYMIZER_PROBE_INTERVAL", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from werkzeug.test import EnvironBuilder  # noqa: E402
+
+import app as gateway  # noqa: E402
+import spans  # noqa: E402
+from app import MSGPACK_MIMETYPE, msgpack  # noqa: E402
+
+SEED = 1337
+DEFAULT_SIZES_MB = (0.25, 1, 4, 16)
+
+WORDS = (
+    "the report was reviewed by our team before the meeting and everyone agreed that the new "
+    "approach should be tested carefully on staging while we wait for feedback from customers"
+).split()
+EMAIL = re.compile(r"[a-z0-9.]+@example\.com")
+
+
+def build_payload(size, seed=SEED):
+    """Conversation JSON d'environ `size` octets: messages de ~4 Ko, une adresse e-mail dans un sur deux."""
+    rng = random.Random(seed)
+    messages = []
+    total = 0
+    while total < size:
+        text = ' '.join(rng.choice(WORDS) for _ in range(700))
+        if len(messages) % 2 == 0:
+            text += f" contact user{len(messages)}@example.com"
+        messages.append({"role": "user" if len(messages) % 2 == 0 else "assistant", "content": text})
+        total += len(text) + 40
+    return json.dumps({"model": "gpt-4", "temperature": 0.2, "messages": messages}).encode("utf-8")
+
+
+class Upstream(BaseHTTPRequestHandler):
+    """Anonymizer (/anonymize/batch) et LiteLLM (/v1/chat/completions) factices, hors du processus mesuré."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        if self.path.endswith("/anonymize/batch"):
+            body = self.rfile.read(length)
+            request = msgpack.unpackb(body, raw=False) if self.headers["Content-Type"] == MSGPACK_MIMETYPE \
+                else json.loads(body)
+            result = {"patterns_version": "bench", "results": [
+                {"anonymized": EMAIL.sub("{{EMAIL}}", text), "anonymized_length": len(text),
+                 "pii_count": 1, "secrets_count": 0} for text in request["texts"]
+            ]}
+            # Comme l'anonymizer: MessagePack si le gateway l'accepte
+            content_type = MSGPACK_MIMETYPE if MSGPACK_MIMETYPE in self.headers.get("Accept", "") \
+                else "application/json"
+            payload = msgpack.packb(result, use_bin_type=True) if content_type == MSGPACK_MIMETYPE \
+                else json.dumps(result).encode("utf-8")
+        else:
+            while length > 0:
+                length -= len(self.rfile.read(min(length, 65536)))
+            content_type, payload = "application/json", b'{"choices": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_upstream():
+    """Serveur factice dans un processus séparé: sa mémoire n'est pas comptée. Retourne (url, processus)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    process = multiprocessing.get_context("fork").Process(target=server.serve_forever, daemon=True)
+    process.start()
+    server.socket.close()
+    return f"http://127.0.0.1:{server.server_port}", process
+
+
+def gateway_request(environ):
+    status = []
+    body = b"".join(gateway.app(environ, lambda code, headers, exc_info=None: status.append(code)))
+    if not status or not status[0].startswith("200"):
+        raise RuntimeError(f"gateway returned {status[0] if status else None}: {body[:200]!r}")
+
+
+def json_roundtrip(raw):
+    json.dumps(json.loads(raw)).encode("utf-8")
+
+
+TARGETS = {
+    "gateway": (
+        lambda raw: EnvironBuilder(
+            path="/v1/chat/completions", method="POST", data=raw, content_type="application/json"
+        ).get_environ(),
+        gateway_request,
+    ),
+    "json_roundtrip": (lambda raw: raw, json_roundtrip),
+}
+
+
+def best_ms(function, repeats=5):
+    """Meilleur temps (ms) de `repeats` exécutions."""
+    best = math.inf
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1000, 2)
+
+
+def parse_times(raw):
+    """Temps CPU de l'analyse du corps: get_json (json.loads), parse (Document.parse), spans (plages)."""
+    buffer = bytearray(raw)
+    return {
+        "get_json_ms": best_ms(lambda: json.loads(raw)),
+        "parse_ms": best_ms(lambda: spans.Document.parse(buffer)),
+        "spans_ms": best_ms(lambda: spans.Document.parse(buffer).spans),
+    }
+
+
+def _status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def _reset_peak_rss():
+    """Remet VmHWM au RSS courant (Linux >= 4.0). False si impossible."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _measure(target, raw, mode, conn):
+    try:
+        prepare, run = TARGETS[target]
+        prepared = prepare(raw)
+        gc.collect()
+        if mode == "python":
+            tracemalloc.start()
+            run(prepared)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        elif _reset_peak_rss():
+            before = _status_kb("VmRSS")
+            run(prepared)
+            peak = (_status_kb("VmHWM") - before) * 1024
+        else:
+            peak = None
+        conn.send(peak)
+    except Exception as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
+
+def measure(target, raw, mode):
+    """Pic mémoire (octets) d'une exécution de la cible dans un processus forké."""
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_measure, args=(target, raw, mode, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    finally:
+        receiver.close()
+        process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def run(sizes_mb=DEFAULT_SIZES_MB):
+    url, upstream = start_upstream()
+    gateway.ANONYMIZER_URL = gateway.LITELLM_URL = url
+    # Chauffe: imports paresseux, connexions keep-alive, avant tout fork
+    gateway_request(TARGETS["gateway"][0](build_payload(16 * 1024)))
+    results = []
+    for size_mb in sizes_mb:
+        raw = build_payload(int(size_mb * 1024 * 1024))
+        entry = {"size_mb": round(len(raw) / 2 ** 20, 2)}
+        for target in TARGETS:
+            for mode in ("rss", "python"):
+                peak = measure(target, raw, mode)
+                entry[f"{target}_{mode}_mb"] = None if peak is None else round(peak / 2 ** 20, 2)
+                entry[f"{target}_{mode}_x"] = None if peak is None else round(peak / len(raw), 2)
+        entry.update(parse_times(raw))
+        results.append(entry)
+        print(
+            f"{entry['size_mb']:8.2f} MB  gateway rss {entry['gateway_rss_mb']} MB ({entry['gateway_rss_x']}x) "
+            f"python {entry['gateway_python_mb']} MB ({entry['gateway_python_x']}x)  "
+            f"json_roundtrip python {entry['json_roundtrip_python_x']}x  "
+            f"get_json {entry['get_json_ms']} ms, parse {entry['parse_ms']} ms (with spans {entry['spans_ms']} ms)",
+            file=sys.stderr
+        )
+    upstream.terminate()
+    return {"version": 1, "python": sys.version.split()[0], "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gateway peak memory versus request body size")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES_MB),
+                        help="Body sizes in MB (comma-separated)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+    report = run([float(size) for size in args.sizes.split(",")])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
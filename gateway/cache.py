@@ -0,0 +1,383 @@
+"""
+Caches du Gateway
+
+1. Résultats d'anonymisation (contenu de message → contenu anonymisé)
+   Les clients renvoient tout l'historique à chaque tour: seuls les nouveaux messages
+   doivent repartir vers l'anonymizer. Les clés sont des HMAC du contenu (jamais le texte
+   brut) préfixées par la version du pattern set de l'anonymizer, ce qui invalide le cache
+   dès que les patterns changent.
+   Backends (ANON_CACHE_BACKEND):
+   - memory: LRU borné + TTL, propre à chaque worker
+   - redis: partagé entre workers gunicorn et réplicas (ANON_CACHE_REDIS_URL)
+
+2. Complétions (opt-in, COMPLETION_CACHE_BACKEND)
+   Les bots de CI et les jobs d'évaluation renvoient des requêtes déterministes identiques
+   (temperature: 0). La réponse LiteLLM est mise en cache, indexée par le hash canonique de
+   la requête APRÈS anonymisation: aucune donnée brute ne sert de clé. Les requêtes stream
+   ne sont jamais servies par le cache.
+   Backends:
+   - memory: LRU borné (entrées et octets) + TTL, propre à chaque worker
+   - disk: SQLite (COMPLETION_CACHE_PATH), partagé par les workers de l'hôte, LRU + TTL
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Versions remplacées retenues pour reconnaître une réponse en retard sur un reload
+RETIRED_VERSIONS = 16
+
+
+class MemoryBackend:
+    """Cache LRU en mémoire avec TTL, thread-safe. max_bytes: taille cumulée des valeurs (0 = pas de limite)."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _discard(self, key: str):
+        value, _ = self._data.pop(key)
+        if self.max_bytes:
+            self._bytes -= len(value)
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                self._discard(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        with self._lock:
+            if key in self._data:
+                self._discard(key)
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            if self.max_bytes:
+                self._bytes += len(value)
+            while len(self._data) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                self._discard(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def size(self):
+        return len(self._data)
+
+
+class RedisBackend:
+    """Cache partagé via un client Redis (get/set avec expiration)."""
+
+    def __init__(self, client, ttl: float = 3600, prefix: str = "llm-shield:anon:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.evictions = 0  # gérées par Redis (maxmemory-policy)
+
+    def get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        return value
+
+    def set(self, key: str, value: str):
+        self.client.set(self.prefix + key, value, ex=int(self.ttl))
+
+    def clear(self):
+        # Les clés sont préfixées par la version: les anciennes expirent via le TTL
+        pass
+
+    def size(self):
+        return None  # inconnu sans parcourir les clés Redis
+
+
+class SqliteBackend:
+    """
+    Cache sur disque (SQLite en mode WAL), partagé entre les workers d'un même hôte.
+    LRU (date de dernier accès) + TTL, bornés en entrées et en octets. Une connexion par
+    processus (rouverte après un fork), les accès sont sérialisés par un verrou.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000, ttl: float = 3600, max_bytes: int = 0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._db = None
+
+    def _conn(self):
+        if self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires_at REAL, used_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at)")
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def get(self, key: str):
+        with self._lock:
+            db = self._conn()
+            row = db.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if row[1] < now:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE entries SET used_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: bytes):
+        with self._lock:
+            db = self._conn()
+            now = time.time()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now + self.ttl, now)
+                )
+                db.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+                count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+                # Les moins récemment utilisées d'abord, jusqu'à repasser sous les deux limites
+                for oldest_key, size in db.execute("SELECT key, size FROM entries ORDER BY used_at").fetchall():
+                    if count <= self.max_entries and (not self.max_bytes or total <= self.max_bytes):
+                        break
+                    db.execute("DELETE FROM entries WHERE key = ?", (oldest_key,))
+                    count, total = count - 1, total - size
+                    self.evictions += 1
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._conn().execute("DELETE FROM entries")
+
+    def size(self):
+        with self._lock:
+            return self._conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class AnonymizationCache:
+    """Cache versionné des contenus anonymisés, avec compteurs hit/miss."""
+
+    def __init__(self, backend, secret: bytes = None):
+        self.backend = backend
+        self.secret = secret or secrets.token_bytes(32)
+        self.version = None
+        # Versions remplacées: une réponse qui en porte encore une (worker de l'anonymizer pas
+        # encore rechargé, sonde en retard) n'invalide plus rien
+        self._retired = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+
+    def _key(self, text: str, version, scope=None) -> str:
+        # Pseudonymes propres à chaque scope: un résultat n'est jamais servi à une autre conversation
+        message = (f"{version or ''}\0{scope}\0{text}" if scope else f"{version or ''}\0{text}").encode("utf-8")
+        digest = hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+        return f"{version or 'unknown'}:{digest}"
+
+    def get_many(self, texts: list, scope=None, version=None) -> dict:
+        """
+        Retourne {index: contenu anonymisé} pour les textes présents dans le cache.
+        version: version du pattern set en service, qui choisit les clés lues (une conversation
+        entièrement en cache n'appelle jamais l'anonymizer, elle doit suivre ses reloads aussi).
+        Une lecture n'observe pas la version: seules les réponses de l'anonymizer le font.
+        """
+        version = version or self.version
+        found = {}
+        for i, text in enumerate(texts):
+            try:
+                value = self.backend.get(self._key(text, version, scope))
+            except Exception as e:
+                logger.warning(f"⚠️ Anonymization cache unavailable: {e}")
+                self.errors += 1
+                value = None
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                found[i] = value
+        return found
+
+    def put_many(self, texts: list, values: list, version=None, scope=None):
+        """Enregistre les résultats d'un appel à l'anonymizer (et observe sa version)."""
+        self.observe_version(version)
+        version = version or self.version
+        for text, value in zip(texts, values):
+            try:
+                self.backend.set(self._key(text, version, scope), value)
+            except Exception as e:
+                logger.warning(f"⚠️ Anonymization cache unavailable: {e}")
+                self.errors += 1
+
+    def observe_version(self, version):
+        """
+        Invalide le cache quand une réponse de l'anonymizer porte une nouvelle version du pattern
+        set. Une version déjà remplacée est ignorée: pendant un reload, les workers de
+        l'anonymizer répondent un temps avec l'une ou l'autre, sans vider le cache à chaque fois.
+        Les clés portant la version, une entrée n'est jamais servie pour une autre version.
+        """
+        if version is None or version == self.version or version in self._retired:
+            return
+        if self.version is not None:
+            logger.info(f"♻️ Pattern set version changed ({self.version} → {version}), cache invalidated")
+            self.invalidations += 1
+            self._retired[self.version] = None
+            while len(self._retired) > RETIRED_VERSIONS:
+                self._retired.popitem(last=False)
+        self.version = version
+        self.backend.clear()
+
+    def clear(self):
+        self.backend.clear()
+        self.version = None
+        self._retired.clear()
+        self.hits = self.misses = self.errors = self.invalidations = 0
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "evictions": self.backend.evictions,
+            "invalidations": self.invalidations,
+            "patterns_version": self.version,
+        }
+
+
+def create_anonymization_cache():
+    """Construit le cache depuis l'environnement (ANON_CACHE_BACKEND=memory|redis|none)."""
+    backend_name = os.getenv("ANON_CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("ANON_CACHE_TTL", "3600"))
+    secret = os.getenv("ANON_CACHE_SECRET")
+    secret = secret.encode("utf-8") if secret else None
+
+    if backend_name == "none":
+        return None
+    if backend_name == "redis":
+        import redis  # dépendance optionnelle, seulement pour le backend partagé
+        client = redis.Redis.from_url(os.getenv("ANON_CACHE_REDIS_URL", "redis://localhost:6379/0"))
+        if secret is None:
+            logger.warning("⚠️ ANON_CACHE_SECRET not set: cache hits won't be shared across processes")
+        return AnonymizationCache(RedisBackend(client, ttl=ttl), secret=secret)
+
+    max_entries = int(os.getenv("ANON_CACHE_MAX_ENTRIES", "10000"))
+    return AnonymizationCache(MemoryBackend(max_entries=max_entries, ttl=ttl), secret=secret)
+
+
+class CompletionCache:
+    """Réponses chat/completions non-stream, indexées par le hash canonique de la requête anonymisée."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(payload: dict) -> str:
+        """Hash de la requête canonique (clés triées): deux requêtes équivalentes ont la même clé."""
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def bypass_reason(payload: dict):
+        """None si la requête peut être servie par le cache, sinon la raison de l'en exclure."""
+        if payload.get("stream"):
+            return "stream"
+        # Seules les requêtes déterministes ont une réponse réutilisable
+        if payload.get("temperature") != 0 or payload.get("n", 1) != 1:
+            return "nondeterministic"
+        return None
+
+    def get(self, key: str):
+        """Retourne (content_type, corps) ou None."""
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"⚠️ Completion cache unavailable: {e}")
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        content_type, _, body = value.partition(b"\n")
+        return content_type.decode("utf-8"), body
+
+    def put(self, key: str, content_type: str, body: bytes):
+        try:
+            self.backend.set(key, (content_type or "").encode("utf-8") + b"\n" + body)
+        except Exception as e:
+            logger.warning(f"⚠️ Completion cache unavailable: {e}")
+            self.errors += 1
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = self.misses = self.bypasses = self.errors = 0
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "errors": self.errors,
+            "evictions": self.backend.evictions,
+        }
+
+
+def create_completion_cache():
+    """Construit le cache de complétions depuis l'environnement (COMPLETION_CACHE_BACKEND=none|memory|disk)."""
+    backend_name = os.getenv("COMPLETION_CACHE_BACKEND", "none").lower()
+    ttl = float(os.getenv("COMPLETION_CACHE_TTL", "3600"))
+    max_entries = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "1000"))
+    max_bytes = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+    if backend_name == "none":
+        return None
+    if backend_name == "disk":
+        path = os.getenv("COMPLETION_CACHE_PATH", "/tmp/completion-cache/completions.sqlite3")
+        return CompletionCache(SqliteBackend(path, max_entries=max_entries, ttl=ttl, max_bytes=max_bytes))
+    if backend_name == "memory":
+        return CompletionCache(MemoryBackend(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes))
+    raise ValueError(f"Unknown COMPLETION_CACHE_BACKEND '{backend_name}' (expected none, memory or disk)")
@@ -0,0 +1,198 @@
+"""
+Disjoncteur et sonde de santé entre le Gateway et l'Anonymizer
+
+Quand l'anonymizer est en panne, chaque requête attendait le timeout complet de l'appel
+avant d'être bloquée, et monopolisait un worker pendant ce temps. Le disjoncteur coupe
+court:
+- closed: les appels passent; après `failure_threshold` échecs consécutifs, il s'ouvre
+- open: les appels échouent immédiatement (CircuitOpenError) pendant `reset_timeout`
+- half_open: quelques appels d'essai passent; un succès le referme, un échec le rouvre
+
+La sonde interroge /health en arrière-plan et met le résultat en cache: le /health du
+Gateway ne fait plus d'appel synchrone. Un échec de sonde compte comme un échec d'appel;
+une sonde réussie pendant que le disjoncteur est ouvert le fait passer en half_open, sans
+attendre la fin de `reset_timeout`.
+
+Le comportement fail-safe est inchangé: un disjoncteur ouvert bloque la requête (503).
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Appel refusé sans être tenté: le service amont est considéré indisponible."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"circuit open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Disjoncteur thread-safe (un par worker). on_change(state) est appelé à chaque transition."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=5.0, half_open_max_calls=1, on_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self.reset()
+
+    @classmethod
+    def from_env(cls, name, prefix, **kwargs):
+        """{prefix}_FAILURES, {prefix}_RESET (secondes), {prefix}_HALF_OPEN_CALLS."""
+        return cls(
+            name,
+            failure_threshold=int(os.getenv(f"{prefix}_FAILURES", "5")),
+            reset_timeout=float(os.getenv(f"{prefix}_RESET", "5")),
+            half_open_max_calls=int(os.getenv(f"{prefix}_HALF_OPEN_CALLS", "1")),
+            **kwargs
+        )
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._trials = 0
+            self._trials_since = None
+
+    def _transition(self, state):
+        # Appelé sous le verrou
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        self._trials = 0
+        self._trials_since = time.monotonic()
+        if state != OPEN:
+            self.failures = 0
+        logger.warning(f"⚡ Circuit {self.name} {state}")
+        if self.on_change is not None:
+            self.on_change(state)
+
+    def before_call(self):
+        """Réserve un appel. Lève CircuitOpenError si le disjoncteur le refuse."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(remaining)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._trials >= self.half_open_max_calls:
+                    # Essais en cours: les autres appels attendent leur verdict (ou leur expiration)
+                    if time.monotonic() - self._trials_since < self.reset_timeout:
+                        raise CircuitOpenError(self.reset_timeout)
+                    self._trials, self._trials_since = 0, time.monotonic()
+                self._trials += 1
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED)
+            else:
+                self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(OPEN)
+            elif self.state == CLOSED:
+                self.failures += 1
+                if self.failures >= self.failure_threshold:
+                    self._transition(OPEN)
+
+    def probe_succeeded(self):
+        """Le service répond à nouveau: les appels d'essai peuvent reprendre."""
+        with self._lock:
+            if self.state == OPEN:
+                self._transition(HALF_OPEN)
+
+    def describe(self):
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()), 3)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in": retry_in,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+            }
+
+
+class HealthProber:
+    """
+    Sonde périodique (thread d'arrière-plan, un par processus, démarré au premier usage).
+    probe() retourne le corps de /health ou lève une exception; interval=0 désactive le
+    thread: chaque status() sonde alors de façon synchrone.
+    """
+
+    def __init__(self, probe, interval=2.0, breaker=None, on_result=None):
+        self.probe = probe
+        self.interval = interval
+        self.breaker = breaker
+        self.on_result = on_result
+        self._pid = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._status = {"ok": None, "checked_at": None, "latency_ms": None, "error": None, "payload": None}
+
+    def ensure_started(self):
+        # Après un fork (workers gunicorn), le thread du parent n'existe plus
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name="anonymizer-prober", daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def check(self):
+        started = time.perf_counter()
+        try:
+            payload = self.probe()
+        except Exception as e:
+            self._status = {
+                "ok": False, "checked_at": time.time(), "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "error": str(e), "payload": None,
+            }
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            return self._status
+        self._status = {
+            "ok": True, "checked_at": time.time(), "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "error": None, "payload": payload,
+        }
+        if self.breaker is not None:
+            self.breaker.probe_succeeded()
+        if self.on_result is not None:
+            self.on_result(payload)
+        return self._status
+
+    def last_payload(self):
+        """Corps du dernier /health reçu (None si la dernière sonde a échoué), sans sonder."""
+        return self._status["payload"]
+
+    def status(self):
+        """Dernier résultat connu (sonde synchrone si aucun n'est encore disponible)."""
+        self.ensure_started()
+        if self.interval <= 0 or self._status["checked_at"] is None:
+            return self.check()
+        return self._status
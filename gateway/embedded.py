@@ -0,0 +1,165 @@
+"""
+Anonymisation dans le processus du Gateway (déploiements mono-hôte)
+
+Chaque appel à l'anonymizer coûte un aller-retour HTTP: encodage JSON, TCP, dispatch
+Flask, décodage, et une réponse qui répète le texte de chaque détection alors que le
+Gateway ne lit que "anonymized". Avec ANONYMIZER_MODE:
+- remote (défaut): appel HTTP à l'anonymizer (/anonymize/batch)
+- embedded: la bibliothèque de l'anonymizer (anonymizer/engine.py) est chargée dans le
+  worker et appelée directement; workers sync uniquement (GATEWAY_WORKER_CLASS=sync)
+- pool: même bibliothèque, exécutée dans un pool de processus locaux (ANONYMIZER_PROCESSES),
+  forkés depuis le worker: le scrubbing CPU-bound ne bloque pas la boucle gevent
+
+Sous gevent ou gthread, un scan embedded tourne hors du thread principal: SCAN_TIMEOUT_MS
+(SIGALRM) ne s'y applique pas, et sous gevent chaque scrub CPU-bound gèle toutes les requêtes
+et tous les streams du worker. Le mode embedded y est donc refusé au démarrage (utiliser pool).
+
+Les modes locaux produisent les mêmes résultats (mêmes patterns, même politique de
+paliers, même garde ReDoS, configurés par les mêmes variables) et gardent la sémantique
+fail-safe: un texte bloqué ou en échec fait échouer tout le batch côté app.py.
+Les pseudonymes par scope sont les mêmes (PSEUDONYM_SECRET), mais sans coffre de réhydratation.
+La bibliothèque (engine.py, pattern_set.py, tiers.py, redos.py, pseudonyms.py) doit être importable:
+ANONYMIZER_LIB_PATH est ajouté au sys.path, et les dépendances de l'anonymizer installées.
+L'image construite avec GATEWAY_VARIANT=embedded les embarque (cf. docker-compose.embedded.yml).
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+MODES = ("remote", "embedded", "pool")
+# Seuls workers où un scan embedded tourne dans le thread principal (limite de temps SIGALRM)
+EMBEDDED_WORKER_CLASSES = ("sync",)
+
+# Moteur du processus courant: hérité par les processus du pool au fork
+_engine = None
+
+
+def _anonymize_item(text, engine=None, fields=None, scope=None):
+    """
+    Résultat d'un texte au format de /anonymize/batch (une erreur est signalée par item),
+    réduit aux champs demandés: moins de données à sérialiser entre les processus du pool.
+    """
+    try:
+        result = (engine or _engine).anonymize(text, scope)
+        return {name: result[name] for name in fields if name in result} if fields else result
+    except Exception as e:
+        # DetectionBlocked (politique de paliers, SCAN_TIMEOUT_MS) ou échec du scrubbing
+        result = {"error": str(e)}
+        if hasattr(e, "tier"):
+            result.update(blocked=True, tier=e.tier, reason=e.reason)
+        return result
+
+
+def _anonymize_pooled(snapshot, text, fields=None, scope=None):
+    """Tâche du pool: aligne d'abord le moteur du processus sur la version du worker."""
+    _engine.sync(*snapshot)
+    return _anonymize_item(text, None, fields, scope)
+
+
+def _noop(_):
+    return None
+
+
+def load_engine(patterns_file, lib_path=None):
+    """
+    Charge la bibliothèque de l'anonymizer et son pattern set. Lève si elle est indisponible.
+    La garde ReDoS n'applique que l'analyse structurelle: ses sondes forkent un processus, ce
+    que le Gateway ne fait pas depuis le thread de sonde qui recharge les patterns.
+    """
+    # En fin de sys.path: les modules du Gateway (metrics, tracing...) restent prioritaires
+    if lib_path and lib_path not in sys.path:
+        sys.path.append(lib_path)
+    engine = importlib.import_module("engine")
+    redos = importlib.import_module("redos")
+    scrub_engine = engine.ScrubEngine(patterns_file, guard=redos.PatternGuard.from_env(probe=False))
+    scrub_engine.load()
+    return scrub_engine
+
+
+class LocalAnonymizer:
+    """Anonymiseur local (embedded ou pool), à la place des appels HTTP à l'anonymizer."""
+
+    def __init__(self, engine, processes=0):
+        self.engine = engine
+        self.processes = processes
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, mode, worker_class=None):
+        """
+        None en mode remote. ANONYMIZER_PATTERNS_FILE, ANONYMIZER_LIB_PATH, ANONYMIZER_PROCESSES.
+        worker_class: classe de worker gunicorn (défaut: GATEWAY_WORKER_CLASS, comme gunicorn.conf.py).
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown ANONYMIZER_MODE '{mode}' (expected one of {list(MODES)})")
+        if mode == "remote":
+            return None
+        worker_class = (worker_class or os.getenv("GATEWAY_WORKER_CLASS", "gevent")).lower()
+        if mode == "embedded" and worker_class not in EMBEDDED_WORKER_CLASSES:
+            raise ValueError(
+                f"ANONYMIZER_MODE=embedded is not supported with {worker_class} workers: scans would run "
+                "without SCAN_TIMEOUT_MS and block the worker (use ANONYMIZER_MODE=pool or GATEWAY_WORKER_CLASS=sync)"
+            )
+        engine = load_engine(
+            os.getenv("ANONYMIZER_PATTERNS_FILE", "patterns.json"),
+            os.getenv("ANONYMIZER_LIB_PATH", "")
+        )
+        processes = int(os.getenv("ANONYMIZER_PROCESSES", str(os.cpu_count() or 1))) if mode == "pool" else 0
+        logger.info(f"✅ Anonymizer {mode} (patterns {engine.version}, {processes} processes)")
+        local = cls(engine, processes)
+        if processes > 0:
+            # Au chargement de l'app dans le worker, avant tout thread (sonde, requêtes)
+            local._get_pool()
+        return local
+
+    @property
+    def mode(self):
+        return "pool" if self.processes > 0 else "embedded"
+
+    def _get_pool(self):
+        # Pool propre à chaque worker gunicorn, forké une seule fois: ses processus suivent
+        # ensuite les reloads par l'instantané transmis avec chaque tâche (_anonymize_pooled)
+        if self._pool is not None and self._pool_pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._start_pool()
+            return self._pool
+
+    def _start_pool(self):
+        global _engine
+        _engine = self.engine
+        pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context('fork'))
+        list(pool.map(_noop, range(self.processes)))  # force le fork immédiat de tous les processus
+        self._pool, self._pool_pid = pool, os.getpid()
+
+    def anonymize_batch(self, texts, fields=None, scope=None):
+        """
+        Même corps que /anonymize/batch: {"results": [...], "patterns_version": ...}.
+        scope: pseudonymes stables (PSEUDONYM_SECRET), sans coffre de réhydratation en mode local.
+        """
+        snapshot = self.engine.snapshot
+        if self.processes > 0:
+            task = partial(_anonymize_pooled, snapshot, fields=fields, scope=scope)
+            results = list(self._get_pool().map(task, texts))
+        else:
+            results = [_anonymize_item(text, self.engine, fields, scope) for text in texts]
+        return {"results": results, "patterns_version": snapshot[0]}
+
+    def health(self):
+        """
+        Équivalent du /health de l'anonymizer (sonde du Gateway). Recharge au passage le
+        pattern set si le fichier a changé, dans ce processus seulement: le pool n'est jamais
+        reforké (pas de fork depuis le thread de sonde), ses processus suivent à la tâche suivante.
+        """
+        self.engine.check_file()
+        return {"status": "healthy", "mode": self.mode, **self.engine.describe()}
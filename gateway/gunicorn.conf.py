@@ -0,0 +1,41 @@
+"""
+Configuration Gunicorn du Gateway
+
+Par défaut: worker gevent (boucle d'événements coopérative). Un appel LiteLLM de 60s
+ne bloque plus le worker: des centaines de complétions peuvent être en vol dans un seul
+processus, /health compris, avec une empreinte mémoire quasi constante (une greenlet par requête).
+
+PROMETHEUS_MULTIPROC_DIR: métriques agrégées entre workers, répertoire vidé au démarrage.
+"""
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', '4000')}"
+
+# gevent (async) | sync | gthread
+worker_class = os.getenv("GATEWAY_WORKER_CLASS", "gevent")
+workers = int(os.getenv("GATEWAY_WORKERS", "1"))
+
+# Nombre max de requêtes simultanées par worker gevent
+worker_connections = int(os.getenv("GATEWAY_WORKER_CONNECTIONS", "1000"))
+
+# Threads par worker si GATEWAY_WORKER_CLASS=gthread
+threads = int(os.getenv("GATEWAY_THREADS", "8"))
+
+# Doit rester supérieur au timeout LiteLLM (60s) pour ne pas tuer les requêtes longues
+timeout = int(os.getenv("GATEWAY_TIMEOUT", "120"))
+keepalive = int(os.getenv("GATEWAY_KEEPALIVE", "5"))
+
+accesslog = "-"
+
+# Chargé avant l'application: les fichiers d'une exécution précédente sont effacés
+multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if multiproc_dir:
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if multiproc_dir:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,111 @@
+"""
+Métriques Prometheus du Gateway (exposées sur /metrics)
+
+- gateway_anonymizer_request_seconds{outcome}: latence des appels à l'anonymizer
+- gateway_upstream_request_seconds{model,stream,status}: latence LiteLLM par modèle
+  (jusqu'aux en-têtes de réponse pour les requêtes stream)
+- gateway_messages_per_request: nombre de messages par requête chat/completions
+- gateway_blocked_requests_total{reason}: requêtes bloquées par le gateway
+- gateway_requests_in_flight: requêtes chat/completions en cours (streams compris)
+- gateway_anonymizer_circuit_state: disjoncteur vers l'anonymizer (0 closed, 1 half_open, 2 open;
+  max sur les workers) et gateway_anonymizer_circuit_transitions_total{state}
+- gateway_admission_in_flight_weight / gateway_admission_queue_depth: poids admis en vol et
+  requêtes en attente d'admission
+- gateway_admission_shed_total{reason,model}: requêtes refusées (429) par le contrôle d'admission
+- gateway_admission_wait_seconds: attente des requêtes admises
+
+Avec plusieurs workers gunicorn, PROMETHEUS_MULTIPROC_DIR active le mode multiprocess
+de prometheus_client (un fichier par processus, agrégés à la lecture de /metrics).
+"""
+import os
+import threading
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+# Le nom du modèle vient du client: nombre de séries borné, les suivants sont regroupés sous "other"
+MAX_MODEL_LABELS = int(os.getenv("METRICS_MAX_MODELS", "50"))
+
+ANONYMIZER_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+MESSAGES_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+BODY_BUCKETS = (1024, 8192, 65536, 262144, 1048576, 4194304, 16777216)
+ADMISSION_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+ANONYMIZER_SECONDS = Histogram(
+    'gateway_anonymizer_request_seconds', 'Anonymizer batch call latency', ['outcome'], buckets=ANONYMIZER_BUCKETS
+)
+UPSTREAM_SECONDS = Histogram(
+    'gateway_upstream_request_seconds', 'LiteLLM latency by model (until response headers when streaming)',
+    ['model', 'stream', 'status'], buckets=UPSTREAM_BUCKETS
+)
+MESSAGES_PER_REQUEST = Histogram(
+    'gateway_messages_per_request', 'Messages per chat completion request', buckets=MESSAGES_BUCKETS
+)
+REQUEST_BODY_BYTES = Histogram(
+    'gateway_request_body_bytes', 'Chat completion request body size', buckets=BODY_BUCKETS
+)
+BLOCKED = Counter('gateway_blocked_requests', 'Requests blocked by the gateway', ['reason'])
+IN_FLIGHT = Gauge('gateway_requests_in_flight', 'Chat completion requests in flight', multiprocess_mode='livesum')
+CIRCUIT_STATE = Gauge(
+    'gateway_anonymizer_circuit_state', 'Anonymizer circuit breaker (0 closed, 1 half_open, 2 open)',
+    multiprocess_mode='livemax'
+)
+CIRCUIT_TRANSITIONS = Counter(
+    'gateway_anonymizer_circuit_transitions', 'Anonymizer circuit breaker transitions', ['state']
+)
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+ADMISSION_IN_FLIGHT = Gauge(
+    'gateway_admission_in_flight_weight', 'Weight of admitted requests in flight', multiprocess_mode='livesum'
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'gateway_admission_queue_depth', 'Requests waiting for admission', multiprocess_mode='livesum'
+)
+ADMISSION_SHED = Counter('gateway_admission_shed', 'Requests rejected by admission control', ['reason', 'model'])
+ADMISSION_WAIT_SECONDS = Histogram(
+    'gateway_admission_wait_seconds', 'Admission queue wait of admitted requests', buckets=ADMISSION_BUCKETS
+)
+COMPLETION_CACHE = Counter(
+    'gateway_completion_cache_requests', 'Completion cache lookups by result (hit, miss, bypass_<reason>)', ['result']
+)
+
+_models = set()
+_models_lock = threading.Lock()
+
+
+def model_label(model):
+    """Label du modèle (borné à MAX_MODEL_LABELS valeurs distinctes par processus)."""
+    if not isinstance(model, str) or not model:
+        return "unknown"
+    if model in _models:
+        return model
+    with _models_lock:
+        if model in _models or len(_models) < MAX_MODEL_LABELS:
+            _models.add(model)
+            return model
+    return "other"
+
+
+def observe_upstream(model, stream, status, seconds):
+    UPSTREAM_SECONDS.labels(model_label(model), "true" if stream else "false", str(status)).observe(seconds)
+
+
+def observe_circuit(state):
+    CIRCUIT_STATE.set(CIRCUIT_STATES[state])
+    CIRCUIT_TRANSITIONS.labels(state).inc()
+
+
+def observe_admission(in_flight, queued):
+    ADMISSION_IN_FLIGHT.set(in_flight)
+    ADMISSION_QUEUE_DEPTH.set(queued)
+
+
+def render():
+    """Retourne (corps, content-type) de /metrics (agrégé sur tous les processus en mode multiprocess)."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
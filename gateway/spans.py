@@ -0,0 +1,187 @@
+"""
+Corps de requête lu une fois, réécrit par plages
+
+Le chemin historique (request.get_json() puis json=data vers LiteLLM) garde plusieurs
+copies d'une grosse requête: les octets reçus, l'arbre décodé, la chaîne JSON ré-encodée
+et ses octets. Ici:
+- read_body: le corps est lu par blocs dans un seul tampon, préalloué quand la longueur est
+  connue; la limite de taille (MAX_CONTENT_LENGTH, GATEWAY_MAX_BODY_BYTES) est appliquée par
+  Flask avant la lecture (Content-Length) ou pendant (corps chunked): 413
+- Document.parse: arbre décodé par json.loads (C), directement depuis le tampon; la plage
+  d'octets (début, fin) de chaque chaîne valeur, indexée par (conteneur, clé), n'est relevée
+  que si des chaînes ont été modifiées (Document.spans), par une passe sur les guillemets
+  appariée à l'arbre
+- Document.body: corps à transmettre, fait des plages d'octets d'origine (memoryview, sans
+  copie) entre les chaînes que l'anonymisation a modifiées, réencodées seules
+
+Une requête dont un objet répète une clé est réencodée en entier: les octets d'origine
+porteraient une valeur que l'arbre décodé (et donc l'anonymisation) n'a jamais vue.
+"""
+import json
+
+# Taille des blocs lus sur le flux d'entrée
+READ_CHUNK_BYTES = 64 * 1024
+
+
+def read_body(stream, length=None, chunk_size=READ_CHUNK_BYTES):
+    """Corps complet dans un seul bytearray (préalloué si `length` est connu: pas d'assemblage)."""
+    if length is not None and hasattr(stream, "readinto"):
+        buffer = bytearray(length)
+        with memoryview(buffer) as view:
+            received = 0
+            while received < length:
+                count = stream.readinto(view[received:received + chunk_size])
+                if not count:
+                    break
+                received += count
+        del buffer[received:]
+        return buffer
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return buffer
+        buffer += chunk
+
+
+def _strings(raw, pos):
+    """
+    Plages (début, fin) des chaînes (clés et valeurs) d'un corps déjà validé par json.loads,
+    dans l'ordre du document. Guillemets et barres obliques inverses cherchés par bytes.find.
+    """
+    find = raw.find
+    while True:
+        start = find(b'"', pos)
+        if start < 0:
+            return
+        end = find(b'"', start + 1)
+        if find(b'\\', start + 1, end) >= 0:
+            # Guillemet échappé: précédé d'un nombre impair de barres obliques inverses
+            while _escaped(raw, end):
+                end = find(b'"', end + 1)
+        pos = end + 1
+        yield start, pos
+
+
+def _escaped(raw, pos):
+    count = 0
+    while raw[pos - 1 - count] == 0x5C:
+        count += 1
+    return count % 2 == 1
+
+
+def _locate(raw, data, start=0):
+    """
+    Plages (début, fin) des chaînes valeurs de l'arbre `data` décodé depuis `raw`, indexées par
+    (conteneur, clé). Les chaînes du corps (clés et valeurs, dans l'ordre du document) sont
+    relevées par _strings et appariées à un parcours de l'arbre, dont seuls les conteneurs et
+    les types comptent: les valeurs peuvent déjà avoir été réécrites. None si l'appariement
+    échoue (le corps sera alors réencodé depuis l'arbre).
+    """
+    tokens = _strings(raw, start)
+    spans = {}
+
+    def walk(node):
+        items = node.items() if isinstance(node, dict) else enumerate(node)
+        for key, value in items:
+            if isinstance(node, dict):
+                next(tokens)
+            if isinstance(value, str):
+                spans[(id(node), key)] = next(tokens)
+            elif isinstance(value, (dict, list)):
+                walk(value)
+
+    try:
+        if isinstance(data, (dict, list)):
+            walk(data)
+    except (StopIteration, RecursionError):
+        return None
+    if next(tokens, None) is not None:
+        return None
+    return spans
+
+
+def _encode(value):
+    """Chaîne JSON d'une valeur réécrite (UTF-8; échappée si elle contient un surrogate isolé)."""
+    try:
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+    except UnicodeEncodeError:
+        return json.dumps(value).encode("ascii")
+
+
+class Body:
+    """Corps de requête en morceaux, de longueur connue (Content-Length, pas de chunked)."""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.length = sum(len(piece) for piece in pieces)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.pieces)
+
+
+class Document:
+    """Corps JSON reçu: octets d'origine, arbre décodé et plages des chaînes valeurs."""
+
+    def __init__(self, raw, data, duplicates=False, start=0):
+        self.raw = raw
+        self.data = data
+        self.duplicates = duplicates
+        self.start = start
+        self._spans = False
+
+    @classmethod
+    def parse(cls, raw):
+        """Lève ValueError si le corps n'est pas du JSON valide (UTF-8)."""
+        duplicates = []
+
+        def pairs_to_dict(pairs):
+            result = dict(pairs)
+            if len(result) != len(pairs):
+                duplicates.append(True)
+            return result
+
+        # BOM UTF-8 toléré comme par json.loads (il reste dans les octets transmis)
+        start = 3 if raw[:3] == b'\xef\xbb\xbf' else 0
+        with memoryview(raw) as view:
+            text = str(view[start:], "utf-8")
+        try:
+            data = json.loads(text, object_pairs_hook=pairs_to_dict)
+        except RecursionError:
+            raise ValueError("JSON nested too deeply") from None
+        return cls(raw, data, bool(duplicates), start)
+
+    @property
+    def spans(self):
+        """Plages des chaînes valeurs (None si elles n'ont pas pu être relevées), calculées une fois."""
+        if self._spans is False:
+            self._spans = _locate(self.raw, self.data, self.start)
+        return self._spans
+
+    def body(self, changed=()):
+        """
+        Corps à transmettre: octets d'origine, sauf les chaînes `changed` (emplacements
+        (conteneur, clé) de l'arbre) remplacées par leur nouvelle valeur.
+        """
+        if self.duplicates:
+            return Body([_encode(self.data)])
+        if not changed:
+            return Body([memoryview(self.raw)])
+        spans = self.spans
+        try:
+            replacements = sorted((spans[(id(container), key)], container[key]) for container, key in changed)
+        except (KeyError, TypeError):
+            # Emplacement sans plage connue (ou plages non relevées): tout est réencodé depuis l'arbre
+            return Body([_encode(self.data)])
+        view = memoryview(self.raw)
+        pieces = []
+        pos = 0
+        for (start, end), value in replacements:
+            pieces.append(view[pos:start])
+            pieces.append(_encode(value))
+            pos = end
+        pieces.append(view[pos:])
+        return Body(pieces)
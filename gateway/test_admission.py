@@ -0,0 +1,153 @@
+"""
+Unit Tests for gateway admission control
+"""
+import threading
+import time
+
+import pytest
+from admission import AdmissionController, AdmissionRejected, load_model_limits
+
+
+def admit_later(controller, client, model, weight=1):
+    """Lance admit() dans un thread; retourne (thread, résultat)."""
+    result = {}
+
+    def run():
+        try:
+            result['ticket'] = controller.admit(client, model, weight)
+        except AdmissionRejected as e:
+            result['rejected'] = e.reason
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def wait_queued(controller, count):
+    for _ in range(200):
+        if controller.describe()['queued'] == count:
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"{count} requests never queued")
+
+
+class TestAdmissionController:
+    """Tests for limits, queueing and shedding."""
+
+    def test_admits_within_limit(self):
+        controller = AdmissionController(max_in_flight=2)
+        first = controller.admit('a', 'm')
+        controller.admit('b', 'm')
+        assert controller.describe()['in_flight'] == 2
+        controller.release(first)
+        assert controller.describe()['in_flight'] == 1
+
+    def test_queue_full_is_rejected_immediately(self):
+        controller = AdmissionController(max_in_flight=1, queue_size=0)
+        controller.admit('a', 'm')
+        with pytest.raises(AdmissionRejected) as excinfo:
+            controller.admit('b', 'm')
+        assert excinfo.value.reason == 'queue_full'
+        assert excinfo.value.retry_after >= 1
+
+    def test_queue_deadline(self):
+        controller = AdmissionController(max_in_flight=1, queue_timeout=0.05)
+        controller.admit('a', 'm')
+        started = time.monotonic()
+        with pytest.raises(AdmissionRejected) as excinfo:
+            controller.admit('b', 'm')
+        assert excinfo.value.reason == 'queue_timeout'
+        assert 0.05 <= time.monotonic() - started < 1
+        assert controller.describe()['queued'] == 0
+
+    def test_waiter_is_admitted_on_release(self):
+        controller = AdmissionController(max_in_flight=1, queue_timeout=5)
+        ticket = controller.admit('a', 'm')
+        thread, result = admit_later(controller, 'b', 'm')
+        wait_queued(controller, 1)
+        controller.release(ticket)
+        thread.join(timeout=5)
+        assert result['ticket'].waited > 0
+
+    def test_per_client_limit(self):
+        controller = AdmissionController(max_in_flight=10, max_per_client=1)
+        controller.admit('a', 'm')
+        with pytest.raises(AdmissionRejected) as excinfo:
+            controller.admit('a', 'm')
+        assert excinfo.value.reason == 'client_limit'
+        controller.admit('b', 'm')
+
+    def test_model_limit_does_not_block_other_models(self):
+        controller = AdmissionController(max_in_flight=10, queue_timeout=5, model_limits={'gpt-4': 1})
+        gpt4 = controller.admit('a', 'gpt-4')
+        thread, result = admit_later(controller, 'b', 'gpt-4')
+        wait_queued(controller, 1)
+        # Le modèle saturé n'empêche pas les autres de passer, même avec une file non vide
+        controller.admit('c', 'claude-3-haiku')
+        controller.release(gpt4)
+        thread.join(timeout=5)
+        assert 'ticket' in result
+
+    def test_saturated_model_does_not_fill_the_queue_of_other_models(self):
+        controller = AdmissionController(max_in_flight=10, queue_size=1, queue_timeout=5, model_limits={'gpt-4': 1})
+        gpt4 = controller.admit('a', 'gpt-4')
+        thread, result = admit_later(controller, 'b', 'gpt-4')
+        wait_queued(controller, 1)
+        # La file de gpt-4 est pleine: refus pour gpt-4 seulement
+        with pytest.raises(AdmissionRejected) as excinfo:
+            controller.admit('c', 'gpt-4')
+        assert excinfo.value.reason == 'queue_full'
+        controller.admit('d', 'claude-3-haiku')
+        controller.release(gpt4)
+        thread.join(timeout=5)
+        assert 'ticket' in result
+
+    def test_heavy_request_keeps_its_place(self):
+        controller = AdmissionController(max_in_flight=4, queue_timeout=5)
+        heavy = controller.admit('a', 'm', weight=3)
+        waiting_heavy, heavy_result = admit_later(controller, 'b', 'm', weight=2)
+        wait_queued(controller, 1)
+        waiting_light, light_result = admit_later(controller, 'c', 'm', weight=1)
+        wait_queued(controller, 2)
+        # Une place de poids 1 est libre, mais la requête lourde arrivée avant garde la priorité
+        assert controller.describe()['in_flight'] == 3
+        controller.release(heavy)
+        waiting_heavy.join(timeout=5)
+        waiting_light.join(timeout=5)
+        assert 'ticket' in heavy_result and 'ticket' in light_result
+
+    def test_weights(self):
+        assert AdmissionController(weight='none').weigh(10 ** 6, 100) == 1
+        by_bytes = AdmissionController(max_in_flight=8, weight='bytes', weight_unit=1000)
+        assert by_bytes.weigh(999) == 1
+        assert by_bytes.weigh(2500) == 3
+        assert by_bytes.weigh(10 ** 9) == 8  # plafonné: passe seule plutôt que jamais
+        by_messages = AdmissionController(max_in_flight=8, weight='messages', weight_unit=4)
+        assert by_messages.weigh(messages=4) == 1
+        assert by_messages.weigh(messages=5) == 2
+
+    def test_unknown_weight_mode(self):
+        with pytest.raises(ValueError):
+            AdmissionController(weight='tokens')
+
+
+class TestModelLimits:
+    """Tests for per-model limits read from the LiteLLM config."""
+
+    def test_load_from_litellm_config(self, tmp_path):
+        config = tmp_path / 'litellm-config.yaml'
+        config.write_text(
+            "model_list:\n"
+            "  - model_name: gpt-4\n"
+            "    litellm_params: {model: openai/gpt-4, max_parallel_requests: 4}\n"
+            "  - model_name: gpt-4\n"
+            "    litellm_params: {model: azure/gpt-4}\n"
+            "    model_info: {max_in_flight: 2}\n"
+            "  - model_name: gemini-pro\n"
+            "    litellm_params: {model: gemini/gemini-pro}\n"
+        )
+        assert load_model_limits(str(config)) == {'gpt-4': 6}
+
+    def test_missing_config(self, tmp_path):
+        assert load_model_limits(str(tmp_path / 'missing.yaml')) == {}
+        assert load_model_limits('') == {}
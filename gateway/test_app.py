@@ -1,11 +1,50 @@
 """
 Unit Tests for Gateway Service
 """
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import msgpack
 import pytest
+import requests
+from flask import g
+from prometheus_client import REGISTRY
 from unittest.mock import patch, Mock
+import app as app_module
+import tracing
+import upstream
+from admission import AdmissionController
+from cache import CompletionCache, MemoryBackend
+from embedded import LocalAnonymizer
+from test_embedded import FakeEngine
 from app import app, AnonymizationError
 
 
+def decode_body(body):
+    """Corps transmis à LiteLLM (octets reçus, chaînes anonymisées réencodées), décodé."""
+    return json.loads(b''.join(body))
+
+
+def sent_json(call):
+    return decode_body(call.kwargs['data'])
+
+
+def decode_batch(json=None, data=None, headers=None, **kwargs):
+    """Batch envoyé à /anonymize/batch (MessagePack si disponible, JSON sinon), décodé."""
+    if data is not None and headers.get('Content-Type') == 'application/msgpack':
+        return msgpack.unpackb(data, raw=False)
+    return json
+
+
+def sent_batch(call):
+    return decode_batch(**call.kwargs)
+
+
 @pytest.fixture
 def client():
     """Create test client."""
@@ -14,10 +53,39 @@ def client():
         yield client
 
 
+@pytest.fixture
+def conversation_header(monkeypatch):
+    """Pseudonymes par conversation activés (désactivés par défaut)."""
+    monkeypatch.setattr(app_module, 'PSEUDONYM_SCOPE_HEADER', 'X-Conversation-Id')
+
+
+@pytest.fixture(autouse=True)
+def reset_cache():
+    """Each test starts with an empty anonymization cache."""
+    app_module.anonymization_cache.clear()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_anonymizer_circuit(monkeypatch):
+    """Each test starts with a closed circuit and synchronous health probes."""
+    monkeypatch.setattr(app_module.anonymizer_prober, 'interval', 0)
+    app_module.anonymizer_prober.reset()
+    app_module.anonymizer_breaker.reset()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_admission(monkeypatch):
+    """Each test gets its own admission controller (the test client never closes responses)."""
+    monkeypatch.setattr(app_module, 'admission', AdmissionController(on_change=app_module.metrics.observe_admission))
+    yield
+
+
 class TestHealthEndpoint:
     """Tests for /health endpoint."""
     
-    @patch('app.requests.get')
+    @patch('app.http.get')
     def test_health_with_anonymizer_ok(self, mock_get, client):
         mock_get.return_value = Mock(status_code=200)
         response = client.get('/health')
@@ -25,7 +93,7 @@ class TestHealthEndpoint:
         assert response.json['status'] == 'healthy'
         assert response.json['anonymizer'] == 'ok'
     
-    @patch('app.requests.get')
+    @patch('app.http.get')
     def test_health_with_anonymizer_down(self, mock_get, client):
         mock_get.side_effect = Exception('Connection refused')
         response = client.get('/health')
@@ -33,21 +101,41 @@ class TestHealthEndpoint:
         assert response.json['status'] == 'degraded'
         assert response.json['anonymizer'] == 'unreachable'
 
+    @patch('app.http.get')
+    def test_health_reports_anonymizer_patterns_version(self, mock_get, client):
+        mock_get.return_value = Mock(status_code=200)
+        mock_get.return_value.json.return_value = {'status': 'healthy', 'patterns_version': 'abc123'}
+        response = client.get('/health')
+        assert response.json['anonymizer_patterns_version'] == 'abc123'
+        assert app_module.anonymization_cache.version == 'abc123'
+
+
+class TestUpstreamConnectionPools:
+    """Tests for the keep-alive connection pools."""
+
+    def test_each_upstream_has_its_own_bounded_pool(self):
+        anonymizer_adapter = app_module.http.get_adapter(app_module.ANONYMIZER_URL + '/anonymize/batch')
+        litellm_adapter = app_module.http.get_adapter(app_module.LITELLM_URL + '/v1/chat/completions')
+        assert anonymizer_adapter is not litellm_adapter
+        assert anonymizer_adapter._pool_maxsize == app_module.ANONYMIZER_POOL_SIZE
+        assert litellm_adapter._pool_maxsize == app_module.LITELLM_POOL_SIZE
+        assert anonymizer_adapter._pool_block and litellm_adapter._pool_block
+
 
 class TestChatCompletions:
     """Tests for /v1/chat/completions endpoint."""
     
-    @patch('app.requests.post')
+    @patch('app.http.post')
     def test_chat_with_successful_anonymization(self, mock_post, client):
         # Mock anonymizer response
         anonymizer_response = Mock()
         anonymizer_response.status_code = 200
-        anonymizer_response.json.return_value = {
+        anonymizer_response.json.return_value = {'results': [{
             'anonymized': 'My email is {{EMAIL}}',
             'anonymized_length': 21,
             'pii_count': 1,
             'secrets_count': 0
-        }
+        }]}
         
         # Mock LiteLLM response
         litellm_response = Mock()
@@ -63,8 +151,54 @@ class TestChatCompletions:
         })
         
         assert response.status_code == 200
-    
-    @patch('app.requests.post')
+
+    @patch('app.http.post')
+    def test_chat_anonymizes_conversation_in_one_call(self, mock_post, client):
+        anonymizer_response = Mock(status_code=200)
+        anonymizer_response.json.return_value = {'results': [
+            {'anonymized': 'You are {{NAME}}', 'anonymized_length': 16, 'pii_count': 1, 'secrets_count': 0},
+            {'anonymized': 'Mail {{EMAIL}}', 'anonymized_length': 14, 'pii_count': 1, 'secrets_count': 0},
+        ]}
+        litellm_response = Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+        mock_post.side_effect = [anonymizer_response, litellm_response]
+
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-3.5-turbo',
+            'messages': [
+                {'role': 'system', 'content': 'You are John'},
+                {'role': 'assistant', 'content': ''},
+                {'role': 'user', 'content': 'Mail test@example.com'},
+            ]
+        })
+
+        assert response.status_code == 200
+        assert mock_post.call_count == 2
+        assert mock_post.call_args_list[0].args[0].endswith('/anonymize/batch')
+        assert sent_batch(mock_post.call_args_list[0]) == {
+            'texts': ['You are John', 'Mail test@example.com'],
+            'fields': ['anonymized', 'anonymized_length', 'pii_count', 'secrets_count']
+        }
+        sent = sent_json(mock_post.call_args_list[1])['messages']
+        assert [m['content'] for m in sent] == ['You are {{NAME}}', '', 'Mail {{EMAIL}}']
+
+    @patch('app.http.post')
+    def test_chat_blocks_when_one_batch_item_fails(self, mock_post, client):
+        anonymizer_response = Mock(status_code=200)
+        anonymizer_response.json.return_value = {'results': [
+            {'anonymized': 'ok', 'anonymized_length': 2, 'pii_count': 0, 'secrets_count': 0},
+            {'error': 'Scrubbing failed'},
+        ]}
+        mock_post.return_value = anonymizer_response
+
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-3.5-turbo',
+            'messages': [{'role': 'user', 'content': 'first'}, {'role': 'user', 'content': 'second'}]
+        })
+
+        assert response.status_code == 503
+        assert mock_post.call_count == 1
+
+    @patch('app.http.post')
     def test_chat_blocks_when_anonymizer_fails(self, mock_post, client):
         import requests
         mock_post.side_effect = requests.exceptions.ConnectionError('Anonymizer unavailable')
@@ -77,7 +211,7 @@ class TestChatCompletions:
         assert response.status_code == 503
         assert 'blocked' in response.json['error'].lower()
     
-    @patch('app.requests.post')
+    @patch('app.http.post')
     def test_chat_blocks_when_anonymizer_returns_error(self, mock_post, client):
         mock_response = Mock()
         mock_response.status_code = 500
@@ -97,10 +231,490 @@ class TestChatCompletions:
         assert response.status_code == 400
 
 
+class TestAnonymizationCache:
+    """Tests for the conversation-aware anonymization cache."""
+
+    @staticmethod
+    def _anonymizer(*contents, version='v1'):
+        response = Mock(status_code=200)
+        response.json.return_value = {'patterns_version': version, 'results': [
+            {'anonymized': c.upper(), 'anonymized_length': len(c), 'pii_count': 0, 'secrets_count': 0}
+            for c in contents
+        ]}
+        return response
+
+    @staticmethod
+    def _litellm():
+        return Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+
+    @patch('app.http.post')
+    def test_only_new_turns_are_sent(self, mock_post, client):
+        first_turn = [{'role': 'system', 'content': 'sys'}, {'role': 'user', 'content': 'hello'}]
+        mock_post.side_effect = [self._anonymizer('sys', 'hello'), self._litellm()]
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': first_turn})
+
+        second_turn = first_turn + [{'role': 'assistant', 'content': 'hi'}, {'role': 'user', 'content': 'bye'}]
+        mock_post.side_effect = [self._anonymizer('hi', 'bye'), self._litellm()]
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': second_turn})
+
+        assert sent_batch(mock_post.call_args_list[2])['texts'] == ['hi', 'bye']
+        sent = sent_json(mock_post.call_args_list[3])['messages']
+        assert [m['content'] for m in sent] == ['SYS', 'HELLO', 'HI', 'BYE']
+        stats = app_module.anonymization_cache.stats()
+        assert stats['hits'] == 2
+        assert stats['misses'] == 4
+
+    @patch('app.http.post')
+    def test_full_hit_skips_anonymizer(self, mock_post, client):
+        messages = [{'role': 'user', 'content': 'hello'}]
+        mock_post.side_effect = [self._anonymizer('hello'), self._litellm(), self._litellm()]
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': messages})
+        response = client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': messages})
+        assert response.status_code == 200
+        assert mock_post.call_count == 3
+        assert sent_json(mock_post.call_args_list[2])['messages'][0]['content'] == 'HELLO'
+
+    @patch('app.http.post')
+    def test_full_hit_follows_anonymizer_reload(self, mock_post, client, monkeypatch):
+        messages = [{'role': 'user', 'content': 'hello'}]
+        mock_post.side_effect = [
+            self._anonymizer('hello'), self._litellm(), self._anonymizer('hello', version='v2'), self._litellm()
+        ]
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': messages})
+        # Reload vu par la sonde: la conversation entièrement en cache repasse par l'anonymizer
+        monkeypatch.setattr(app_module, 'anonymizer_patterns_version', lambda: 'v2')
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': messages})
+        assert mock_post.call_count == 4
+        assert sent_batch(mock_post.call_args_list[2])['texts'] == ['hello']
+
+    @patch('app.http.get')
+    def test_patterns_version_comes_from_last_probe(self, mock_get):
+        assert app_module.anonymizer_patterns_version() is None
+        mock_get.return_value = Mock(status_code=200)
+        mock_get.return_value.json.return_value = {'patterns_version': 'v3'}
+        app_module.anonymizer_prober.check()
+        assert app_module.anonymizer_patterns_version() == 'v3'
+        assert mock_get.call_count == 1  # lue sans nouvelle sonde
+
+    @patch('app.http.post')
+    def test_conversation_scope_is_forwarded(self, mock_post, client, conversation_header):
+        messages = [{'role': 'user', 'content': 'hello'}]
+        mock_post.side_effect = [self._anonymizer('hello'), self._litellm(), self._anonymizer('hello'), self._litellm()]
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': messages},
+                    headers={'X-Conversation-Id': 'conv-1'})
+        assert sent_batch(mock_post.call_args_list[0])['scope'] == 'conv-1'
+        # Autre conversation: pseudonymes différents, le résultat en cache de conv-1 n'est pas réutilisé
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': messages},
+                    headers={'X-Conversation-Id': 'conv-2'})
+        assert sent_batch(mock_post.call_args_list[2])['scope'] == 'conv-2'
+
+    @patch('app.http.post')
+    def test_no_scope_without_header(self, mock_post, client, conversation_header):
+        mock_post.side_effect = [self._anonymizer('hello'), self._litellm()]
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'hello'}]})
+        assert 'scope' not in sent_batch(mock_post.call_args_list[0])
+
+    @patch('app.http.post')
+    def test_scope_header_is_ignored_by_default(self, mock_post, client):
+        assert app_module.PSEUDONYM_SCOPE_HEADER == ''
+        mock_post.side_effect = [self._anonymizer('hello'), self._litellm()]
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'hello'}]},
+                    headers={'X-Conversation-Id': 'conv-1'})
+        assert 'scope' not in sent_batch(mock_post.call_args_list[0])
+
+    @patch('app.http.post')
+    def test_oversized_scope_is_rejected(self, mock_post, client, conversation_header):
+        response = client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': []},
+                               headers={'X-Conversation-Id': 'x' * 300})
+        assert response.status_code == 400
+        mock_post.assert_not_called()
+
+    @patch('app.http.get')
+    def test_health_exposes_cache_counters(self, mock_get, client):
+        mock_get.return_value = Mock(status_code=200)
+        response = client.get('/health')
+        assert response.json['anonymization_cache']['hits'] == 0
+        assert response.json['anonymization_cache']['backend'] == 'MemoryBackend'
+
+
+class TestCompletionCache:
+    """Tests for the opt-in completion cache."""
+
+    @pytest.fixture(autouse=True)
+    def enable_cache(self, monkeypatch):
+        monkeypatch.setattr(app_module, 'completion_cache', CompletionCache(MemoryBackend()))
+
+    @staticmethod
+    def _anonymizer(content):
+        response = Mock(status_code=200)
+        response.json.return_value = {'patterns_version': 'v1', 'results': [
+            {'anonymized': '{{EMAIL}}', 'anonymized_length': 9, 'pii_count': 1, 'secrets_count': 0}
+        ]}
+        return response
+
+    @staticmethod
+    def _litellm(status=200):
+        return Mock(status_code=status, content=b'{"id": "cmpl-1"}', headers={'content-type': 'application/json'})
+
+    @staticmethod
+    def _request(content='john@example.com', **extra):
+        return {'model': 'gpt-4', 'temperature': 0, 'messages': [{'role': 'user', 'content': content}], **extra}
+
+    @patch('app.http.post')
+    def test_second_identical_request_is_a_hit(self, mock_post, client):
+        mock_post.side_effect = [self._anonymizer('john@example.com'), self._litellm()]
+        first = client.post('/v1/chat/completions', json=self._request())
+        second = client.post('/v1/chat/completions', json=self._request())
+        assert first.headers['X-Cache'] == 'MISS'
+        assert second.headers['X-Cache'] == 'HIT'
+        assert second.data == b'{"id": "cmpl-1"}'
+        assert second.content_type == 'application/json'
+        assert mock_post.call_count == 2  # anonymisation servie par son cache, LiteLLM pas rappelé
+
+    @patch('app.http.post')
+    def test_key_is_the_anonymized_request(self, mock_post, client):
+        # Deux PII différentes anonymisées à l'identique partagent la réponse; aucune n'apparaît dans la clé
+        mock_post.side_effect = [self._anonymizer('john@example.com'), self._litellm(),
+                                 self._anonymizer('jane@example.com')]
+        client.post('/v1/chat/completions', json=self._request('john@example.com'))
+        response = client.post('/v1/chat/completions', json=self._request('jane@example.com'))
+        assert response.headers['X-Cache'] == 'HIT'
+        keys = list(app_module.completion_cache.backend._data)
+        assert keys == [CompletionCache.key(self._request('{{EMAIL}}'))]
+
+    @patch('app.http.post')
+    def test_errors_are_not_cached(self, mock_post, client):
+        mock_post.side_effect = [self._anonymizer('john@example.com'), self._litellm(429), self._litellm()]
+        client.post('/v1/chat/completions', json=self._request())
+        response = client.post('/v1/chat/completions', json=self._request())
+        assert response.headers['X-Cache'] == 'MISS'
+        assert response.status_code == 200
+
+    @patch('app.http.post')
+    def test_stream_and_sampled_requests_bypass(self, mock_post, client):
+        stream = Mock(status_code=200, headers={'content-type': 'text/event-stream'})
+        stream.iter_content.return_value = iter([b'data: [DONE]\n\n'])
+        mock_post.side_effect = [self._anonymizer('john@example.com'), stream, self._litellm(), self._litellm()]
+        streamed = client.post('/v1/chat/completions', json=self._request(stream=True))
+        assert streamed.headers['X-Cache'] == 'BYPASS'
+        assert streamed.data == b'data: [DONE]\n\n'
+        sampled = self._request(temperature=0.7)
+        client.post('/v1/chat/completions', json=sampled)
+        response = client.post('/v1/chat/completions', json=sampled)
+        assert response.headers['X-Cache'] == 'BYPASS'
+        assert app_module.completion_cache.stats()['entries'] == 0
+
+    @patch('app.http.post')
+    def test_cache_control_is_honoured(self, mock_post, client):
+        mock_post.side_effect = [self._anonymizer('john@example.com'), self._litellm(), self._litellm(),
+                                 self._litellm()]
+        client.post('/v1/chat/completions', json=self._request(), headers={'Cache-Control': 'no-store'})
+        assert app_module.completion_cache.stats()['entries'] == 0
+        client.post('/v1/chat/completions', json=self._request())
+        response = client.post('/v1/chat/completions', json=self._request(), headers={'Cache-Control': 'no-cache'})
+        assert response.headers['X-Cache'] == 'MISS'
+        assert mock_post.call_count == 4
+
+    def test_disabled_by_default(self, client, monkeypatch):
+        monkeypatch.setattr(app_module, 'completion_cache', None)
+        with patch('app.http.post') as mock_post:
+            mock_post.side_effect = [self._anonymizer('john@example.com'), self._litellm()]
+            response = client.post('/v1/chat/completions', json=self._request())
+        assert 'X-Cache' not in response.headers
+        with patch('app.http.get', return_value=Mock(status_code=200)):
+            assert client.get('/health').json['completion_cache'] is None
+
+
+class TestRequestBody:
+    """Tests for body size limits and span-based forwarding."""
+
+    @staticmethod
+    def _anonymizer(texts):
+        response = Mock(status_code=200)
+        response.json.return_value = {'patterns_version': 'v1', 'results': [
+            {'anonymized': text.replace('john@example.com', '{{EMAIL}}'), 'anonymized_length': 0,
+             'pii_count': 1, 'secrets_count': 0} for text in texts
+        ]}
+        return response
+
+    @patch('app.http.post')
+    def test_received_bytes_are_forwarded_except_anonymized_strings(self, mock_post, client):
+        raw = '{ "model": "gpt-4",\n  "messages": [{"role": "user", "content": "été, mail john@example.com"}],' \
+              '\n  "temperature": 0.50, "metadata": {"note": "kept\\u00a0as is"} }'
+        mock_post.side_effect = [
+            self._anonymizer(['été, mail john@example.com']),
+            Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'}),
+        ]
+        response = client.post('/v1/chat/completions', data=raw.encode('utf-8'), content_type='application/json')
+        assert response.status_code == 200
+        forwarded = b''.join(mock_post.call_args_list[1].kwargs['data'])
+        assert forwarded == raw.replace('john@example.com', '{{EMAIL}}').encode('utf-8')
+
+    def test_oversized_body_is_rejected_before_anonymization(self, client, monkeypatch):
+        monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 100)
+        with patch('app.http.post') as mock_post:
+            response = client.post('/v1/chat/completions', json={
+                'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'x' * 200}]
+            })
+        assert response.status_code == 413
+        assert 'too large' in response.json['error']
+        mock_post.assert_not_called()
+
+    def test_non_json_content_type(self, client):
+        response = client.post('/v1/chat/completions', data='{}', content_type='text/plain')
+        assert response.status_code == 415
+
+
+class TestStructuredContent:
+    """Tests for content parts, tool calls and names."""
+
+    @staticmethod
+    def _post(calls):
+        """Anonymizer qui met les textes en majuscules; LiteLLM renvoie {}."""
+        def post(url, json=None, data=None, **kwargs):
+            if url.endswith('/anonymize/batch'):
+                batch = decode_batch(json, data, **kwargs)
+                calls.append((url, batch))
+                response = Mock(status_code=200)
+                response.json.return_value = {'patterns_version': 'v1', 'results': [
+                    {'anonymized': t.upper(), 'anonymized_length': len(t), 'pii_count': 0, 'secrets_count': 0}
+                    for t in batch['texts']
+                ]}
+                return response
+            calls.append((url, decode_body(data)))
+            return Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+        return post
+
+    def test_every_leaf_in_one_deduplicated_call(self, client):
+        calls = []
+        messages = [
+            {'role': 'user', 'name': 'john', 'content': [
+                {'type': 'text', 'text': 'mail john@example.com'},
+                {'type': 'image_url', 'image_url': {'url': 'https://example.com/a.png'}},
+            ]},
+            {'role': 'assistant', 'content': None, 'tool_calls': [{'id': 'call_1', 'type': 'function', 'function': {
+                'name': 'send_mail', 'arguments': json.dumps({'to': 'john@example.com', 'body': 'mail john@example.com'})
+            }}]},
+            {'role': 'tool', 'tool_call_id': 'call_1', 'content': 'sent to john@example.com'},
+        ]
+        with patch('app.http.post', side_effect=self._post(calls)):
+            response = client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': messages})
+        assert response.status_code == 200
+        assert len(calls) == 2
+        assert sorted(calls[0][1]['texts']) == sorted([
+            'john', 'mail john@example.com', 'to', 'john@example.com', 'body', 'sent to john@example.com'
+        ])
+        sent = calls[1][1]['messages']
+        assert sent[0]['name'] == 'JOHN'
+        assert sent[0]['content'][0]['text'] == 'MAIL JOHN@EXAMPLE.COM'
+        assert sent[0]['content'][1]['image_url']['url'] == 'https://example.com/a.png'
+        function = sent[1]['tool_calls'][0]['function']
+        assert function['name'] == 'send_mail'
+        assert json.loads(function['arguments']) == {'TO': 'JOHN@EXAMPLE.COM', 'BODY': 'MAIL JOHN@EXAMPLE.COM'}
+        assert sent[2]['content'] == 'SENT TO JOHN@EXAMPLE.COM'
+
+    def test_many_parts_still_take_one_call(self, client):
+        calls = []
+        parts = [{'type': 'text', 'text': f'part {i}'} for i in range(200)]
+        with patch('app.http.post', side_effect=self._post(calls)):
+            client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': [{'role': 'user', 'content': parts}]})
+        assert len(calls) == 2
+        assert len(calls[0][1]['texts']) == 200
+
+    def test_oversized_batches_are_split(self, client, monkeypatch):
+        monkeypatch.setattr(app_module, 'ANONYMIZER_BATCH_MAX_ITEMS', 2)
+        calls = []
+        messages = [{'role': 'user', 'content': f'turn {i}'} for i in range(5)]
+        with patch('app.http.post', side_effect=self._post(calls)):
+            client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': messages})
+        assert [len(c[1]['texts']) for c in calls[:-1]] == [2, 2, 1]
+        assert [m['content'] for m in calls[-1][1]['messages']] == [f'TURN {i}' for i in range(5)]
+
+    def test_large_batches_are_split_by_size(self, client, monkeypatch):
+        monkeypatch.setattr(app_module, 'ANONYMIZER_BATCH_MAX_CHARS', 25)
+        calls = []
+        messages = [{'role': 'user', 'content': f'{i}' * 10} for i in range(5)] + [{'role': 'user', 'content': 'x' * 40}]
+        with patch('app.http.post', side_effect=self._post(calls)):
+            client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': messages})
+        # Un texte plus long que la limite part seul
+        assert [c[1]['texts'] for c in calls[:-1]] == [['0' * 10, '1' * 10], ['2' * 10, '3' * 10], ['4' * 10], ['x' * 40]]
+
+
+class TestLeanAnonymizerResponses:
+    """Tests for the projected MessagePack anonymizer client."""
+
+    @patch('app.http.post')
+    def test_msgpack_batch_is_decoded(self, mock_post, client):
+        anonymizer = Mock(status_code=200, headers={'Content-Type': 'application/msgpack'}, content=msgpack.packb({
+            'patterns_version': 'v1',
+            'results': [{'anonymized': '{{EMAIL}}', 'anonymized_length': 9, 'pii_count': 1, 'secrets_count': 0}]
+        }))
+        litellm = Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+        mock_post.side_effect = [anonymizer, litellm]
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'john@example.com'}]
+        })
+        assert response.status_code == 200
+        assert mock_post.call_args_list[0].kwargs['headers']['Accept'].startswith('application/msgpack')
+        assert mock_post.call_args_list[0].kwargs['headers']['Content-Type'] == 'application/msgpack'
+        assert sent_batch(mock_post.call_args_list[0])['texts'] == ['john@example.com']
+        assert sent_json(mock_post.call_args_list[1])['messages'][0]['content'] == '{{EMAIL}}'
+
+    @patch('app.http.post')
+    def test_corrupt_msgpack_blocks(self, mock_post, client):
+        mock_post.return_value = Mock(status_code=200, headers={'Content-Type': 'application/msgpack'},
+                                      content=b'\xc1')
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'john@example.com'}]
+        })
+        assert response.status_code == 503
+        assert mock_post.call_count == 1
+
+
+class TestEmbeddedMode:
+    """Tests for ANONYMIZER_MODE=embedded (no HTTP hop to the anonymizer)."""
+
+    @pytest.fixture(autouse=True)
+    def embedded(self, monkeypatch):
+        monkeypatch.setattr(app_module, 'local_anonymizer', LocalAnonymizer(FakeEngine()))
+
+    @patch('app.http.post')
+    def test_anonymized_in_process(self, mock_post, client):
+        mock_post.return_value = Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'mail john@example.com'}]
+        })
+        assert response.status_code == 200
+        assert mock_post.call_count == 1  # LiteLLM seulement
+        assert sent_json(mock_post.call_args)['messages'][0]['content'] == 'mail {{EMAIL}}'
+        assert app_module.anonymization_cache.version == 'v1'
+
+    @patch('app.http.post')
+    def test_conversation_scope_reaches_the_engine(self, mock_post, client, conversation_header):
+        mock_post.return_value = Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+        client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'mail john@example.com'}]
+        }, headers={'X-Conversation-Id': 'c1'})
+        assert sent_json(mock_post.call_args)['messages'][0]['content'] == 'mail {{EMAIL_c1}}'
+
+    @patch('app.http.post')
+    def test_blocked_item_blocks_the_request(self, mock_post, client):
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'hi'}, {'role': 'user', 'content': 'BLOCK'}]
+        })
+        assert response.status_code == 503
+        mock_post.assert_not_called()
+
+    def test_health_uses_the_local_engine(self, client):
+        with patch('app.http.get') as mock_get:
+            response = client.get('/health')
+        mock_get.assert_not_called()
+        assert response.json['anonymizer'] == 'ok'
+        assert response.json['anonymizer_patterns_version'] == 'v1'
+
+
+class TestLogging:
+    """Tests for per-request log lines."""
+
+    @patch('app.http.post')
+    def test_no_payload_excerpt_by_default(self, mock_post, client):
+        anonymizer = Mock(status_code=200)
+        anonymizer.json.return_value = {'results': [
+            {'anonymized': 'mail {{EMAIL}}', 'anonymized_length': 14, 'pii_count': 0, 'secrets_count': 1}
+        ]}
+        mock_post.side_effect = [anonymizer, Mock(status_code=200, content=b'{}', headers={})]
+        with patch('app.logs.detail') as detail:
+            client.post('/v1/chat/completions', json={
+                'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'mail john@example.com'}]
+            })
+        lines = {call.args[1]: call.kwargs for call in detail.call_args_list}
+        assert lines['🔒 Textes anonymisés'] == {'texts': 1, 'pii': 0, 'secrets': 1}
+        assert all('{{EMAIL}}' not in str(fields) for fields in lines.values())
+
+    @patch('app.http.post')
+    def test_summary_counts(self, mock_post, client, monkeypatch):
+        summary = app_module.logs.Summary(3600, app_module.logger)
+        monkeypatch.setattr(app_module.logs, 'summary', summary)
+        mock_post.side_effect = requests.exceptions.ConnectionError('down')
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'hi'}]})
+        assert summary.counts == {'requests': 1, 'blocked': 1}
+
+    def test_direct_run_finds_the_shared_modules(self):
+        # python app.py hors de l'image: logs et tracing sont pris dans ../common sans PYTHONPATH
+        env = {key: value for key, value in os.environ.items() if key != 'PYTHONPATH'}
+        result = subprocess.run([sys.executable, '-c', 'import app; print(app.logs.__file__, app.tracing.__file__)'],
+                                cwd=os.path.dirname(__file__), env=env, capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        assert all(os.path.basename(os.path.dirname(path)) == 'common' for path in result.stdout.splitlines()[-1].split())
+
+
+class TestStreaming:
+    """Tests for stream: true passthrough."""
+
+    @staticmethod
+    def _anonymizer():
+        response = Mock(status_code=200)
+        response.json.return_value = {'results': [
+            {'anonymized': 'Hi {{NAME}}', 'anonymized_length': 11, 'pii_count': 1, 'secrets_count': 0}
+        ]}
+        return response
+
+    @staticmethod
+    def _upstream(chunks):
+        upstream = Mock(status_code=200, headers={'content-type': 'text/event-stream'})
+        upstream.iter_content.return_value = iter(chunks)
+        return upstream
+
+    @patch('app.http.post')
+    def test_stream_chunks_are_relayed(self, mock_post, client):
+        chunks = [b'data: {"choices":[{"delta":{"content":"He"}}]}\n\n', b'data: [DONE]\n\n']
+        upstream = self._upstream(chunks)
+        mock_post.side_effect = [self._anonymizer(), upstream]
+
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'stream': True, 'messages': [{'role': 'user', 'content': 'Hi John'}]
+        })
+
+        assert response.status_code == 200
+        assert response.content_type == 'text/event-stream'
+        assert response.headers['X-Accel-Buffering'] == 'no'
+        assert response.data == b''.join(chunks)
+        assert mock_post.call_args_list[1].kwargs['stream'] is True
+        assert sent_json(mock_post.call_args_list[1])['messages'][0]['content'] == 'Hi {{NAME}}'
+        upstream.close.assert_called_once()
+
+    @patch('app.http.post')
+    def test_client_disconnect_closes_upstream(self, mock_post, client):
+        upstream = self._upstream(iter([b'data: 1\n\n', b'data: 2\n\n', b'data: 3\n\n']))
+        mock_post.side_effect = [self._anonymizer(), upstream]
+
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'stream': True, 'messages': [{'role': 'user', 'content': 'Hi John'}]
+        }, buffered=False)
+        assert next(response.response) == b'data: 1\n\n'
+        response.close()  # le client abandonne la génération
+
+        upstream.close.assert_called_once()
+
+    @patch('app.http.post')
+    def test_stream_upstream_error_is_returned(self, mock_post, client):
+        upstream = Mock(status_code=429, content=b'{"error": "rate limited"}',
+                        headers={'content-type': 'application/json'})
+        mock_post.side_effect = [self._anonymizer(), upstream]
+
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'stream': True, 'messages': [{'role': 'user', 'content': 'Hi John'}]
+        })
+
+        assert response.status_code == 429
+        assert response.json['error'] == 'rate limited'
+        upstream.close.assert_called_once()
+
+
 class TestFailSafe:
     """Tests for fail-safe security behavior."""
     
-    @patch('app.requests.post')
+    @patch('app.http.post')
     def test_no_data_leakage_on_anonymizer_timeout(self, mock_post, client):
         """Verify that original data is NEVER sent if anonymization fails."""
         import requests
@@ -117,3 +731,285 @@ class TestFailSafe:
         
         # Verify LiteLLM was never called (only 1 call to anonymizer, not 2)
         assert mock_post.call_count == 1
+
+    @patch('app.http.post')
+    def test_lone_surrogate_is_blocked(self, mock_post, client):
+        # "\ud800" échappé en JSON se décode en surrogate isolé, que l'UTF-8 ne peut pas encoder
+        body = b'{"model": "gpt-4", "messages": [{"role": "user", "content": "hi \\ud800 john@example.com"}]}'
+        response = client.post('/v1/chat/completions', data=body, content_type='application/json')
+        assert response.status_code == 503
+        assert 'Cannot encode' in response.json['detail']
+        mock_post.assert_not_called()
+
+
+class TestCircuitBreaker:
+    """Tests for fail-fast blocking while the anonymizer is down."""
+
+    @staticmethod
+    def chat(client):
+        return client.post('/v1/chat/completions', json={
+            'model': 'gpt-3.5-turbo',
+            'messages': [{'role': 'user', 'content': 'My password is super_secret_123'}]
+        })
+
+    @patch('app.http.post')
+    def test_open_circuit_blocks_without_calling(self, mock_post, client):
+        mock_post.side_effect = requests.exceptions.ConnectionError('Connection refused')
+        for _ in range(app_module.anonymizer_breaker.failure_threshold):
+            assert self.chat(client).status_code == 503
+        calls = mock_post.call_count
+        blocked = REGISTRY.get_sample_value('gateway_blocked_requests_total', {'reason': 'anonymizer_unavailable'}) or 0
+
+        started = time.perf_counter()
+        response = self.chat(client)
+        assert time.perf_counter() - started < 0.1
+        assert response.status_code == 503
+        assert 'blocked' in response.json['error'].lower()
+        assert int(response.headers['Retry-After']) >= 1
+        assert mock_post.call_count == calls
+        assert REGISTRY.get_sample_value('gateway_anonymizer_circuit_state') == 2
+        assert REGISTRY.get_sample_value(
+            'gateway_blocked_requests_total', {'reason': 'anonymizer_unavailable'}) == blocked + 1
+
+    @patch('app.http.post')
+    def test_client_errors_do_not_trip(self, mock_post, client):
+        mock_post.return_value = Mock(status_code=400)
+        for _ in range(app_module.anonymizer_breaker.failure_threshold + 1):
+            assert self.chat(client).status_code == 503
+        assert app_module.anonymizer_breaker.state == 'closed'
+
+    @patch('app.http.post')
+    def test_recovers_through_half_open(self, mock_post, client, monkeypatch):
+        monkeypatch.setattr(app_module.anonymizer_breaker, 'reset_timeout', 0.05)
+        mock_post.side_effect = requests.exceptions.Timeout('Timeout')
+        for _ in range(app_module.anonymizer_breaker.failure_threshold):
+            self.chat(client)
+        assert app_module.anonymizer_breaker.state == 'open'
+
+        time.sleep(0.06)
+        anonymizer = Mock(status_code=200)
+        anonymizer.json.return_value = {'results': [
+            {'anonymized': 'My password is {{PASSWORD}}', 'anonymized_length': 27, 'pii_count': 0, 'secrets_count': 1}
+        ]}
+        litellm = Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+        mock_post.side_effect = [anonymizer, litellm]
+        assert self.chat(client).status_code == 200
+        assert app_module.anonymizer_breaker.state == 'closed'
+
+    @patch('app.http.get')
+    def test_health_is_served_from_the_cached_probe(self, mock_get, client, monkeypatch):
+        monkeypatch.setattr(app_module.anonymizer_prober, 'interval', 60)
+        monkeypatch.setattr(app_module.anonymizer_prober, 'ensure_started', lambda: None)
+        mock_get.return_value = Mock(status_code=200)
+        assert client.get('/health').json['status'] == 'healthy'
+
+        for _ in range(app_module.anonymizer_breaker.failure_threshold):
+            app_module.anonymizer_breaker.record_failure()
+        response = client.get('/health')
+        assert response.json['status'] == 'degraded'
+        assert response.json['anonymizer_circuit']['state'] == 'open'
+        assert mock_get.call_count == 1
+
+
+class TestAdmissionControl:
+    """Tests for gateway-side load shedding."""
+
+    @staticmethod
+    def chat(client, model='gpt-4', client_ip='10.0.0.1'):
+        return client.post('/v1/chat/completions', json={
+            'model': model, 'messages': [{'role': 'user', 'content': 'Hi'}]
+        }, headers={'X-Real-IP': client_ip})
+
+    def test_overload_is_shed_with_retry_after(self, client, monkeypatch):
+        controller = AdmissionController(max_in_flight=1, queue_size=0)
+        monkeypatch.setattr(app_module, 'admission', controller)
+        controller.admit('other', 'gpt-4')
+        before = REGISTRY.get_sample_value(
+            'gateway_admission_shed_total', {'reason': 'queue_full', 'model': 'gpt-4'}) or 0
+
+        with patch('app.http.post') as mock_post:
+            response = self.chat(client)
+        assert response.status_code == 429
+        assert response.json['reason'] == 'queue_full'
+        assert int(response.headers['Retry-After']) >= 1
+        mock_post.assert_not_called()
+        assert REGISTRY.get_sample_value(
+            'gateway_admission_shed_total', {'reason': 'queue_full', 'model': 'gpt-4'}) == before + 1
+
+    @patch('app.http.post')
+    def test_per_client_limit_uses_forwarded_ip(self, mock_post, client, monkeypatch):
+        controller = AdmissionController(max_per_client=1)
+        monkeypatch.setattr(app_module, 'admission', controller)
+        controller.admit('10.0.0.1', 'gpt-4')
+        mock_post.side_effect = requests.exceptions.ConnectionError('down')
+        assert self.chat(client, client_ip='10.0.0.1').status_code == 429
+        assert self.chat(client, client_ip='10.0.0.2').status_code == 503  # admis, bloqué ensuite
+
+    @patch('app.http.post')
+    def test_slot_is_released_when_the_response_closes(self, mock_post, client):
+        anonymizer = Mock(status_code=200)
+        anonymizer.json.return_value = {'results': [
+            {'anonymized': 'Hi', 'anonymized_length': 2, 'pii_count': 0, 'secrets_count': 0}
+        ]}
+        mock_post.side_effect = [anonymizer, Mock(status_code=200, content=b'{}', headers={})]
+        response = self.chat(client)
+        assert app_module.admission.describe()['in_flight'] == 1
+        response.close()
+        assert app_module.admission.describe()['in_flight'] == 0
+        assert REGISTRY.get_sample_value('gateway_admission_in_flight_weight') == 0
+
+    def test_health_reports_admission(self, client):
+        with patch('app.http.get', return_value=Mock(status_code=200)):
+            admission = client.get('/health').json['admission']
+        assert admission['in_flight'] == 0
+        assert admission['queued'] == 0
+        assert admission['max_in_flight'] == 200
+
+
+class TestMetrics:
+    """Tests for the Prometheus /metrics endpoint."""
+
+    @staticmethod
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    @staticmethod
+    def _anonymizer():
+        response = Mock(status_code=200)
+        response.json.return_value = {'results': [
+            {'anonymized': 'Hi {{NAME}}', 'anonymized_length': 11, 'pii_count': 1, 'secrets_count': 0}
+        ]}
+        return response
+
+    def test_metrics_endpoint(self, client):
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert b'gateway_requests_in_flight' in response.data
+
+    @patch('app.http.post')
+    def test_completion_records_latencies(self, mock_post, client):
+        upstream = Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+        mock_post.side_effect = [self._anonymizer(), upstream]
+        before = {
+            'anonymizer': self.sample('gateway_anonymizer_request_seconds_count', outcome='ok'),
+            'upstream': self.sample('gateway_upstream_request_seconds_count', model='gpt-4', stream='false',
+                                    status='200'),
+            'messages': self.sample('gateway_messages_per_request_count'),
+        }
+        client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'Hi John'}]})
+        assert self.sample('gateway_anonymizer_request_seconds_count', outcome='ok') == before['anonymizer'] + 1
+        assert self.sample(
+            'gateway_upstream_request_seconds_count', model='gpt-4', stream='false', status='200'
+        ) == before['upstream'] + 1
+        assert self.sample('gateway_messages_per_request_count') == before['messages'] + 1
+
+    @patch('app.http.post')
+    def test_blocked_request_is_counted(self, mock_post, client):
+        import requests
+        mock_post.side_effect = requests.exceptions.ConnectionError('down')
+        before = self.sample('gateway_blocked_requests_total', reason='anonymization_failed')
+        response = client.post('/v1/chat/completions', json={'messages': [{'role': 'user', 'content': 'secret'}]})
+        assert response.status_code == 503
+        assert self.sample('gateway_blocked_requests_total', reason='anonymization_failed') == before + 1
+
+    @patch('app.http.post')
+    def test_in_flight_covers_the_whole_stream(self, mock_post, client):
+        upstream = Mock(status_code=200, headers={'content-type': 'text/event-stream'})
+        upstream.iter_content.return_value = iter([b'data: 1\n\n', b'data: [DONE]\n\n'])
+        mock_post.side_effect = [self._anonymizer(), upstream]
+        before = self.sample('gateway_requests_in_flight')
+
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'stream': True, 'messages': [{'role': 'user', 'content': 'Hi John'}]
+        }, buffered=False)
+        next(response.response)
+        assert self.sample('gateway_requests_in_flight') == before + 1
+        response.close()
+        assert self.sample('gateway_requests_in_flight') == before
+
+    def test_model_labels_are_bounded(self, monkeypatch):
+        import metrics
+        monkeypatch.setattr(metrics, 'MAX_MODEL_LABELS', 1)
+        monkeypatch.setattr(metrics, '_models', set())
+        assert metrics.model_label('gpt-4') == 'gpt-4'
+        assert metrics.model_label('random-1') == 'other'
+        assert metrics.model_label('gpt-4') == 'gpt-4'
+        assert metrics.model_label(None) == 'unknown'
+
+
+class TestTracing:
+    """Tests for Server-Timing, trace propagation and span export."""
+
+    TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+
+    @staticmethod
+    def _anonymizer():
+        response = Mock(status_code=200, headers={'Server-Timing': 'tier.fast;dur=0.4, total;dur=1.0'})
+        response.json.return_value = {'results': [
+            {'anonymized': 'Hi {{NAME}}', 'anonymized_length': 11, 'pii_count': 1, 'secrets_count': 0}
+        ]}
+        return response
+
+    @patch('app.http.post')
+    def test_server_timing_lists_stages(self, mock_post, client):
+        upstream = Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+        mock_post.side_effect = [self._anonymizer(), upstream]
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'Hi John'}]
+        }, headers={'traceparent': f'00-{self.TRACE_ID}-00f067aa0ba902b7-01'})
+        stages = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        assert stages == ['parse', 'admission', 'cache', 'anonymize', 'total']
+        assert response.headers['X-Trace-Id'] == self.TRACE_ID
+
+    def test_other_endpoints_are_not_traced(self, client):
+        assert 'Server-Timing' not in client.get('/metrics').headers
+
+    @patch('app.http.post')
+    def test_spans_are_exported_with_anonymizer_timings(self, mock_post, client, tmp_path, monkeypatch):
+        path = tmp_path / 'spans.jsonl'
+        monkeypatch.setattr(tracing, 'exporter', tracing.create_exporter(str(path)))
+        upstream = Mock(status_code=200, content=b'{}', headers={'content-type': 'application/json'})
+        mock_post.side_effect = [self._anonymizer(), upstream]
+        response = client.post('/v1/chat/completions', json={
+            'model': 'gpt-4', 'messages': [{'role': 'user', 'content': 'Hi John'}]
+        }, headers={'traceparent': f'00-{self.TRACE_ID}-00f067aa0ba902b7-01'})
+        response.close()  # le serveur WSGI ferme la réponse: le span racine se termine
+        for _ in range(100):
+            if path.exists() and len(path.read_text().splitlines()) >= 4:
+                break
+            time.sleep(0.02)
+        spans = {span['name']: span for span in map(json.loads, path.read_text().splitlines())}
+        root = spans['chat_completions']
+        assert root['traceId'] == self.TRACE_ID and root['parentSpanId'] == '00f067aa0ba902b7'
+        assert spans['anonymize']['parentSpanId'] == root['spanId']
+        assert spans['anonymize']['attributes']['anonymizer.server_timing'] == 'tier.fast;dur=0.4, total;dur=1.0'
+
+    def test_adapter_propagates_traceparent_and_times_upstream(self):
+        received = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                received['traceparent'] = self.headers.get('traceparent')
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.handle_request, daemon=True).start()
+        session = requests.Session()
+        session.mount('http://', upstream.TracingHTTPAdapter(timed=True))
+        try:
+            with app.test_request_context():
+                trace = g.trace = tracing.Trace('test', service='gateway')
+                with trace.span('anonymize') as span:
+                    session.get(f'http://127.0.0.1:{server.server_port}/', timeout=5)
+        finally:
+            server.server_close()
+        assert received['traceparent'] == f'00-{trace.trace_id}-{span.span_id}-01'
+        names = [s.name for s in trace.spans]
+        assert 'upstream_connect' in names
+        assert 'upstream_ttfb' in names
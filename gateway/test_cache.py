@@ -0,0 +1,215 @@
+"""
+Unit Tests for the anonymization and completion caches
+"""
+import multiprocessing
+from unittest.mock import patch
+
+import pytest
+from cache import AnonymizationCache, CompletionCache, MemoryBackend, RedisBackend, SqliteBackend
+
+
+class FakeRedis:
+    """Stand-in local pour un client Redis (get/set avec expiration)."""
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        value = self.store.get(key)
+        return value.encode('utf-8') if value is not None else None
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+
+
+class BrokenRedis:
+    def get(self, key):
+        raise ConnectionError('redis down')
+
+    def set(self, key, value, ex=None):
+        raise ConnectionError('redis down')
+
+
+class TestMemoryBackend:
+    """Tests for the in-process LRU backend."""
+
+    def test_lru_eviction(self):
+        backend = MemoryBackend(max_entries=2, ttl=60)
+        backend.set('a', '1')
+        backend.set('b', '2')
+        assert backend.get('a') == '1'  # 'a' devient le plus récent
+        backend.set('c', '3')
+        assert backend.get('b') is None
+        assert backend.get('a') == '1'
+        assert backend.evictions == 1
+
+    def test_ttl_expiration(self):
+        backend = MemoryBackend(max_entries=10, ttl=10)
+        with patch('cache.time.monotonic', return_value=100.0):
+            backend.set('a', '1')
+        with patch('cache.time.monotonic', return_value=105.0):
+            assert backend.get('a') == '1'
+        with patch('cache.time.monotonic', return_value=111.0):
+            assert backend.get('a') is None
+
+    def test_byte_limit(self):
+        backend = MemoryBackend(max_entries=10, ttl=60, max_bytes=10)
+        backend.set('a', b'12345')
+        backend.set('b', b'12345')
+        backend.set('a', b'123')  # remplacement: l'ancienne taille est rendue
+        backend.set('c', b'1234')
+        assert backend.get('b') is None
+        assert backend.get('a') == b'123'
+        assert backend.get('c') == b'1234'
+
+
+def _write_entry(path):
+    SqliteBackend(path).set('from-child', b'value')
+
+
+class TestSqliteBackend:
+    """Tests for the disk-backed LRU backend."""
+
+    def test_round_trip_and_persistence(self, tmp_path):
+        path = str(tmp_path / 'cache' / 'completions.sqlite3')
+        SqliteBackend(path).set('a', b'\x00binary')
+        assert SqliteBackend(path).get('a') == b'\x00binary'
+
+    def test_shared_between_processes(self, tmp_path):
+        path = str(tmp_path / 'completions.sqlite3')
+        backend = SqliteBackend(path)
+        backend.size()  # connexion ouverte avant le fork: le fils doit en rouvrir une
+        child = multiprocessing.get_context('fork').Process(target=_write_entry, args=(path,))
+        child.start()
+        child.join(timeout=10)
+        assert backend.get('from-child') == b'value'
+
+    def test_lru_eviction_by_entries_and_bytes(self, tmp_path):
+        backend = SqliteBackend(str(tmp_path / 'c.sqlite3'), max_entries=2, ttl=60, max_bytes=8)
+        with patch('cache.time.time', side_effect=[1.0, 2.0, 3.0, 4.0, 5.0, 6.0]):
+            backend.set('a', b'1')
+            backend.set('b', b'2')
+            assert backend.get('a') == b'1'  # 'a' devient le plus récent
+            backend.set('c', b'3')
+            assert backend.get('b') is None
+            backend.set('d', b'12345678')  # 8 octets: seule entrée sous la limite
+        assert backend.size() == 1
+        assert backend.evictions == 3
+
+    def test_ttl_expiration(self, tmp_path):
+        backend = SqliteBackend(str(tmp_path / 'c.sqlite3'), ttl=10)
+        with patch('cache.time.time', return_value=100.0):
+            backend.set('a', b'1')
+        with patch('cache.time.time', return_value=105.0):
+            assert backend.get('a') == b'1'
+        with patch('cache.time.time', return_value=111.0):
+            assert backend.get('a') is None
+        assert backend.size() == 0
+
+
+class TestCompletionCache:
+    """Tests for completion keys, eligibility and storage."""
+
+    def test_key_is_canonical(self):
+        a = {'model': 'gpt-4', 'temperature': 0, 'messages': [{'role': 'user', 'content': '{{EMAIL}}'}]}
+        b = {'messages': [{'content': '{{EMAIL}}', 'role': 'user'}], 'temperature': 0, 'model': 'gpt-4'}
+        assert CompletionCache.key(a) == CompletionCache.key(b)
+        assert CompletionCache.key(a) != CompletionCache.key({**a, 'max_tokens': 10})
+
+    @pytest.mark.parametrize('payload, reason', [
+        ({'temperature': 0}, None),
+        ({'temperature': 0, 'stream': True}, 'stream'),
+        ({}, 'nondeterministic'),
+        ({'temperature': 0.7}, 'nondeterministic'),
+        ({'temperature': 0, 'n': 3}, 'nondeterministic'),
+    ])
+    def test_bypass_reason(self, payload, reason):
+        assert CompletionCache.bypass_reason(payload) == reason
+
+    def test_round_trip_keeps_content_type(self):
+        cache = CompletionCache(MemoryBackend())
+        cache.put('k', 'application/json', b'{"id": 1}')
+        assert cache.get('k') == ('application/json', b'{"id": 1}')
+        assert cache.get('other') is None
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_backend_errors_are_misses(self):
+        cache = CompletionCache(RedisBackend(BrokenRedis()))
+        cache.put('k', 'application/json', b'{}')
+        assert cache.get('k') is None
+        assert cache.stats()['errors'] == 2
+
+
+class TestAnonymizationCache:
+    """Tests for hashing, counters and version invalidation."""
+
+    def test_hits_and_misses(self):
+        cache = AnonymizationCache(MemoryBackend())
+        cache.put_many(['hello john'], ['hello {{NAME}}'], version='v1')
+        assert cache.get_many(['hello john', 'new turn']) == {0: 'hello {{NAME}}'}
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_keys_never_contain_raw_text(self):
+        backend = MemoryBackend()
+        cache = AnonymizationCache(backend)
+        cache.put_many(['john@example.com'], ['{{EMAIL}}'], version='v1')
+        assert all('john' not in key for key in backend._data)
+
+    def test_scopes_do_not_share_entries(self):
+        cache = AnonymizationCache(MemoryBackend())
+        cache.put_many(['john@example.com'], ['{{EMAIL_3f2a9c1b}}'], version='v1', scope='conv-1')
+        assert cache.get_many(['john@example.com'], 'conv-1') == {0: '{{EMAIL_3f2a9c1b}}'}
+        assert cache.get_many(['john@example.com'], 'conv-2') == {}
+        assert cache.get_many(['john@example.com']) == {}
+
+    def test_version_change_invalidates(self):
+        cache = AnonymizationCache(MemoryBackend())
+        cache.put_many(['hello'], ['hello'], version='v1')
+        cache.observe_version('v2')
+        assert cache.get_many(['hello']) == {}
+        assert cache.stats()['invalidations'] == 1
+
+    def test_read_with_new_version_misses_without_invalidating(self):
+        cache = AnonymizationCache(MemoryBackend())
+        cache.put_many(['hello'], ['hello'], version='v1')
+        assert cache.get_many(['hello'], version='v1') == {0: 'hello'}
+        assert cache.get_many(['hello'], version='v2') == {}
+        assert cache.get_many(['hello']) == {0: 'hello'}  # version inconnue: la version observée
+        assert cache.stats()['invalidations'] == 0
+        assert cache.stats()['patterns_version'] == 'v1'
+
+    def test_alternating_versions_invalidate_once(self):
+        cache = AnonymizationCache(MemoryBackend())
+        cache.put_many(['a'], ['a'], version='v1')
+        # Reload en cours: la sonde voit encore v1, les réponses alternent entre v1 et v2
+        cache.put_many(['b'], ['{{B}}'], version='v2')
+        for version in ('v1', 'v2', 'v1', 'v2'):
+            cache.get_many(['b'], version='v1')
+            cache.put_many(['c'], ['c'], version=version)
+        assert cache.stats()['invalidations'] == 1
+        assert cache.stats()['patterns_version'] == 'v2'
+        assert cache.get_many(['b', 'c'], version='v2') == {0: '{{B}}', 1: 'c'}
+
+    def test_late_response_is_cached_under_its_own_version(self):
+        cache = AnonymizationCache(MemoryBackend())
+        cache.observe_version('v1')
+        cache.observe_version('v2')
+        cache.put_many(['hello'], ['{{OLD}}'], version='v1')
+        assert cache.get_many(['hello'], version='v2') == {}
+        assert cache.get_many(['hello'], version='v1') == {0: '{{OLD}}'}
+
+    def test_shared_backend_is_shared_between_processes(self):
+        client = FakeRedis()
+        worker_a = AnonymizationCache(RedisBackend(client), secret=b'shared')
+        worker_b = AnonymizationCache(RedisBackend(client), secret=b'shared')
+        worker_a.put_many(['system prompt'], ['system prompt'], version='v1')
+        worker_b.observe_version('v1')
+        assert worker_b.get_many(['system prompt']) == {0: 'system prompt'}
+
+    def test_backend_errors_are_misses(self):
+        cache = AnonymizationCache(RedisBackend(BrokenRedis()))
+        cache.put_many(['hello'], ['hello'], version='v1')
+        assert cache.get_many(['hello']) == {}
+        assert cache.stats()['errors'] == 2
@@ -0,0 +1,102 @@
+"""
+Unit Tests for the circuit breaker and the health prober
+"""
+import time
+
+import pytest
+from circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, HealthProber
+
+
+def tripped(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+    return breaker
+
+
+class TestCircuitBreaker:
+    """Tests for state transitions."""
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()  # un succès remet le compteur à zéro
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        breaker.record_failure()
+        assert breaker.state == OPEN
+
+    def test_open_fails_fast_with_retry_after(self):
+        breaker = tripped(CircuitBreaker('test', failure_threshold=2, reset_timeout=60))
+        with pytest.raises(CircuitOpenError) as excinfo:
+            breaker.before_call()
+        assert 59 < excinfo.value.retry_after <= 60
+
+    def test_half_open_allows_limited_trials(self):
+        breaker = tripped(CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05, half_open_max_calls=1))
+        time.sleep(0.06)
+        breaker.before_call()
+        assert breaker.state == HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_trial_success_closes(self):
+        breaker = tripped(CircuitBreaker('test', failure_threshold=1, reset_timeout=0.01))
+        time.sleep(0.02)
+        breaker.before_call()
+        breaker.record_success()
+        assert breaker.state == CLOSED
+        breaker.before_call()
+
+    def test_trial_failure_reopens(self):
+        breaker = tripped(CircuitBreaker('test', failure_threshold=1, reset_timeout=0.01))
+        time.sleep(0.02)
+        breaker.before_call()
+        breaker.record_failure()
+        assert breaker.state == OPEN
+
+    def test_stale_trial_is_replaced(self):
+        breaker = tripped(CircuitBreaker('test', failure_threshold=1, reset_timeout=0.02))
+        time.sleep(0.03)
+        breaker.before_call()  # essai sans verdict
+        time.sleep(0.03)
+        breaker.before_call()
+        assert breaker.state == HALF_OPEN
+
+    def test_transitions_are_reported(self):
+        states = []
+        breaker = tripped(CircuitBreaker('test', failure_threshold=1, reset_timeout=60, on_change=states.append))
+        breaker.probe_succeeded()
+        breaker.before_call()
+        breaker.record_success()
+        assert states == [OPEN, HALF_OPEN, CLOSED]
+
+
+class TestHealthProber:
+    """Tests for the cached health status."""
+
+    def test_failed_probe_counts_as_failure(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+        prober = HealthProber(lambda: 1 / 0, interval=0, breaker=breaker)
+        assert prober.status()['ok'] is False
+        prober.check()
+        assert breaker.state == OPEN
+
+    def test_successful_probe_half_opens(self):
+        breaker = tripped(CircuitBreaker('test', failure_threshold=1, reset_timeout=60))
+        results = []
+        prober = HealthProber(lambda: {'patterns_version': 'v1'}, interval=0, breaker=breaker,
+                              on_result=results.append)
+        assert prober.status()['ok'] is True
+        assert breaker.state == HALF_OPEN
+        assert results == [{'patterns_version': 'v1'}]
+
+    def test_background_status_is_cached(self):
+        calls = []
+        prober = HealthProber(lambda: calls.append(1) or {}, interval=60)
+        prober.status()
+        prober.status()
+        prober.status()
+        assert len(calls) <= 2  # sonde du thread + éventuelle sonde synchrone initiale
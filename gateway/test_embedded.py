@@ -0,0 +1,218 @@
+"""
+Unit Tests for the in-process (embedded / pool) anonymization modes
+"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+from unittest.mock import patch
+
+import pytest
+from embedded import LocalAnonymizer, load_engine
+
+ANONYMIZER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'anonymizer')
+
+
+class Blocked(Exception):
+    """Stand-in local pour tiers.DetectionBlocked."""
+
+    def __init__(self):
+        super().__init__('Detection blocked: nlp tier too_long')
+        self.tier = 'nlp'
+        self.reason = 'too_long'
+
+
+class FakeEngine:
+    """Stand-in local pour engine.ScrubEngine (remplace les emails)."""
+
+    def __init__(self):
+        self.version = 'v1'
+        self.changed = False
+
+    def anonymize(self, text, scope=None):
+        if 'BLOCK' in text:
+            raise Blocked()
+        if 'CRASH' in text:
+            raise RuntimeError('scrubber crashed')
+        if 'SLOW' in text:
+            deadline = time.perf_counter() + 0.3
+            while time.perf_counter() < deadline:
+                pass
+        anonymized = text.replace('john@example.com', f'{{{{EMAIL_{scope}}}}}' if scope else '{{EMAIL}}')
+        return {'anonymized': anonymized, 'anonymized_length': len(anonymized), 'pii_count': 0,
+                'secrets_count': int(anonymized != text), 'pid': os.getpid(), 'version': self.version}
+
+    @property
+    def snapshot(self):
+        return self.version, {}
+
+    def sync(self, version, patterns):
+        self.version = version
+
+    def check_file(self):
+        if self.changed:
+            self.version, self.changed = 'v2', False
+            return True
+        return False
+
+    def describe(self):
+        return {'patterns_version': self.version}
+
+
+class TestLocalAnonymizer:
+    """Tests for batch results, errors and reloads."""
+
+    def test_embedded_batch(self):
+        local = LocalAnonymizer(FakeEngine())
+        payload = local.anonymize_batch(['mail john@example.com', 'hello'])
+        assert [r['anonymized'] for r in payload['results']] == ['mail {{EMAIL}}', 'hello']
+        assert payload['patterns_version'] == 'v1'
+        assert local.mode == 'embedded'
+
+    def test_errors_are_reported_per_item(self):
+        payload = LocalAnonymizer(FakeEngine()).anonymize_batch(['ok', 'BLOCK', 'CRASH'])
+        assert 'error' not in payload['results'][0]
+        assert payload['results'][1]['blocked'] is True
+        assert payload['results'][1]['reason'] == 'too_long'
+        assert payload['results'][2] == {'error': 'scrubber crashed'}
+
+    def test_results_are_projected(self):
+        payload = LocalAnonymizer(FakeEngine()).anonymize_batch(['john@example.com', 'BLOCK'], ['anonymized'])
+        assert payload['results'][0] == {'anonymized': '{{EMAIL}}'}
+        assert payload['results'][1]['blocked'] is True
+
+    def test_pool_runs_in_child_processes(self):
+        local = LocalAnonymizer(FakeEngine(), processes=2)
+        try:
+            payload = local.anonymize_batch(['john@example.com'] * 4)
+            assert {r['anonymized'] for r in payload['results']} == {'{{EMAIL}}'}
+            assert os.getpid() not in {r['pid'] for r in payload['results']}
+        finally:
+            local._pool.shutdown()
+
+    def test_pool_follows_reload_without_refork(self):
+        engine = FakeEngine()
+        local = LocalAnonymizer(engine, processes=1)
+        try:
+            pids = {r['pid'] for r in local.anonymize_batch(['a'])['results']}
+            pool = local._pool
+            engine.changed = True
+            assert local.health()['patterns_version'] == 'v2'
+            assert local._pool is pool
+            payload = local.anonymize_batch(['a', 'b'])
+            assert payload['patterns_version'] == 'v2'
+            assert {r['version'] for r in payload['results']} == {'v2'}
+            assert {r['pid'] for r in payload['results']} == pids
+        finally:
+            local._pool.shutdown()
+
+    def test_pool_is_started_with_the_worker(self, monkeypatch):
+        monkeypatch.setenv('ANONYMIZER_PROCESSES', '1')
+        monkeypatch.setattr('embedded.load_engine', lambda patterns_file, lib_path=None: FakeEngine())
+        local = LocalAnonymizer.from_env('pool')
+        try:
+            assert local._pool is not None
+        finally:
+            local._pool.shutdown()
+
+    def test_pool_under_gevent_keeps_the_loop_responsive(self):
+        pytest.importorskip('gevent')
+        # Processus séparé: monkey.patch_all() doit précéder tout import (comme le worker gevent)
+        script = textwrap.dedent("""
+            from gevent import monkey
+            monkey.patch_all()
+            import json, time
+            import gevent
+            from embedded import LocalAnonymizer
+            from test_embedded import FakeEngine
+
+            local = LocalAnonymizer(FakeEngine(), processes=2)
+            gaps = []
+
+            def tick():
+                last = time.perf_counter()
+                while True:
+                    gevent.sleep(0.01)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+
+            ticker = gevent.spawn(tick)
+            jobs = [gevent.spawn(local.anonymize_batch, ['SLOW john@example.com'] * 2, ['anonymized'])
+                    for _ in range(4)]
+            gevent.joinall(jobs, timeout=30)
+            ticker.kill()
+            local._pool.shutdown()
+            print(json.dumps({'results': [j.value['results'] if j.successful() else None for j in jobs],
+                              'max_gap': max(gaps)}))
+        """)
+        here = os.path.dirname(os.path.abspath(__file__))
+        run = subprocess.run([sys.executable, '-c', script], cwd=here, capture_output=True, text=True, timeout=60)
+        assert run.returncode == 0, run.stderr
+        report = json.loads(run.stdout.splitlines()[-1])
+        assert report['results'] == [[{'anonymized': 'SLOW {{EMAIL}}'}] * 2] * 4
+        # 8 scans de 0.3s: exécutés dans le worker, ils gèleraient la boucle bien plus longtemps
+        assert report['max_gap'] < 0.25
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            LocalAnonymizer.from_env('sidecar')
+        assert LocalAnonymizer.from_env('remote') is None
+
+    @pytest.mark.parametrize('worker_class', ['gevent', 'gthread'])
+    def test_embedded_mode_requires_sync_workers(self, worker_class):
+        with pytest.raises(ValueError, match='pool'):
+            LocalAnonymizer.from_env('embedded', worker_class)
+
+    def test_default_worker_class_is_gevent(self, monkeypatch):
+        monkeypatch.delenv('GATEWAY_WORKER_CLASS', raising=False)
+        with pytest.raises(ValueError):
+            LocalAnonymizer.from_env('embedded')
+
+
+class TestSharedLibrary:
+    """Tests against the anonymizer's own library (skipped without its dependencies)."""
+
+    def test_same_results_as_the_anonymizer(self):
+        pytest.importorskip('scrubadub')
+        engine = load_engine(os.path.join(ANONYMIZER_DIR, 'patterns.json'), ANONYMIZER_DIR)
+        from tiers import NlpPolicy
+        engine.policy = NlpPolicy.from_profile('fast')
+        result = LocalAnonymizer(engine).anonymize_batch(['key sk-abcdefghijklmnopqrstuvwxyz123456'])['results'][0]
+        assert 'sk-abcdefghijklmnopqrstuvwxyz123456' not in result['anonymized']
+        assert result['secrets_count'] == 1
+
+    def test_reload_does_not_fork_a_probe(self, tmp_path):
+        pytest.importorskip('scrubadub')
+        path = tmp_path / 'patterns.json'
+        path.write_text('{"tok": "tok_[a-z]+"}')
+        engine = load_engine(str(path), ANONYMIZER_DIR)
+        import redos
+        path.write_text('{"tok": "tok_[a-z]+", "ref": "REF-[0-9]{6}"}')
+        os.utime(path, ns=(0, 0))
+        with patch.object(redos, 'check_patterns') as check:
+            assert engine.check_file() is True
+        check.assert_not_called()
+        assert engine.guard.describe()['probe'] is False
+
+    def test_pool_processes_sync_to_the_snapshot(self, tmp_path):
+        pytest.importorskip('scrubadub')
+        path = tmp_path / 'patterns.json'
+        path.write_text('{"tok": "tok_[a-z]+"}')
+        engine = load_engine(str(path), ANONYMIZER_DIR)
+        from tiers import NlpPolicy
+        engine.policy = NlpPolicy.from_profile('fast')
+        local = LocalAnonymizer(engine, processes=1)
+        try:
+            assert local.anonymize_batch(['REF-123456'])['results'][0]['anonymized'] == 'REF-123456'
+            path.write_text('{"tok": "tok_[a-z]+", "ref": "REF-[0-9]{6}"}')
+            os.utime(path, ns=(0, 0))
+            local.health()
+            payload = local.anonymize_batch(['REF-123456'])
+            assert payload['results'][0]['anonymized'] == '{{REF}}'
+            assert payload['patterns_version'] == engine.version
+        finally:
+            local._pool.shutdown()
@@ -0,0 +1,116 @@
+"""
+Unit Tests for queued, sampled and summarized logging
+"""
+import io
+import json
+import logging
+import threading
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+
+import logs
+
+
+def make_logger(formatter=None, size=100):
+    stream = io.StringIO()
+    target = logging.StreamHandler(stream)
+    target.setFormatter(formatter or logs.JsonFormatter())
+    handler = logs.QueuedHandler(target, size=size)
+    logger = logging.getLogger(f"test-logs-{id(stream)}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger, handler, stream
+
+
+class TestQueuedHandler:
+    """Tests for the background log writer."""
+
+    def test_json_records_with_fields(self, monkeypatch):
+        monkeypatch.setattr(logs, 'SERVICE_NAME', 'gateway')
+        logger, handler, stream = make_logger()
+        logger.info("hello %s", "world", extra={"fields": {"texts": 3}})
+        handler.flush()
+        record = json.loads(stream.getvalue())
+        assert record["message"] == "hello world"
+        assert record["texts"] == 3
+        assert record["level"] == "INFO"
+        assert record["service"] == "gateway"
+
+    def test_written_by_another_thread(self):
+        logger, handler, stream = make_logger()
+        writers = []
+        with patch.object(handler.target, 'handle', side_effect=lambda r: writers.append(threading.get_ident())):
+            logger.info("x")
+            handler.flush()
+        assert writers and writers[0] != threading.get_ident()
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        logger, handler, stream = make_logger(size=1)
+        gate = threading.Event()
+        with patch.object(handler.target, 'handle', side_effect=lambda r: gate.wait(5)):
+            for _ in range(5):
+                logger.info("x")
+            assert handler.dropped >= 3
+            gate.set()
+            handler.flush()
+
+    def test_exceptions_are_serialized(self):
+        logger, handler, stream = make_logger()
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("failed")
+        handler.flush()
+        assert "ValueError: boom" in json.loads(stream.getvalue())["exception"]
+
+    def test_text_format(self):
+        logger, handler, stream = make_logger(logs.TextFormatter('%(message)s'))
+        logger.info("📥 Réponse LiteLLM", extra={"fields": {"status": 200}})
+        handler.flush()
+        assert stream.getvalue() == "📥 Réponse LiteLLM status=200\n"
+
+
+class TestSamplingAndSummary:
+    """Tests for per-request sampling, excerpts and summary mode."""
+
+    def test_sampling_is_drawn_once_per_request(self, monkeypatch):
+        monkeypatch.setattr(logs, 'LOG_SAMPLE_RATE', 0.5)
+        app = Flask(__name__)
+        draws = iter([0.9, 0.1])
+        with patch('logs.random.random', side_effect=lambda: next(draws)):
+            with app.test_request_context():
+                assert [logs.sampled(), logs.sampled()] == [False, False]
+            with app.test_request_context():
+                assert logs.sampled() is True
+
+    @pytest.mark.parametrize('mode, rate, expected', [('request', 1, True), ('request', 0, False), ('summary', 1, False)])
+    def test_detail_lines(self, monkeypatch, mode, rate, expected):
+        monkeypatch.setattr(logs, 'LOG_MODE', mode)
+        monkeypatch.setattr(logs, 'LOG_SAMPLE_RATE', rate)
+        logger, handler, stream = make_logger()
+        logs.detail(logger, "🚀 Nouvelle requête", model="gpt-4")
+        handler.flush()
+        assert bool(stream.getvalue()) is expected
+
+    def test_excerpts_are_off_by_default(self, monkeypatch):
+        assert logs.excerpt("mail {{EMAIL}}") is None
+        monkeypatch.setattr(logs, 'LOG_PAYLOAD_EXCERPT_CHARS', 4)
+        assert logs.excerpt("mail {{EMAIL}}") == "mail"
+
+    def test_summary_is_rate_limited(self):
+        logger, handler, stream = make_logger()
+        with patch('logs.time.monotonic', return_value=100.0):
+            summary = logs.Summary(60, logger)
+            summary.add(requests=1, pii=2)
+            summary.add(requests=1, pii=1)
+        with patch('logs.time.monotonic', return_value=161.0):
+            summary.add(requests=1, blocked=1)
+            summary.add(requests=1)
+        handler.flush()
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert len(lines) == 1
+        assert lines[0]["requests"] == 3 and lines[0]["pii"] == 3 and lines[0]["blocked"] == 1
+        assert summary.counts == {"requests": 1}
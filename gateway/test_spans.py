@@ -0,0 +1,166 @@
+"""
+Unit Tests for request body ingestion and span-based rewriting
+"""
+import io
+import json
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from spans import Document, read_body
+from walker import collect
+
+
+def parse(text):
+    return Document.parse(bytearray(text.encode('utf-8')))
+
+
+def rewrite(document, changed):
+    return b''.join(document.body(changed)).decode('utf-8')
+
+
+class TestParse:
+    """Tests for the span-recording JSON parser."""
+
+    @pytest.mark.parametrize('text', [
+        '{"a": "x", "b": [1, -2, 2.5, -3e2, 4E+1, true, false, null], "c": {}, "d": []}',
+        '{"escaped": "tab\\t quote\\" slash\\/ \\u00e9 \\ud83d\\ude00", "raw": "café 日本"}',
+        ' [ {"nested": [[{"deep": "yes"}]]} ] ',
+        '"only a string"',
+        '0',
+        '{"":""}',
+    ])
+    def test_same_tree_as_json(self, text):
+        assert parse(text).data == json.loads(text)
+
+    def test_nan_and_infinity_like_json(self):
+        data = parse('[NaN, Infinity, -Infinity]').data
+        assert math.isnan(data[0]) and data[1:] == [math.inf, -math.inf]
+
+    @pytest.mark.parametrize('text', [
+        '', '{', '{"a":}', '{"a" 1}', '{"a": "x"', '[1,]', '[1 2]', '{"a": 1} extra', '{a: 1}',
+        '{"a": "\x01"}', '{"a": "\\x"}', "{'a': 1}", '[01]',
+    ])
+    def test_invalid_json_is_rejected(self, text):
+        with pytest.raises(ValueError):
+            parse(text)
+
+    def test_invalid_utf8_is_rejected(self):
+        with pytest.raises(ValueError):
+            Document.parse(bytearray(b'{"a": "\xff"}'))
+
+    def test_deep_nesting_is_rejected(self):
+        with pytest.raises(ValueError):
+            parse('[' * 100000 + ']' * 100000)
+
+    def test_string_spans(self):
+        raw = '{"messages": [{"role": "user", "content": "hi \\"john\\""}]}'
+        document = parse(raw)
+        message = document.data['messages'][0]
+        start, end = document.spans[(id(message), 'content')]
+        assert raw[start:end] == '"hi \\"john\\""'
+
+    def test_spans_with_escaped_quotes_and_backslashes(self):
+        raw = r'{"k\"ey": "v\\", "x": ["\\\"", "\\", "é \u0022"], "n": 1}'
+        document = parse(raw)
+        located = {key: bytes(document.raw[start:end]).decode('utf-8') for (_, key), (start, end) in document.spans.items()}
+        assert located == {'k"ey': r'"v\\"', 0: r'"\\\""', 1: r'"\\"', 2: r'"é \u0022"'}
+
+    def test_spans_are_located_in_rewritten_tree(self):
+        raw = '\ufeff{"messages": [{"role": "user", "content": "hi john"}, {"role": "user", "content": ["x"]}]}'
+        document = Document.parse(bytearray(raw.encode('utf-8')))
+        message = document.data['messages'][0]
+        message['content'] = 'hi {{NAME}}'
+        assert rewrite(document, [(message, 'content')]) == raw.replace('john', '{{NAME}}')
+
+    def test_spans_mismatch_falls_back_to_reencoding(self):
+        document = parse('{"messages": [{"role": "user", "content": "hi john"}]}')
+        message = document.data['messages'][0]
+        message['extra'] = 'added'
+        assert document.spans is None
+        message['content'] = 'hi {{NAME}}'
+        assert json.loads(rewrite(document, [(message, 'content')])) == document.data
+
+
+class TestBody:
+    """Tests for the forwarded request body."""
+
+    def test_unchanged_request_is_forwarded_as_received(self):
+        raw = '{ "model" : "gpt-4",\n  "messages": [{"role": "user", "content": "héllo"}], "temperature": 0.70 }'
+        assert rewrite(parse(raw), []) == raw
+
+    def test_only_changed_strings_are_reencoded(self):
+        raw = '{"model":"gpt-4",  "messages": [{"role":"user","content":"mail john@example.com"},\n' \
+              '{"role":"assistant","content":"ok"}], "top_p": 1.0}'
+        document = parse(raw)
+        leaves = collect(document.data['messages'])
+        changed = leaves.write({'mail john@example.com': 'mail {{EMAIL}}', 'user': 'user',
+                                'ok': 'ok', 'assistant': 'assistant'})
+        assert rewrite(document, changed) == raw.replace('john@example.com', '{{EMAIL}}')
+
+    def test_rewritten_tool_arguments(self):
+        arguments = json.dumps({'to': 'john@example.com', 'priority': 2})
+        raw = json.dumps({'messages': [{'role': 'assistant', 'content': None, 'tool_calls': [
+            {'id': 'call_1', 'type': 'function', 'function': {'name': 'send', 'arguments': arguments}}
+        ]}]})
+        document = parse(raw)
+        changed = collect(document.data['messages']).write({'to': 'to', 'john@example.com': '{{EMAIL}}', 'priority': 'priority'})
+        sent = json.loads(rewrite(document, changed))
+        function = sent['messages'][0]['tool_calls'][0]['function']
+        assert json.loads(function['arguments']) == {'to': '{{EMAIL}}', 'priority': 2}
+        assert sent['messages'][0]['tool_calls'][0]['id'] == 'call_1'
+
+    def test_duplicate_keys_are_reencoded_from_the_tree(self):
+        # Les octets d'origine porteraient la première valeur, jamais anonymisée
+        document = parse('{"messages": [{"role": "user", "content": "john@example.com", "content": "hi"}]}')
+        assert 'john@example.com' not in rewrite(document, [])
+        assert json.loads(rewrite(document, [])) == document.data
+
+    def test_lone_surrogate_is_escaped(self):
+        document = parse('{"content": "x"}')
+        document.data['content'] = 'bad \ud800'
+        assert json.loads(rewrite(document, [(document.data, 'content')])) == {'content': 'bad \ud800'}
+
+    def test_body_length_and_real_upload(self):
+        document = parse('{"messages": [{"role": "user", "content": "héllo john"}]}')
+        message = document.data['messages'][0]
+        message['content'] = 'héllo {{NAME}}'
+        body = document.body([(message, 'content')])
+        received = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received['transfer_encoding'] = self.headers.get('Transfer-Encoding')
+                received['body'] = self.rfile.read(int(self.headers['Content-Length']))
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.handle_request, daemon=True).start()
+        try:
+            requests.post(f'http://127.0.0.1:{server.server_port}/', data=body, timeout=5)
+        finally:
+            server.server_close()
+        assert received['transfer_encoding'] is None
+        assert len(received['body']) == len(body)
+        assert json.loads(received['body'])['messages'][0]['content'] == 'héllo {{NAME}}'
+
+
+class TestReadBody:
+    """Tests for bounded body reads."""
+
+    def test_known_length(self):
+        assert read_body(io.BytesIO(b'x' * 200000), 200000, chunk_size=4096) == b'x' * 200000
+
+    def test_short_body(self):
+        assert read_body(io.BytesIO(b'abc'), 10) == b'abc'
+
+    def test_unknown_length(self):
+        assert read_body(io.BytesIO(b'y' * 10000), None, chunk_size=1000) == b'y' * 10000
@@ -0,0 +1,96 @@
+"""
+Unit Tests for the structured content walker
+"""
+import json
+
+from walker import collect
+
+
+def upper(leaves):
+    leaves.write({text: text.upper() for text in leaves.texts})
+
+
+class TestCollect:
+    """Tests for leaf collection and in-place write-back."""
+
+    def test_text_parts_and_names(self):
+        messages = [{'role': 'user', 'name': 'john', 'content': [
+            {'type': 'text', 'text': 'hello'},
+            {'type': 'image_url', 'image_url': {'url': 'https://example.com/john.png'}},
+        ]}]
+        upper(collect(messages))
+        assert messages[0]['name'] == 'JOHN'
+        assert messages[0]['content'][0]['text'] == 'HELLO'
+        assert messages[0]['content'][1]['image_url']['url'] == 'https://example.com/john.png'
+
+    def test_tool_call_arguments_stay_valid_json(self):
+        arguments = {'to': 'john@example.com', 'cc': ['jane@example.com'], 'priority': 2, 'urgent': True}
+        messages = [{'role': 'assistant', 'content': None, 'tool_calls': [
+            {'id': 'call_1', 'type': 'function', 'function': {'name': 'send_mail', 'arguments': json.dumps(arguments)}}
+        ]}]
+        leaves = collect(messages)
+        assert leaves.texts == ['to', 'john@example.com', 'cc', 'jane@example.com', 'priority', 'urgent']
+        upper(leaves)
+        function = messages[0]['tool_calls'][0]['function']
+        assert json.loads(function['arguments']) == {
+            'TO': 'JOHN@EXAMPLE.COM', 'CC': ['JANE@EXAMPLE.COM'], 'PRIORITY': 2, 'URGENT': True
+        }
+        assert function['name'] == 'send_mail'
+
+    def test_invalid_arguments_are_treated_as_text(self):
+        messages = [{'role': 'assistant', 'function_call': {'name': 'f', 'arguments': '{"to": john'}}]
+        upper(collect(messages))
+        assert messages[0]['function_call']['arguments'] == '{"TO": JOHN'
+
+    def test_tool_results(self):
+        messages = [{'role': 'tool', 'tool_call_id': 'call_1', 'content': 'sent to john@example.com'}]
+        upper(collect(messages))
+        assert messages[0]['content'] == 'SENT TO JOHN@EXAMPLE.COM'
+        assert messages[0]['tool_call_id'] == 'call_1'
+
+    def test_texts_are_deduplicated(self):
+        messages = [{'role': 'user', 'content': 'same'}, {'role': 'user', 'content': [{'type': 'text', 'text': 'same'}]}]
+        leaves = collect(messages)
+        assert leaves.texts == ['same']
+        assert len(leaves.slots) == 2
+
+    def test_nothing_to_anonymize(self):
+        messages = [{'role': 'user', 'content': ''}, {'role': 'assistant', 'content': None}, 'junk']
+        assert collect(messages).texts == []
+
+    def test_write_returns_changed_locations(self):
+        arguments = '{"to":  "john@example.com"}'
+        messages = [
+            {'role': 'user', 'content': 'hello john@example.com'},
+            {'role': 'assistant', 'content': 'ok', 'tool_calls': [
+                {'id': 'call_1', 'type': 'function', 'function': {'name': 'send', 'arguments': arguments}}
+            ]},
+        ]
+        changed = collect(messages).write({
+            'hello john@example.com': 'hello {{EMAIL}}', 'ok': 'ok', 'to': 'to', 'john@example.com': '{{EMAIL}}'
+        })
+        function = messages[1]['tool_calls'][0]['function']
+        assert changed == [(messages[0], 'content'), (function, 'arguments')]
+
+    def test_unchanged_arguments_keep_their_encoding(self):
+        arguments = '{"city":  "Paris"}'
+        messages = [{'role': 'assistant', 'tool_calls': [{'function': {'name': 'weather', 'arguments': arguments}}]}]
+        assert collect(messages).write({'city': 'city', 'Paris': 'Paris'}) == []
+        assert messages[0]['tool_calls'][0]['function']['arguments'] == arguments
+
+    def test_pii_in_argument_keys_is_anonymized(self):
+        arguments = {'contacts': {'jean.dupont@corp.fr': {'role': 'owner'}, 'marie@corp.fr': 'viewer'}, 'n': 2}
+        messages = [{'role': 'assistant', 'tool_calls': [
+            {'function': {'name': 'share', 'arguments': json.dumps(arguments)}}
+        ]}]
+        leaves = collect(messages)
+        assert 'jean.dupont@corp.fr' in leaves.texts and 'marie@corp.fr' in leaves.texts
+        emails = {'jean.dupont@corp.fr': '{{EMAIL}}', 'marie@corp.fr': '{{EMAIL}}', 'viewer': 'viewer'}
+        changed = leaves.write({text: emails.get(text, text) for text in leaves.texts})
+        function = messages[0]['tool_calls'][0]['function']
+        assert changed == [(function, 'arguments')]
+        assert 'corp.fr' not in function['arguments']
+        # Même placeholder pour deux clés: la seconde est suffixée, aucune entrée n'est perdue
+        assert json.loads(function['arguments']) == {
+            'contacts': {'{{EMAIL}}': {'role': 'owner'}, '{{EMAIL}} (2)': 'viewer'}, 'n': 2
+        }
@@ -0,0 +1,85 @@
+"""
+Adaptateur HTTP des appels amont (anonymizer, LiteLLM)
+
+Transmet le traceparent de la requête en cours (tracing.py) et, pour LiteLLM, mesure les
+étapes côté client: upstream_connect (attente d'une connexion du pool + établissement TCP)
+et upstream_ttfb (jusqu'aux en-têtes de réponse).
+"""
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import tracing
+
+
+def _record_connect(started, phase):
+    trace = tracing.current()
+    if trace is not None:
+        trace.add_span("upstream_connect", started, time.perf_counter(), phase=phase)
+
+
+class _TimedConnectionMixin:
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            _record_connect(started, "connect")
+
+
+class _TimedPoolMixin:
+    def _get_conn(self, timeout=None):
+        # Attente d'une connexion libre du pool (pool_block=True)
+        started = time.perf_counter()
+        try:
+            return super()._get_conn(timeout=timeout)
+        finally:
+            _record_connect(started, "pool_wait")
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(_TimedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(_TimedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TracingHTTPAdapter(HTTPAdapter):
+    """
+    Transmet le traceparent de la requête en cours. Avec timed=True, mesure aussi l'obtention
+    de la connexion (upstream_connect: attente du pool + établissement TCP) et le temps
+    jusqu'aux en-têtes de réponse (upstream_ttfb).
+    """
+
+    def __init__(self, timed=False, **kwargs):
+        self.timed = timed
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if self.timed:
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool
+            }
+
+    def send(self, request, **kwargs):
+        trace = tracing.current()
+        if trace is None:
+            return super().send(request, **kwargs)
+        request.headers.setdefault("traceparent", trace.traceparent())
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        if self.timed:
+            trace.add_span("upstream_ttfb", started, time.perf_counter(), status=response.status_code)
+        return response
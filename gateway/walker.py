@@ -0,0 +1,169 @@
+"""
+Parcours des contenus structurés d'une requête chat/completions
+
+Les chaînes susceptibles de porter des données utilisateur ne sont pas toutes dans
+messages[].content sous forme de texte:
+- content en liste de parts: {"type": "text", "text": ...} (et "refusal" des réponses assistant)
+- messages "tool"/"function": résultats d'outils, en texte ou en parts
+- tool_calls[].function.arguments (et l'ancien function_call.arguments): JSON encodé en
+  chaîne; chaque valeur texte du JSON est anonymisée, et chaque clé: le modèle peut y mettre
+  des données utilisateur ({"jean.dupont@corp.fr": ...}), pas seulement le schéma de l'outil
+- name: nom du participant d'un message
+
+collect() relève toutes ces feuilles (dédupliquées) pour un seul appel à l'anonymizer;
+Leaves.write() réécrit les résultats en place dans les objets de la requête (aucune copie
+profonde) et retourne les emplacements modifiés: seules ces chaînes sont réencodées dans le
+corps transmis (spans.py). Les autres champs (image_url, noms de fonctions, ids...) sont
+transmis tels quels.
+"""
+import json
+
+# Types de parts dont le texte est analysé, et le champ qui le porte
+TEXT_PARTS = {"text": "text", "refusal": "refusal"}
+
+
+class Leaves:
+    """Feuilles texte relevées dans une requête: emplacements (conteneur, clé) et textes distincts."""
+
+    def __init__(self):
+        self.slots = []
+        # Clés d'objets des arguments JSON (slots (_Key, None)), renommées après écriture
+        self._keys = []
+        # Arguments JSON d'appels d'outils: (conteneur, clé, arbre décodé, slots de l'arbre début/fin)
+        # à réencoder après écriture
+        self._encoded = []
+
+    @property
+    def texts(self):
+        """Textes distincts, dans l'ordre de première apparition."""
+        return list(dict.fromkeys(container[key] for container, key in self.slots))
+
+    def add(self, container, key):
+        value = container.get(key) if isinstance(container, dict) else container[key]
+        if isinstance(value, str) and value:
+            self.slots.append((container, key))
+
+    def write(self, anonymized):
+        """
+        Remplace chaque feuille par sa version anonymisée ({texte original: texte anonymisé}).
+        Retourne les emplacements (conteneur, clé) des messages dont la valeur a changé: les
+        arguments d'outils réencodés, pas les feuilles de leur arbre décodé.
+        """
+        changed = set()
+        for index, (container, key) in enumerate(self.slots):
+            value = anonymized[container[key]]
+            if value != container[key]:
+                container[key] = value
+                changed.add(index)
+        _rename(self._keys)
+        nested = {index for *_, first, last in self._encoded for index in range(first, last)}
+        locations = [self.slots[index] for index in sorted(changed - nested)]
+        for container, key, tree, first, last in self._encoded:
+            if any(index in changed for index in range(first, last)):
+                container[key] = json.dumps(tree, ensure_ascii=False)
+                locations.append((container, key))
+        return locations
+
+
+class _Key:
+    """
+    Clé d'un objet JSON décodé vue comme une feuille (slot (_Key, None)): l'écriture retient
+    le nouveau nom, _rename reconstruit l'objet une fois les valeurs écrites.
+    """
+    __slots__ = ("node", "original", "name")
+
+    def __init__(self, node, name):
+        self.node = node
+        self.original = self.name = name
+
+    def __getitem__(self, _):
+        return self.name
+
+    def __setitem__(self, _, name):
+        self.name = name
+
+
+def _rename(keys):
+    """
+    Reconstruit chaque objet dont une clé a changé, dans l'ordre d'origine. Deux clés
+    anonymisées vers le même placeholder ({{EMAIL}}) ne s'écrasent pas: les suivantes sont
+    suffixées (" (2)", " (3)"...).
+    """
+    renamed = {}
+    for key in keys:
+        if key.name != key.original:
+            renamed.setdefault(id(key.node), (key.node, {}))[1][key.original] = key.name
+    for node, names in renamed.values():
+        items = list(node.items())
+        node.clear()
+        for key, value in items:
+            name = unique = names.get(key, key)
+            suffix = 2
+            while unique in node:
+                unique = f"{name} ({suffix})"
+                suffix += 1
+            node[unique] = value
+
+
+def _walk_json(node, leaves):
+    """Clés et valeurs texte d'un arbre JSON décodé."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key:
+                leaves._keys.append(_Key(node, key))
+                leaves.slots.append((leaves._keys[-1], None))
+            if isinstance(value, str):
+                leaves.add(node, key)
+            else:
+                _walk_json(value, leaves)
+    elif isinstance(node, list):
+        for i, value in enumerate(node):
+            if isinstance(value, str):
+                leaves.add(node, i)
+            else:
+                _walk_json(value, leaves)
+
+
+def _add_arguments(function, leaves):
+    """function.arguments: JSON décodé et parcouru, ou chaîne entière s'il n'est pas valide."""
+    if not isinstance(function, dict) or not isinstance(function.get("arguments"), str):
+        return
+    try:
+        tree = json.loads(function["arguments"])
+    except (ValueError, RecursionError):
+        leaves.add(function, "arguments")
+        return
+    if isinstance(tree, str):
+        leaves.add(function, "arguments")
+        return
+    count = len(leaves.slots)
+    _walk_json(tree, leaves)
+    if len(leaves.slots) > count:
+        leaves._encoded.append((function, "arguments", tree, count, len(leaves.slots)))
+
+
+def _add_content(message, leaves):
+    content = message.get("content")
+    if isinstance(content, str):
+        leaves.add(message, "content")
+    elif isinstance(content, list):
+        for i, part in enumerate(content):
+            if isinstance(part, dict) and part.get("type") in TEXT_PARTS:
+                leaves.add(part, TEXT_PARTS[part["type"]])
+            elif isinstance(part, str):
+                leaves.add(content, i)
+
+
+def collect(messages):
+    """Relève les feuilles texte de tous les messages."""
+    leaves = Leaves()
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        _add_content(message, leaves)
+        leaves.add(message, "name")
+        for call in message.get("tool_calls") or []:
+            if isinstance(call, dict):
+                _add_arguments(call.get("function"), leaves)
+        _add_arguments(message.get("function_call"), leaves)
+    return leaves
@@ -0,0 +1,17 @@
+"""
+Configuration Gunicorn du stub LLM
+
+Worker gevent: chaque réponse attend volontairement (latence simulée), des milliers
+de requêtes en vol doivent tenir dans un seul processus sans fausser les mesures.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+worker_class = "gevent"
+workers = int(os.getenv("STUB_WORKERS", "1"))
+worker_connections = int(os.getenv("STUB_WORKER_CONNECTIONS", "5000"))
+backlog = 2048
+
+timeout = 120
+keepalive = 30
@@ -0,0 +1,301 @@
+"""
+Générateur de charge de bout en bout pour /v1/chat/completions
+
+Chaque utilisateur virtuel enchaîne des conversations multi-tours réalistes (historique
+renvoyé à chaque tour, prompt système commun, PII et secrets dans une partie des messages)
+et mesure la latence, le temps jusqu'au premier token (requêtes stream) et les erreurs.
+
+Usage:
+    python loadgen.py --url http://localhost --concurrency 50 --duration 60
+    python loadgen.py --url http://gateway:4000 --requests 500 --stream-ratio 1 --json report.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant for the platform team. Answer concisely, "
+    "never repeat credentials and format code in markdown blocks."
+)
+NAMES = ["John Smith", "Alice Martin", "Marie Dupont", "Carlos Garcia", "Wei Chen", "Fatima Okafor"]
+TOPICS = ["the deployment pipeline", "our billing export", "the login timeout", "the nightly backup", "rate limits"]
+ALNUM = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+def _token(rng, length):
+    return ''.join(rng.choice(ALNUM) for _ in range(length))
+
+
+def user_message(rng, turn):
+    """Message utilisateur réaliste: prose, code avec clé, logs, ou question de suivi."""
+    name = rng.choice(NAMES)
+    topic = rng.choice(TOPICS)
+    kind = rng.choice(["prose", "prose", "code", "logs", "followup"] if turn else ["prose", "code", "logs"])
+    if kind == "prose":
+        email = name.lower().replace(" ", ".") + "@example.com"
+        return (f"Hi, {name} asked me to look into {topic}. Can you summarize what could go wrong "
+                f"and draft a short reply to {email}? Their phone is 06 12 34 56 {rng.randint(10, 99)}.")
+    if kind == "code":
+        return ("Why does this fail with a 401?\n```python\nimport openai\n"
+                f"client = openai.OpenAI(api_key=\"sk-{_token(rng, 40)}\")\n"
+                "resp = client.chat.completions.create(model='gpt-4', messages=msgs)\n```")
+    if kind == "logs":
+        lines = [
+            f"2024-05-{rng.randint(1, 28):02d}T10:{rng.randint(0, 59):02d}:00Z ERROR upstream={topic.split()[-1]} "
+            f"status=502 latency_ms={rng.randint(100, 9000)} user={name.split()[0].lower()}"
+            for _ in range(rng.randint(3, 12))
+        ]
+        return "Here are the logs from this morning, what is the root cause?\n" + "\n".join(lines)
+    return rng.choice([
+        "Thanks. Can you make it shorter?",
+        f"What would you check first regarding {topic}?",
+        "Can you give me the exact commands?",
+        f"Please rewrite it so that {name.split()[0]} can understand it without context.",
+    ])
+
+
+class Result:
+    """Mesure d'une requête."""
+
+    __slots__ = ("latency", "ttft", "error", "tokens", "stream", "content")
+
+    def __init__(self, latency, ttft=None, error=None, tokens=0, stream=False, content=""):
+        self.latency = latency
+        self.ttft = ttft
+        self.error = error
+        self.tokens = tokens
+        self.stream = stream
+        self.content = content
+
+
+def send(session, url, payload, timeout):
+    """Envoie une requête de complétion et la mesure (les erreurs sont catégorisées, jamais levées)."""
+    stream = bool(payload.get("stream"))
+    start = time.perf_counter()
+    try:
+        response = session.post(f"{url}/v1/chat/completions", json=payload, stream=stream, timeout=timeout)
+    except requests.exceptions.Timeout:
+        return Result(time.perf_counter() - start, error="timeout", stream=stream)
+    except requests.exceptions.ConnectionError:
+        return Result(time.perf_counter() - start, error="connection_error", stream=stream)
+
+    with response:
+        if response.status_code != 200:
+            response.content  # consomme le corps pour réutiliser la connexion
+            return Result(time.perf_counter() - start, error=f"http_{response.status_code}", stream=stream)
+
+        if not stream:
+            try:
+                body = response.json()
+                content = body["choices"][0]["message"]["content"] or ""
+                tokens = body.get("usage", {}).get("completion_tokens") or len(content.split())
+            except (ValueError, KeyError, IndexError, TypeError):
+                return Result(time.perf_counter() - start, error="invalid_response")
+            latency = time.perf_counter() - start
+            return Result(latency, ttft=latency, tokens=tokens, content=content)
+
+        ttft = None
+        parts = []
+        done = False
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    done = True
+                    break
+                try:
+                    delta = json.loads(data)["choices"][0].get("delta", {})
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if delta.get("content"):
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    parts.append(delta["content"])
+        except (requests.exceptions.RequestException, ValueError):
+            done = False
+        latency = time.perf_counter() - start
+        if not done:
+            return Result(latency, ttft=ttft, error="stream_interrupted", stream=True)
+        return Result(latency, ttft=ttft, tokens=len(parts), stream=True, content="".join(parts))
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Stats:
+    """Agrégation thread-safe des résultats."""
+
+    def __init__(self):
+        self.results = []
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        with self._lock:
+            self.results.append(result)
+
+    def summary(self, elapsed):
+        with self._lock:
+            results = list(self.results)
+        ok = [r for r in results if r.error is None]
+        errors = {}
+        for r in results:
+            if r.error:
+                errors[r.error] = errors.get(r.error, 0) + 1
+
+        def distribution(values):
+            return {
+                "p50_ms": _ms(percentile(values, 0.50)),
+                "p95_ms": _ms(percentile(values, 0.95)),
+                "p99_ms": _ms(percentile(values, 0.99)),
+                "max_ms": _ms(max(values) if values else None),
+            }
+
+        return {
+            "duration_s": round(elapsed, 3),
+            "requests": len(results),
+            "ok": len(ok),
+            "errors": len(results) - len(ok),
+            "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            "completion_tokens_per_s": round(sum(r.tokens for r in ok) / elapsed, 1) if elapsed else 0.0,
+            "latency": distribution([r.latency for r in ok]),
+            "ttft": distribution([r.ttft for r in ok if r.stream and r.ttft is not None]),
+            "error_breakdown": dict(sorted(errors.items(), key=lambda item: -item[1])),
+        }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class LoadTest:
+    """Utilisateurs virtuels concurrents jusqu'à la durée ou au nombre de requêtes demandés."""
+
+    def __init__(self, url, concurrency=10, duration=30.0, max_requests=0, model="gpt-3.5-turbo",
+                 stream_ratio=0.5, min_turns=2, max_turns=6, timeout=60.0, seed=42, api_key=None):
+        self.url = url.rstrip("/")
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.model = model
+        self.stream_ratio = stream_ratio
+        self.min_turns = min_turns
+        self.max_turns = max_turns
+        self.timeout = timeout
+        self.seed = seed
+        self.api_key = api_key
+        self.stats = Stats()
+        self._sent = 0
+        self._lock = threading.Lock()
+        self._deadline = None
+
+    def _next_request(self):
+        """Réserve un créneau de requête; False quand la durée ou le quota est atteint."""
+        if self.duration and time.perf_counter() >= self._deadline:
+            return False
+        with self._lock:
+            if self.max_requests and self._sent >= self.max_requests:
+                return False
+            self._sent += 1
+            return True
+
+    def virtual_user(self, index):
+        rng = random.Random(f"{self.seed}:{index}")
+        session = requests.Session()
+        if self.api_key:
+            session.headers["Authorization"] = f"Bearer {self.api_key}"
+        try:
+            while True:
+                messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+                for turn in range(rng.randint(self.min_turns, self.max_turns)):
+                    if not self._next_request():
+                        return
+                    messages.append({"role": "user", "content": user_message(rng, turn)})
+                    payload = {"model": self.model, "messages": messages, "stream": rng.random() < self.stream_ratio}
+                    result = send(session, self.url, payload, self.timeout)
+                    self.stats.add(result)
+                    if result.error:
+                        break  # l'utilisateur abandonne la conversation et en recommence une
+                    messages.append({"role": "assistant", "content": result.content})
+        finally:
+            session.close()
+
+    def run(self):
+        start = time.perf_counter()
+        self._deadline = start + self.duration if self.duration else None
+        threads = [
+            threading.Thread(target=self.virtual_user, args=(i,), name=f"vu-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.stats.summary(time.perf_counter() - start)
+
+
+def format_summary(summary):
+    latency, ttft = summary["latency"], summary["ttft"]
+    lines = [
+        f"Requests:   {summary['requests']} ({summary['ok']} ok, {summary['errors']} errors) "
+        f"in {summary['duration_s']}s",
+        f"Throughput: {summary['throughput_rps']} req/s, {summary['completion_tokens_per_s']} completion tokens/s",
+        f"Latency:    p50 {latency['p50_ms']}ms  p95 {latency['p95_ms']}ms  p99 {latency['p99_ms']}ms  "
+        f"max {latency['max_ms']}ms",
+        f"TTFT:       p50 {ttft['p50_ms']}ms  p95 {ttft['p95_ms']}ms  p99 {ttft['p99_ms']}ms  (stream requests)",
+    ]
+    if summary["error_breakdown"]:
+        lines.append("Errors:     " + ", ".join(f"{k}: {v}" for k, v in summary["error_breakdown"].items()))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load generator for /v1/chat/completions")
+    parser.add_argument("--url", default=os.getenv("LOADTEST_URL", "http://localhost"),
+                        help="Base URL (nginx, gateway or LiteLLM)")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run (0 = until --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0 = no limit)")
+    parser.add_argument("--model", default=os.getenv("LOADTEST_MODEL", "gpt-3.5-turbo"))
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="Share of stream: true requests")
+    parser.add_argument("--min-turns", type=int, default=2)
+    parser.add_argument("--max-turns", type=int, default=6)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--api-key", default=os.getenv("LOADTEST_API_KEY"))
+    parser.add_argument("--json", metavar="PATH", help="Also write the summary as JSON")
+    args = parser.parse_args(argv)
+
+    if not args.duration and not args.requests:
+        parser.error("--duration 0 requires --requests")
+
+    test = LoadTest(
+        args.url, concurrency=args.concurrency, duration=args.duration, max_requests=args.requests,
+        model=args.model, stream_ratio=args.stream_ratio, min_turns=args.min_turns, max_turns=args.max_turns,
+        timeout=args.timeout, seed=args.seed, api_key=args.api_key,
+    )
+    print(f"🚀 {args.concurrency} virtual users against {test.url} "
+          f"({args.duration or '∞'}s, {args.requests or '∞'} requests)", file=sys.stderr)
+    summary = test.run()
+    print(format_summary(summary))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+            f.write("\n")
+    return 0 if summary["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
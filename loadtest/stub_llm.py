@@ -0,0 +1,152 @@
+"""
+Stub LLM - Serveur compatible OpenAI pour les tests de charge
+
+Remplace les vrais fournisseurs derrière LiteLLM (ou directement derrière le Gateway):
+aucune requête payante, des temps de réponse contrôlés.
+
+Configuration (variables d'environnement):
+- STUB_LATENCY_MS / STUB_LATENCY_JITTER_MS: délai avant le premier token (loi normale)
+- STUB_TOKENS_PER_SEC: débit de génération des tokens (0 = instantané)
+- STUB_COMPLETION_TOKENS: longueur des réponses (plafonnée par max_tokens)
+- STUB_ERROR_RATE: proportion de requêtes en erreur (0.0 - 1.0)
+- STUB_ERROR_STATUSES: codes HTTP tirés au sort pour les erreurs (ex: "500,429,503")
+"""
+import json
+import logging
+import os
+import random
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "300"))
+LATENCY_JITTER_MS = float(os.getenv("STUB_LATENCY_JITTER_MS", "50"))
+TOKENS_PER_SEC = float(os.getenv("STUB_TOKENS_PER_SEC", "50"))
+COMPLETION_TOKENS = int(os.getenv("STUB_COMPLETION_TOKENS", "64"))
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+ERROR_STATUSES = [int(s) for s in os.getenv("STUB_ERROR_STATUSES", "500").split(",") if s.strip()]
+MODELS = [m.strip() for m in os.getenv(
+    "STUB_MODELS", "gpt-3.5-turbo,gpt-4,claude-3-haiku,claude-3-sonnet,gemini-pro"
+).split(",") if m.strip()]
+
+WORDS = (
+    "sure here is a short answer based on the context you provided the main points are listed "
+    "below and you can ask for more details about any of them if something is unclear"
+).split()
+
+
+def first_token_delay():
+    """Délai avant le premier token, en secondes."""
+    return max(0.0, random.gauss(LATENCY_MS, LATENCY_JITTER_MS)) / 1000
+
+
+def token_delay():
+    return 1 / TOKENS_PER_SEC if TOKENS_PER_SEC > 0 else 0.0
+
+
+def completion_tokens(data):
+    """Tokens de la réponse (un mot = un token), plafonnés par max_tokens."""
+    count = COMPLETION_TOKENS
+    if isinstance(data.get("max_tokens"), int) and data["max_tokens"] > 0:
+        count = min(count, data["max_tokens"])
+    return [(" " if i else "") + WORDS[i % len(WORDS)] for i in range(count)]
+
+
+def prompt_tokens(messages):
+    return sum(len(str(m.get("content", "")).split()) for m in messages if isinstance(m, dict))
+
+
+def injected_error():
+    """Réponse d'erreur si la requête est tirée au sort, sinon None."""
+    if ERROR_RATE <= 0 or random.random() >= ERROR_RATE:
+        return None
+    status = random.choice(ERROR_STATUSES)
+    return jsonify({"error": {"message": "Injected stub error", "type": "stub_error", "code": status}}), status
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({
+        "status": "healthy",
+        "service": "stub-llm",
+        "latency_ms": LATENCY_MS,
+        "tokens_per_sec": TOKENS_PER_SEC,
+        "error_rate": ERROR_RATE
+    })
+
+
+@app.route('/v1/models', methods=['GET'])
+@app.route('/models', methods=['GET'])
+def models():
+    return jsonify({
+        "object": "list",
+        "data": [{"id": name, "object": "model", "owned_by": "stub"} for name in MODELS]
+    })
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+@app.route('/chat/completions', methods=['POST'])
+def chat_completions():
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get("messages"), list):
+        return jsonify({"error": {"message": "Missing 'messages'", "type": "invalid_request_error"}}), 400
+
+    error = injected_error()
+    if error is not None:
+        return error
+
+    model = data.get("model", MODELS[0] if MODELS else "stub")
+    tokens = completion_tokens(data)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    usage = {
+        "prompt_tokens": prompt_tokens(data["messages"]),
+        "completion_tokens": len(tokens),
+        "total_tokens": prompt_tokens(data["messages"]) + len(tokens)
+    }
+
+    if data.get("stream"):
+        def generate():
+            time.sleep(first_token_delay())
+            delay = token_delay()
+            for i, token in enumerate(tokens):
+                if i and delay:
+                    time.sleep(delay)
+                delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return Response(generate(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+    time.sleep(first_token_delay() + token_delay() * max(0, len(tokens) - 1))
+    return jsonify({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(tokens)},
+            "finish_reason": "stop"
+        }],
+        "usage": usage
+    })
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.getenv("PORT", "8000")), threaded=True)
@@ -0,0 +1,69 @@
+"""
+Unit Tests for the load generator (against a local stub LLM)
+"""
+import random
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import loadgen
+import stub_llm
+
+
+@pytest.fixture
+def stub_url(monkeypatch):
+    monkeypatch.setattr(stub_llm, 'LATENCY_MS', 5)
+    monkeypatch.setattr(stub_llm, 'LATENCY_JITTER_MS', 0)
+    monkeypatch.setattr(stub_llm, 'TOKENS_PER_SEC', 0)
+    monkeypatch.setattr(stub_llm, 'COMPLETION_TOKENS', 8)
+    server = make_server('127.0.0.1', 0, stub_llm.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+class TestLoadGenerator:
+    """Tests for the virtual users, measurements and report."""
+
+    def test_run_by_request_count(self, stub_url):
+        summary = loadgen.LoadTest(stub_url, concurrency=4, duration=0, max_requests=20, stream_ratio=0.5).run()
+        assert summary['requests'] == 20
+        assert summary['ok'] == 20
+        assert summary['latency']['p50_ms'] >= 5
+        assert summary['ttft']['p50_ms'] is not None
+        assert summary['completion_tokens_per_s'] > 0
+
+    def test_error_breakdown(self, stub_url, monkeypatch):
+        monkeypatch.setattr(stub_llm, 'ERROR_RATE', 1.0)
+        monkeypatch.setattr(stub_llm, 'ERROR_STATUSES', [503])
+        summary = loadgen.LoadTest(stub_url, concurrency=2, duration=0, max_requests=6).run()
+        assert summary['error_breakdown'] == {'http_503': 6}
+        assert summary['error_rate'] == 1.0
+
+    def test_connection_errors_are_counted(self):
+        summary = loadgen.LoadTest('http://127.0.0.1:9', concurrency=1, duration=0, max_requests=2).run()
+        assert summary['error_breakdown'] == {'connection_error': 2}
+
+    def test_conversations_are_multi_turn(self, stub_url, monkeypatch):
+        sizes = []
+        original = loadgen.send
+
+        def spy(session, url, payload, timeout):
+            sizes.append(len(payload['messages']))
+            return original(session, url, payload, timeout)
+        monkeypatch.setattr(loadgen, 'send', spy)
+        loadgen.LoadTest(stub_url, concurrency=1, duration=0, max_requests=4, min_turns=4, max_turns=4).run()
+        assert sizes == [2, 4, 6, 8]  # système + (user, assistant) * tour
+
+    def test_messages_are_reproducible(self):
+        assert loadgen.user_message(random.Random(1), 0) == loadgen.user_message(random.Random(1), 0)
+
+    def test_format_summary(self):
+        stats = loadgen.Stats()
+        stats.add(loadgen.Result(0.1, ttft=0.02, tokens=10, stream=True))
+        stats.add(loadgen.Result(0.5, error='timeout'))
+        text = loadgen.format_summary(stats.summary(1.0))
+        assert 'Errors:     timeout: 1' in text
+        assert 'TTFT:       p50 20.0ms' in text
@@ -0,0 +1,59 @@
+"""
+Unit Tests for the stub LLM server
+"""
+import json
+
+import pytest
+
+import stub_llm
+from stub_llm import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(stub_llm, 'LATENCY_MS', 0)
+    monkeypatch.setattr(stub_llm, 'LATENCY_JITTER_MS', 0)
+    monkeypatch.setattr(stub_llm, 'TOKENS_PER_SEC', 0)
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+MESSAGES = [{'role': 'user', 'content': 'hello there'}]
+
+
+class TestStubCompletions:
+    """Tests for the OpenAI-compatible endpoints."""
+
+    def test_models(self, client):
+        response = client.get('/v1/models')
+        assert 'gpt-3.5-turbo' in [m['id'] for m in response.json['data']]
+
+    def test_completion(self, client):
+        response = client.post('/v1/chat/completions', json={'model': 'gpt-4', 'messages': MESSAGES})
+        assert response.status_code == 200
+        assert response.json['model'] == 'gpt-4'
+        assert response.json['choices'][0]['message']['content']
+        assert response.json['usage']['prompt_tokens'] == 2
+
+    def test_max_tokens_caps_completion(self, client):
+        response = client.post('/v1/chat/completions', json={'messages': MESSAGES, 'max_tokens': 3})
+        assert response.json['usage']['completion_tokens'] == 3
+
+    def test_stream(self, client):
+        response = client.post('/v1/chat/completions', json={'messages': MESSAGES, 'stream': True, 'max_tokens': 4})
+        assert response.mimetype == 'text/event-stream'
+        events = [line[6:] for line in response.get_data(as_text=True).split('\n\n') if line]
+        assert events[-1] == '[DONE]'
+        chunks = [json.loads(e) for e in events[:-1]]
+        assert ''.join(c['choices'][0]['delta'].get('content', '') for c in chunks) == 'sure here is a'
+        assert chunks[-1]['choices'][0]['finish_reason'] == 'stop'
+
+    def test_injected_errors(self, client, monkeypatch):
+        monkeypatch.setattr(stub_llm, 'ERROR_RATE', 1.0)
+        monkeypatch.setattr(stub_llm, 'ERROR_STATUSES', [429])
+        response = client.post('/v1/chat/completions', json={'messages': MESSAGES})
+        assert response.status_code == 429
+
+    def test_missing_messages(self, client):
+        assert client.post('/v1/chat/completions', json={}).status_code == 400